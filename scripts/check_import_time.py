@@ -0,0 +1,79 @@
+"""Check the import time of the CLI entry points against a budget.
+
+Usage: python scripts/check_import_time.py [--budget-ms MS] [--runs N]
+
+Each module is imported in a fresh interpreter with '-X importtime', the best of
+N runs is compared with its budget, and the CLI module must not import any of the
+heavy dependencies (they are imported by the commands which need them).
+"""
+
+import argparse
+import subprocess
+import sys
+
+
+# Module, budget in milliseconds (cumulative import time)
+MODULES = [
+    ('fvc.tools.cli', 100),
+    ('fvc.tools.calc.main', 100),
+    ('fvc.tools.df.main', 250)
+]
+
+# Not to be imported at CLI startup
+HEAVY_MODULES = ['boto3', 'botocore', 'pandas', 'scipy', 'numpy', 'jsonschema', 'yaml', 'pygments', 'pygeodesy', 'pyarrow']
+
+
+def import_times(module: str) -> dict[str, int]:
+    # Cumulative import times in microseconds of the modules imported by 'module'
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True
+    )
+
+    times = {}
+
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, help='Override the budget of the CLI module')
+    parser.add_argument('--runs', type=int, default=5, help='Runs per module, the best one counts')
+    args = parser.parse_args()
+
+    failures = []
+
+    for module, budget in MODULES:
+        if module == 'fvc.tools.cli' and args.budget_ms:
+            budget = args.budget_ms
+
+        runs = [import_times(module) for _ in range(args.runs)]
+        best = min(times[module] for times in runs) / 1000
+        status = 'ok' if best <= budget else 'OVER BUDGET'
+        print(f'{module}: {best:.1f} ms (budget {budget} ms) {status}')
+
+        if best > budget:
+            failures.append(f'{module} takes {best:.1f} ms, the budget is {budget} ms')
+
+        if module == 'fvc.tools.cli':
+            imported = {name.split('.')[0] for name in runs[0]}
+
+            for heavy in HEAVY_MODULES:
+                if heavy in imported:
+                    failures.append(f'{module} imports {heavy}')
+
+    for failure in failures:
+        print(f'FAIL: {failure}', file=sys.stderr)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
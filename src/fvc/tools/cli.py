@@ -2,15 +2,16 @@ import logging as lg
 from argparse import ArgumentParser
 import traceback
 
-import boto3
 import click
 
-import fvc.tools.calc.main
-import fvc.tools.df
-import fvc.tools.calc
+from fvc.tools.util import LazyGroup
 
 
-@click.group(help='Flyvercity CLI tools suite')
+# Command groups are imported when invoked: most of the startup time is in their dependencies
+@click.group(
+    cls=LazyGroup, help='Flyvercity CLI tools suite',
+    lazy_commands={'df': 'fvc.tools.df.main:df', 'calc': 'fvc.tools.calc.main:calc'}
+)
 @click.pass_context
 @click.option('--verbose', is_flag=True, help='sets logging level to debug')
 @click.option('--json', is_flag=True, help='Make JSON default output format instead of free form')
@@ -36,6 +37,7 @@ def cli(ctx, verbose, json, no_pprint, aws_profile, egm):
 
     if aws_profile:
         lg.debug(f'Using AWS profile: {aws_profile}')
+        import boto3
         boto3.setup_default_session(profile_name=aws_profile)
 
 
@@ -58,10 +60,6 @@ def pwsh():
     ))
 
 
-cli.add_command(fvc.tools.df.df)
-cli.add_command(fvc.tools.calc.calc)
-
-
 def main():
     try:
         cli()
@@ -1 +1,7 @@
-from fvc.tools.df.main import df  # noqa
+def __getattr__(name):
+    # The command group is imported on demand, so importing a df module does not import them all
+    if name == 'df':
+        from fvc.tools.df.main import df
+        return df
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,371 @@
+from pathlib import Path
+from contextlib import contextmanager
+import json
+import logging as lg
+import os
+import re
+import time
+
+import click
+
+from fvc.tools.util import JSON, json_print
+
+
+META_SUFFIX = '.fvcmeta'
+LOCK_SUFFIX = '.lock'
+TEMP_SUFFIX = '.tmp'
+STATS_NAME = '.fvc-cache-stats.json'
+GLOBAL_LOCK_NAME = '.fvc-cache.lock'
+STALE_TEMP_SECONDS = 24 * 3600
+
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', re.IGNORECASE)
+
+
+def parse_size(size: str | int | None) -> int | None:
+    if size is None or size == '':
+        return None
+
+    if isinstance(size, int):
+        return size
+
+    if not (match := SIZE_PATTERN.match(size)):
+        raise UserWarning(f'Invalid cache size: {size} (use e.g. 500M or 20G)')
+
+    return int(float(match[1]) * SIZE_UNITS[match[2].upper()])
+
+
+@contextmanager
+def file_lock(lock_path: Path, blocking=True):
+    # Advisory lock held on a separate lock file, so data files can be renamed over
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with lock_path.open('a+b') as f:
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)  # type: ignore
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))  # type: ignore
+
+        except OSError:
+            if blocking:
+                raise
+
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)  # type: ignore
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)  # type: ignore
+
+
+def write_json(path: Path, data: JSON):
+    temp_path = path.with_name(f'{path.name}.{os.getpid()}{TEMP_SUFFIX}')
+    temp_path.write_text(json.dumps(data, indent=1, sort_keys=True))
+    os.replace(temp_path, path)
+
+
+def read_json(path: Path) -> JSON | None:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def head_entry(head) -> JSON:
+    return {
+        'etag': head['ETag'],
+        'size': head['ContentLength'],
+        'mtime_ns': int(head['LastModified'].timestamp()) * 1_000_000_000
+    }
+
+
+# S3 objects cached as <cache_dir>/<bucket>/<key>, each with a metadata file next to it
+# (ETag, size, last access). A data file without a matching metadata file is never trusted:
+# the metadata file is written only after the data file is complete and renamed in place.
+class S3Cache:
+    def __init__(self, cache_dir: Path, max_size: int | None = None):
+        self.cache_dir = cache_dir.resolve()
+        self.max_size = max_size
+
+    def path_for(self, bucket: str, key: str) -> Path:
+        return (self.cache_dir / bucket / key).resolve()
+
+    @staticmethod
+    def meta_path(path: Path) -> Path:
+        return path.with_name(path.name + META_SUFFIX)
+
+    @staticmethod
+    def lock_path(path: Path) -> Path:
+        return path.with_name(path.name + LOCK_SUFFIX)
+
+    def lock(self, path: Path, blocking=True):
+        return file_lock(self.lock_path(path), blocking)
+
+    def is_valid(self, path: Path, head: JSON | None) -> bool:
+        meta = read_json(self.meta_path(path))
+
+        if not meta or not path.exists():
+            return False
+
+        if path.stat().st_size != meta.get('size'):
+            lg.warning(f'Cached file {path} has an unexpected size, discarding')
+            return False
+
+        # Without a HEAD response (offline), the recorded size is the only check
+        return head is None or (meta.get('etag'), meta.get('size')) == (head['etag'], head['size'])
+
+    def touch(self, path: Path):
+        meta_path = self.meta_path(path)
+
+        if meta := read_json(meta_path):
+            meta['accessed'] = time.time()
+            write_json(meta_path, meta)
+
+    def commit(self, path: Path, temp_path: Path, head: JSON):
+        # Called with the key lock held, 'temp_path' holds the complete object
+        if temp_path.stat().st_size != head['size']:
+            temp_path.unlink(missing_ok=True)
+            raise UserWarning(f'Incomplete download of {path.name}, expected {head["size"]} bytes')
+
+        os.utime(temp_path, ns=(head['mtime_ns'], head['mtime_ns']))
+        self.meta_path(path).unlink(missing_ok=True)
+        os.replace(temp_path, path)
+        now = time.time()
+        write_json(self.meta_path(path), {**head, 'cached': now, 'accessed': now})
+
+    def temp_path(self, path: Path) -> Path:
+        return path.with_name(f'{path.name}.{os.getpid()}{TEMP_SUFFIX}')
+
+    def fetch(self, s3, bucket: str, key: str, callback=None) -> Path:
+        path = self.path_for(bucket, key)
+        head = self.head(s3, bucket, key)
+
+        with self.lock(path):
+            # Checked again with the lock held: another process may just have fetched it
+            if self.is_valid(path, head):
+                lg.info(f'Using cached file: {path}')
+                self.touch(path)
+                self.record(hits=1)
+                return path
+
+            if head is None:
+                raise UserWarning(f'Unable to reach s3://{bucket}/{key} and no valid cached copy')
+
+            lg.info(f'Fetching to {path}')
+            temp_path = self.temp_path(path)
+
+            try:
+                s3.download_file(bucket, key, str(temp_path), Callback=callback)
+
+                # download_file does not support IfMatch: detect an object replaced meanwhile
+                if self.head(s3, bucket, key) != head:
+                    raise UserWarning(f's3://{bucket}/{key} changed during the download, try again')
+
+                self.commit(path, temp_path, head)
+
+            finally:
+                temp_path.unlink(missing_ok=True)
+
+        self.record(misses=1, downloaded=head['size'])
+        self.evict(keep=path)
+        return path
+
+    def head(self, s3, bucket: str, key: str) -> JSON | None:
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            return head_entry(s3.head_object(Bucket=bucket, Key=key))
+
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ['404', 'NoSuchKey']:
+                raise UserWarning(f'No such object: s3://{bucket}/{key}')
+
+            raise
+
+        except BotoCoreError as e:
+            # No network or no credentials: a complete cached copy is still usable
+            lg.warning(f'Unable to check s3://{bucket}/{key} ({e}), trying the cache')
+            return None
+
+    def store(self, path: Path, temp_path: Path, head: JSON):
+        # A streamed download completed in 'temp_path'
+        with self.lock(path):
+            self.commit(path, temp_path, head)
+
+        self.record(misses=1, downloaded=head['size'])
+        self.evict(keep=path)
+
+    def entries(self) -> list[JSON]:
+        entries = []
+
+        for meta_path in self.cache_dir.rglob(f'*{META_SUFFIX}'):
+            path = meta_path.with_name(meta_path.name.removesuffix(META_SUFFIX))
+
+            if (meta := read_json(meta_path)) and path.exists():
+                entries.append({'path': path, 'size': meta.get('size', 0), 'accessed': meta.get('accessed', 0)})
+
+        return entries
+
+    def remove(self, path: Path) -> bool:
+        # Entries being fetched by another process (locked) are kept
+        with self.lock(path, blocking=False) as locked:
+            if not locked:
+                return False
+
+            self.meta_path(path).unlink(missing_ok=True)
+            path.unlink(missing_ok=True)
+
+        # The lock file stays: another process may be waiting on it
+        return True
+
+    def evict(self, max_size: int | None = None, keep: Path | None = None) -> JSON:
+        # Least recently used entries first, until the cache fits into the budget
+        max_size = self.max_size if max_size is None else max_size
+        result = {'evicted': 0, 'freed': 0}
+
+        if max_size is None:
+            return result
+
+        entries = sorted(self.entries(), key=lambda e: e['accessed'])
+        total = sum(e['size'] for e in entries)
+
+        for entry in entries:
+            if total <= max_size:
+                break
+
+            if entry['path'] == keep:
+                continue
+
+            if self.remove(entry['path']):
+                lg.debug(f'Evicted {entry["path"]} from the cache')
+                total -= entry['size']
+                result['evicted'] += 1
+                result['freed'] += entry['size']
+
+        if total > max_size:
+            lg.warning(f'Cache size {total} bytes is still over the budget of {max_size} bytes')
+
+        if result['evicted']:
+            self.record(evictions=result['evicted'])
+
+        return result
+
+    def remove_leftovers(self) -> int:
+        # Temporary files of interrupted downloads, and data files without metadata
+        removed = 0
+        now = time.time()
+
+        for path in self.cache_dir.rglob('*'):
+            if not path.is_file() or path.name in [STATS_NAME, GLOBAL_LOCK_NAME]:
+                continue
+
+            if path.name.endswith(TEMP_SUFFIX):
+                if now - path.stat().st_mtime > STALE_TEMP_SECONDS:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+
+            elif not path.name.endswith((META_SUFFIX, LOCK_SUFFIX)) and not self.meta_path(path).exists():
+                with self.lock(path, blocking=False) as locked:
+                    if locked:
+                        path.unlink(missing_ok=True)
+                        removed += 1
+
+        return removed
+
+    def record(self, **counters: int):
+        stats_path = self.cache_dir / STATS_NAME
+
+        try:
+            with file_lock(self.cache_dir / GLOBAL_LOCK_NAME):
+                stats = read_json(stats_path) or {}
+
+                for name, value in counters.items():
+                    stats[name] = stats.get(name, 0) + value
+
+                write_json(stats_path, stats)
+
+        except OSError as e:
+            lg.debug(f'Unable to update cache statistics: {e}')
+
+    def stats(self) -> JSON:
+        stats = read_json(self.cache_dir / STATS_NAME) or {}
+        entries = self.entries()
+        hits = stats.get('hits', 0)
+        misses = stats.get('misses', 0)
+
+        return {
+            'directory': str(self.cache_dir),
+            'entries': len(entries),
+            'size': sum(e['size'] for e in entries),
+            'max_size': self.max_size,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+            'downloaded': stats.get('downloaded', 0),
+            'evictions': stats.get('evictions', 0)
+        }
+
+
+def open_cache(params) -> S3Cache:
+    cache_dir = params.get('cache_dir')
+
+    if not cache_dir:
+        raise UserWarning('Cache directory should be specified for external data')
+
+    cache_dir_path = Path(cache_dir)
+    cache_dir_path.mkdir(parents=True, exist_ok=True)
+    return S3Cache(cache_dir_path, parse_size(params.get('cache_size')))
+
+
+@click.group(help='Inspect and prune the cache of external data')
+def cache():
+    pass
+
+
+@cache.command(help='Show cache size, usage and hit rate')
+@click.pass_obj
+def info(params):
+    stats = open_cache(params).stats()
+
+    if params['JSON']:
+        json_print(params, stats)
+        return
+
+    hit_rate = f'{100 * stats["hit_rate"]:.1f}%' if stats['hit_rate'] is not None else 'n/a'
+    max_size = stats['max_size'] if stats['max_size'] is not None else 'unlimited'
+    lg.info(f'Cache directory: {stats["directory"]}')
+    lg.info(f'Entries: {stats["entries"]}, size: {stats["size"]} bytes (budget: {max_size})')
+    lg.info(f'Hits: {stats["hits"]}, misses: {stats["misses"]}, hit rate: {hit_rate}')
+    lg.info(f'Downloaded: {stats["downloaded"]} bytes, evictions: {stats["evictions"]}')
+
+
+@cache.command(help='Evict least recently used entries and remove leftovers of interrupted downloads')
+@click.pass_obj
+@click.option('--max-size', help='Size to prune to, e.g. 500M (default: the cache budget)')
+@click.option('--all', 'prune_all', is_flag=True, help='Remove all entries not in use')
+def prune(params, max_size, prune_all):
+    s3_cache = open_cache(params)
+    max_size = 0 if prune_all else parse_size(max_size)
+
+    if max_size is None and s3_cache.max_size is None:
+        raise UserWarning('No cache budget: use --max-size, --all, --cache-size or FVC_CACHE_SIZE')
+
+    result = s3_cache.evict(max_size)
+    result['leftovers'] = s3_cache.remove_leftovers()
+
+    if params['JSON']:
+        json_print(params, result)
+    else:
+        lg.info(
+            f'Evicted {result["evicted"]} entries ({result["freed"]} bytes), '
+            f'removed {result["leftovers"]} leftover files'
+        )
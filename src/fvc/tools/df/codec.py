@@ -0,0 +1,78 @@
+import os
+import json
+import logging as lg
+from json.encoder import JSONEncoder, c_make_encoder, encode_basestring_ascii
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonCodec:
+    name = 'json'
+
+    def __init__(self):
+        # Built once, as json.dumps would do on every call, with json.dumps defaults
+        self._encoder = c_make_encoder and c_make_encoder(
+            None, JSONEncoder().default, encode_basestring_ascii, None,
+            ': ', ', ', False, False, True
+        )
+
+    def encode(self, data) -> str:
+        if self._encoder:
+            return ''.join(self._encoder(data, 0))
+
+        return json.dumps(data)
+
+    def decode(self, line: bytes | str):
+        return json.loads(line)
+
+
+class OrjsonDecodeCodec(JsonCodec):
+    # Output is still produced by the stdlib encoder: orjson output is valid but not
+    # byte-compatible with json.dumps (separators, non-ASCII characters, NaN)
+    name = 'orjson-decode'
+
+    def decode(self, line: bytes | str):
+        try:
+            return orjson.loads(line)  # type: ignore
+        except orjson.JSONDecodeError:  # type: ignore
+            # Not supported by orjson, e.g. NaN or very large integers
+            return json.loads(line)
+
+
+class OrjsonCodec(OrjsonDecodeCodec):
+    name = 'orjson'
+
+    def encode(self, data) -> str:
+        return orjson.dumps(data).decode('utf-8')  # type: ignore
+
+
+CODECS = {
+    'json': JsonCodec,
+    'orjson-decode': OrjsonDecodeCodec,
+    'orjson': OrjsonCodec
+}
+
+_default_codec = None
+
+
+def default_codec() -> JsonCodec:
+    # FVC_JSON_CODEC=orjson trades byte-compatible output for speed (compact separators)
+    global _default_codec
+
+    if _default_codec is None:
+        name = os.getenv('FVC_JSON_CODEC', 'orjson-decode' if orjson else 'json')
+
+        if name not in CODECS:
+            raise UserWarning(f'Unknown JSON codec: {name}')
+
+        if name.startswith('orjson') and not orjson:
+            lg.warning(f"JSON codec '{name}' requires 'orjson', using the standard library")
+            name = 'json'
+
+        lg.debug(f'Using JSON codec: {name}')
+        _default_codec = CODECS[name]()
+
+    return _default_codec
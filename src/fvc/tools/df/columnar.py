@@ -0,0 +1,290 @@
+from pathlib import Path
+from typing import Literal
+import json
+
+from fvc.tools.util import JSON
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+METADATA_KEY = b'fvc.metadata'
+EXTRA_COLUMN = 'extra'
+BATCH_SIZE = 1 << 16
+
+# Typed columns for the well-known record fields, anything else goes to the 'extra' column
+INT_COLUMNS = [
+    'time.unix'
+]
+
+STRING_COLUMNS = [
+    'origin',
+    'uaid.int',
+    'uaid.fvc',
+    'uaid.icaohex',
+    'uaid.icaoreg',
+    'uaid.atm',
+    'uaid.ip',
+    'uaid.imei',
+    'uaid.imsi',
+    'cellsig.radio'
+]
+
+FLOAT_COLUMNS = [
+    'pos.loc.lat',
+    'pos.loc.lon',
+    'pos.loc.alt',
+    'pos.loc.amsl',
+    'pos.loc.height',
+    'pos.loc.bear',
+    'pos.loc.elev',
+    'pos.loc.gspeed',
+    'pos.att.roll',
+    'pos.att.pitch',
+    'pos.att.yaw',
+    'cellsig.RSRP',
+    'cellsig.RSRQ',
+    'cellsig.RSSI',
+    'cellsig.SINR'
+]
+
+COLUMNS = INT_COLUMNS + STRING_COLUMNS + FLOAT_COLUMNS
+
+
+def check_pyarrow():
+    if pa is None:
+        raise UserWarning("Columnar FVC files require 'pyarrow' (install 'fvctools[columnar]')")
+
+
+def arrow_schema(metadata: JSON | None = None):
+    check_pyarrow()
+
+    fields = (
+        [pa.field(c, pa.int64()) for c in INT_COLUMNS]
+        + [pa.field(c, pa.string()) for c in STRING_COLUMNS]
+        + [pa.field(c, pa.float64()) for c in FLOAT_COLUMNS]
+        + [pa.field(EXTRA_COLUMN, pa.string())]
+    )
+
+    schema_metadata = {METADATA_KEY: json.dumps(metadata)} if metadata is not None else None
+    return pa.schema(fields, metadata=schema_metadata)
+
+
+def flatten(record: JSON, prefix='', into=None) -> JSON:
+    flat = into if into is not None else {}
+
+    for key, value in record.items():
+        if isinstance(value, dict) and value:
+            flatten(value, f'{prefix}{key}.', flat)
+        else:
+            flat[f'{prefix}{key}'] = value
+
+    return flat
+
+
+def set_path(record: JSON, path: str, value):
+    *parents, leaf = path.split('.')
+
+    for key in parents:
+        record = record.setdefault(key, {})
+
+    record[leaf] = value
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def split_record(record: JSON):
+    # Values of unexpected types stay in 'extra', so the round trip is lossless
+    flat = flatten(record)
+    row = {}
+
+    for column in INT_COLUMNS:
+        if isinstance(flat.get(column), int) and not isinstance(flat[column], bool):
+            row[column] = flat.pop(column)
+
+    for column in STRING_COLUMNS:
+        if isinstance(flat.get(column), str):
+            row[column] = flat.pop(column)
+
+    for column in FLOAT_COLUMNS:
+        if is_number(flat.get(column)):
+            row[column] = float(flat.pop(column))
+
+    if flat:
+        extra = {}
+
+        for path, value in flat.items():
+            set_path(extra, path, value)
+
+        row[EXTRA_COLUMN] = json.dumps(extra)
+
+    return row
+
+
+def merge(target: JSON, source: JSON):
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def join_record(row: JSON) -> JSON:
+    record = {}  # type: JSON
+
+    for column in COLUMNS:
+        if (value := row.get(column)) is not None:
+            set_path(record, column, value)
+
+    if extra := row.get(EXTRA_COLUMN):
+        merge(record, json.loads(extra))
+
+    return record
+
+
+def read_metadata(filepath: Path) -> JSON | None:
+    check_pyarrow()
+    schema_metadata = pq.read_schema(filepath).metadata or {}
+
+    if METADATA_KEY not in schema_metadata:
+        return None
+
+    return json.loads(schema_metadata[METADATA_KEY])
+
+
+def read_columns(filepath: Path, columns: list[str]):
+    check_pyarrow()
+    return pq.read_table(filepath, columns=columns)
+
+
+# Columnar counterpart of JsonlinesIO: the first record written (or read) is the metadata
+# line, kept in the file-level Parquet metadata, and records are flattened into typed columns
+class ParquetIO:
+    def __init__(self, filepath: Path, mode: Literal['r', 'w'], callback=None):
+        check_pyarrow()
+        self._filepath = filepath
+        self._mode = mode
+        self._callback = callback
+        self._file = None
+        self._writer = None
+        self._metadata = None  # type: JSON | None
+        self._rows = []  # type: list[JSON]
+        self._records = None
+        self._in_line_no = 0
+
+    def stat_size(self):
+        return self._filepath.stat().st_size
+
+    def __enter__(self):
+        if self._mode == 'r':
+            self._file = pq.ParquetFile(self._filepath)
+            self._metadata = read_metadata(self._filepath)
+            self._records = self._iterate_records()
+        else:
+            self._file = True
+
+        self._in_line_no = 0
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._mode == 'w' and self._file:
+            self._flush()
+
+            if not self._writer:
+                # Still a valid file with the metadata and no records
+                self._open_writer()
+
+            self._writer.close()  # type: ignore
+
+        self._file = None
+
+    def _check_entered(self):
+        if not self._file:
+            raise UserWarning('Enter context before using the object')
+
+    def _iterate_records(self):
+        num_rows = self._file.metadata.num_rows  # type: ignore
+        row_bytes = self.stat_size() // num_rows if num_rows else 0
+
+        for batch in self._file.iter_batches(batch_size=BATCH_SIZE):  # type: ignore
+            for row in batch.to_pylist():
+                if self._callback:
+                    self._callback(row_bytes)
+
+                yield join_record(row)
+
+    def read(self) -> JSON | None:
+        self._check_entered()
+        self._in_line_no += 1
+
+        if self._in_line_no == 1:
+            return self._metadata
+
+        return next(self._records, None)  # type: ignore
+
+    def in_line_no(self):
+        return self._in_line_no
+
+    def _open_writer(self):
+        self._writer = pq.ParquetWriter(self._filepath, arrow_schema(self._metadata))
+
+    def _flush(self):
+        if not self._rows:
+            return
+
+        if not self._writer:
+            self._open_writer()
+
+        table = pa.Table.from_pylist(self._rows, schema=arrow_schema(self._metadata))
+        self._writer.write_table(table)  # type: ignore
+        self._rows = []
+
+    def write(self, data):
+        self._check_entered()
+
+        if self._metadata is None:
+            self._metadata = data
+            return
+
+        self._rows.append(split_record(data))
+
+        if len(self._rows) >= BATCH_SIZE:
+            self._flush()
+
+    def write_many(self, records):
+        for data in records:
+            self.write(data)
+
+    def write_columns(self, columns: dict[str, list]):
+        # Records given as typed columns (COLUMNS paths to values), written as a batch
+        self._check_entered()
+
+        if self._metadata is None:
+            raise UserWarning('Metadata must be written before records')
+
+        if unknown := set(columns) - set(COLUMNS):
+            raise ValueError(f'Not typed columns: {", ".join(sorted(unknown))}')
+
+        self._flush()
+
+        if not self._writer:
+            self._open_writer()
+
+        schema = arrow_schema(self._metadata)
+        count = len(next(iter(columns.values()), []))
+        arrays = [
+            pa.array(columns[field.name], type=field.type) if field.name in columns else pa.nulls(count, type=field.type)
+            for field in schema
+        ]
+
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=schema))  # type: ignore
+
+    def iterate(self):
+        while data := self.read():
+            yield data
@@ -0,0 +1,249 @@
+from pathlib import Path
+from typing import Literal, NamedTuple
+import gzip
+import io
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Uncompressed size of a frame; frames always end at a line boundary, so each frame can be
+# decompressed and parsed on its own
+FRAME_SIZE = 1 << 20
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+class Frame(NamedTuple):
+    offset: int
+    size: int
+    content_offset: int
+    content_size: int
+
+
+def build_frames(sizes) -> list[Frame]:
+    frames = []
+    offset = 0
+    content_offset = 0
+
+    for size, content_size in sizes:
+        frames.append(Frame(offset, size, content_offset, content_size))
+        offset += size
+        content_offset += content_size
+
+    return frames
+
+
+# Frames are gzip members (a multi-member gzip file is a regular gzip file), each with an
+# extra field 'FV' holding the member size and uncompressed size, like the BGZF 'BC' field
+class GzipFrames:
+    suffix = '.gz'
+    HEADER = struct.Struct('<4s4sBBH2sHII')
+    MAGIC = b'\x1f\x8b\x08\x04'
+    SUBFIELD = b'FV'
+
+    def compress(self, data: bytes) -> bytes:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = compressor.compress(data) + compressor.flush()
+        size = self.HEADER.size + len(deflated) + 8
+        header = self.HEADER.pack(self.MAGIC, b'\0\0\0\0', 0, 255, 12, self.SUBFIELD, 8, size, len(data))
+        return header + deflated + struct.pack('<II', zlib.crc32(data), len(data) & 0xffffffff)
+
+    def decompress(self, frame: bytes) -> bytes:
+        return gzip.decompress(frame)
+
+    def trailer(self, frames: list[Frame]) -> bytes:
+        return b''
+
+    def index(self, f) -> list[Frame] | None:
+        f.seek(0, io.SEEK_END)
+        end = f.tell()
+        offset = 0
+        sizes = []
+
+        while offset < end:
+            f.seek(offset)
+            header = f.read(self.HEADER.size)
+
+            if len(header) < self.HEADER.size:
+                return None
+
+            (magic, _, _, _, xlen, subfield, sublen, size, content_size) = self.HEADER.unpack(header)
+
+            if magic != self.MAGIC or xlen != 12 or subfield != self.SUBFIELD or sublen != 8:
+                # A gzip file from another tool, only readable from the start
+                return None
+
+            sizes.append((size, content_size))
+            offset += size
+
+        return build_frames(sizes) if offset == end else None
+
+    def reader(self, f):
+        return gzip.GzipFile(fileobj=f, mode='rb')
+
+
+# Zstandard seekable format: independent frames followed by a seek table in a skippable
+# frame, see https://github.com/facebook/zstd/blob/dev/contrib/seekable_format/zstd_seekable_compression_format.md
+class ZstdFrames:
+    suffix = '.zst'
+    SKIPPABLE_MAGIC = 0x184D2A5E
+    SEEKABLE_MAGIC = 0x8F92EAB1
+    FOOTER = struct.Struct('<IBI')
+    ENTRY = struct.Struct('<II')
+
+    def __init__(self):
+        check_zstandard()
+        self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, write_content_size=True)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, frame: bytes) -> bytes:
+        return self._decompressor.decompress(frame)
+
+    def trailer(self, frames: list[Frame]) -> bytes:
+        entries = b''.join(self.ENTRY.pack(frame.size, frame.content_size) for frame in frames)
+        footer = self.FOOTER.pack(len(frames), 0, self.SEEKABLE_MAGIC)
+        return struct.pack('<II', self.SKIPPABLE_MAGIC, len(entries) + len(footer)) + entries + footer
+
+    def index(self, f) -> list[Frame] | None:
+        f.seek(0, io.SEEK_END)
+        end = f.tell()
+
+        if end < 8 + self.FOOTER.size:
+            return None
+
+        f.seek(end - self.FOOTER.size)
+        (count, descriptor, magic) = self.FOOTER.unpack(f.read(self.FOOTER.size))
+
+        if magic != self.SEEKABLE_MAGIC or descriptor & 0x83:
+            # Not seekable or with frame checksums, which are not written here
+            return None
+
+        table_size = count * self.ENTRY.size + self.FOOTER.size
+        f.seek(end - table_size - 8)
+        (skippable, frame_size) = struct.unpack('<II', f.read(8))
+
+        if skippable != self.SKIPPABLE_MAGIC or frame_size != table_size:
+            return None
+
+        table = f.read(count * self.ENTRY.size)
+        frames = build_frames(self.ENTRY.iter_unpack(table))
+        return frames if sum(frame.size for frame in frames) == end - table_size - 8 else None
+
+    def reader(self, f):
+        # Skippable frames (the seek table) are skipped by the decompressor
+        return self._decompressor.stream_reader(f, read_across_frames=True)
+
+
+COMPRESSIONS = {
+    '.gz': GzipFrames,
+    '.zst': ZstdFrames
+}
+
+
+def check_zstandard():
+    if zstandard is None:
+        raise UserWarning("Zstandard compressed FVC files require 'zstandard' (install 'fvctools[compression]')")
+
+
+def compression(filepath: Path):
+    if kind := COMPRESSIONS.get(filepath.suffix):
+        return kind()
+
+    return None
+
+
+# Binary output file, cut into line-aligned frames of about FRAME_SIZE uncompressed bytes
+class FramedWriter(io.RawIOBase):
+    def __init__(self, f, frames):
+        super().__init__()
+        self._file = f
+        self._frames = frames
+        self._buffer = bytearray()
+        self._sizes = []  # type: list[tuple[int, int]]
+
+    def writable(self):
+        return True
+
+    def _write_frame(self, data):
+        frame = self._frames.compress(bytes(data))
+        self._file.write(frame)
+        self._sizes.append((len(frame), len(data)))
+
+    def write(self, data) -> int:
+        self._buffer += data
+
+        if len(self._buffer) >= FRAME_SIZE:
+            cut = self._buffer.rfind(b'\n') + 1
+
+            if cut:
+                self._write_frame(self._buffer[:cut])
+                del self._buffer[:cut]
+
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                if self._buffer:
+                    self._write_frame(self._buffer)
+                    self._buffer = bytearray()
+
+                self._file.write(self._frames.trailer(build_frames(self._sizes)))
+
+            finally:
+                self._file.close()
+
+        super().close()
+
+
+def open_compressed(filepath: Path, mode: Literal['r', 'w'], buffer_size=io.DEFAULT_BUFFER_SIZE):
+    frames = compression(filepath)
+
+    if frames is None:
+        raise UserWarning(f'Unknown compression: {filepath}')
+
+    if mode == 'w':
+        return FramedWriter(filepath.open('wb'), frames)
+
+    # Sequential reading does not need the frame index, so it also works on streamed input
+    return io.BufferedReader(frames.reader(filepath.open('rb')), buffer_size)
+
+
+def frame_index(filepath: Path) -> list[Frame] | None:
+    # None if the file has no frame index (e.g. compressed by another tool)
+    frames = compression(filepath)
+
+    if frames is None:
+        return None
+
+    with filepath.open('rb') as f:
+        return frames.index(f)
+
+
+def read_frames(filepath: Path, selected: list[Frame]):
+    # Uncompressed content of the selected frames, each starting at a line boundary
+    frames = compression(filepath)
+
+    if frames is None:
+        raise UserWarning(f'Unknown compression: {filepath}')
+
+    with filepath.open('rb') as f:
+        for frame in selected:
+            f.seek(frame.offset)
+            yield frames.decompress(f.read(frame.size))
+
+
+def content_size(filepath: Path) -> int:
+    # Uncompressed size if it is known without decompressing, the file size otherwise
+    if isinstance(filepath, Path) and (frames := frame_index(filepath)):
+        return sum(frame.content_size for frame in frames)
+
+    return filepath.stat().st_size
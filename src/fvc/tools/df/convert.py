@@ -0,0 +1,35 @@
+from pathlib import Path
+import logging as lg
+import importlib
+
+import fvc.tools.df.util as u
+import fvc.tools.df.metadata as metadata
+import fvc.tools.df.manifest as manifest
+
+
+def do_convert(params, input_path: Path, output_path: Path):
+    try:
+        params['output_path'] = output_path
+
+        x_format = params['x_format']
+
+        lg.debug(f'Using external format module: {x_format}')
+        ext_format_mod = importlib.import_module(f'fvc.tools.df.xformats.{x_format}')
+        lg.debug('Imported external format function')
+        convert_fun = getattr(ext_format_mod, 'convert_to_fvc')
+        meta = metadata.initial_metadata(params)
+
+        with u.open_fvc(output_path, 'w') as io:
+            convert_fun(params, meta, input_path, io)
+
+        lg.info(f'Conversion complete, output written to {output_path}')
+    except ModuleNotFoundError as e:
+        lg.error(f'Error importing external format module: {e}')
+        raise UserWarning(f'Unknown external format: {params["x_format"]}')
+
+
+def do_tracked_convert(params, input_path: Path, output_path: Path, extra=None, checksum=False):
+    # Fingerprint the input before conversion, so a concurrent change makes the output stale
+    fingerprint = manifest.file_fingerprint(input_path, checksum)
+    do_convert(params, input_path, output_path)
+    return manifest.build_entry(params, extra, input_path, fingerprint, output_path)
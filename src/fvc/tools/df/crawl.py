@@ -0,0 +1,266 @@
+import os
+import sys
+import time
+import logging as lg
+import tomllib
+import traceback
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+
+from fvc.tools.util import json_print
+import fvc.tools.df.util as u
+from fvc.tools.df.convert import do_tracked_convert
+from fvc.tools.df.manifest import Manifests, MANIFEST_NAME
+from fvc.tools.df.spatial import SPATIAL_INDEX_NAME
+
+
+class CrawlTask:
+    def __init__(self, params, extra, in_file_path: Path, output_path: Path, checksum=False):
+        self.params = params
+        self.extra = extra
+        self.checksum = checksum
+        self.in_file_path = in_file_path
+        self.output_path = output_path
+
+
+# Keeps log records of a task in a worker to replay them in the main process
+class RecordingHandler(lg.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # Render the message here, the arguments may not survive pickling
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+def collect_tasks(params, input_dir: Path, force: bool, manifests: Manifests, checksum=False):
+    tasks = []
+    skipped = []
+    outputs = set()
+
+    for toml_file in sorted(input_dir.glob('**/fvc.df.toml')):
+        lg.info(f'Found DF local config {toml_file}')
+        crawl_config = tomllib.loads(toml_file.read_text())
+
+        if convert_task := crawl_config.get('convert'):
+            for file_def in convert_task:
+                x_format = convert_task[file_def]['x-format']
+                target = convert_task[file_def].get('target', 'flightlog')
+                extra = convert_task[file_def].get('extra', {})
+
+                # Each task gets its own copy, so 'extra' tables do not leak between tasks
+                task_params = dict(params)
+                task_params.update(extra)
+                task_params.update({'x_format': x_format, 'target': target})
+
+                task_dir = toml_file.parent
+
+                for in_file_path in sorted(task_dir.glob(file_def)):
+                    if in_file_path.is_dir():
+                        lg.info(f'Found directory {in_file_path}, skipping')
+                        continue
+
+                    if in_file_path.name in ['fvc.df.toml', MANIFEST_NAME, SPATIAL_INDEX_NAME] or u.is_sidecar(in_file_path):
+                        continue
+
+                    if u.is_fvc_file(in_file_path):
+                        lg.info(f'File {in_file_path.name} is already in FVC format, skipping')
+                        continue
+
+                    output_path = in_file_path.with_suffix('.fvc')
+
+                    if output_path in outputs:
+                        lg.info(f'File {in_file_path.name} is already scheduled, skipping')
+                        continue
+
+                    if force:
+                        reason = 'forced'
+                    else:
+                        reason = manifests[output_path].stale_reason(
+                            task_params, extra, in_file_path, output_path, checksum
+                        )
+
+                    if reason:
+                        lg.debug(f'Output file {output_path.name} is out of date ({reason})')
+                        file_params = dict(task_params)
+                        file_params['input'] = u.Input(file_params, str(in_file_path))
+
+                        tasks.append(
+                            CrawlTask(file_params, extra, in_file_path, output_path, checksum)
+                        )
+
+                        outputs.add(output_path)
+                    else:
+                        lg.info(f'Output file {output_path.name} is up to date, skipping')
+                        skipped.append(output_path)
+
+    return tasks, skipped
+
+
+def run_task(task: CrawlTask, capture=False):
+    handler = None
+
+    if capture:
+        handler = RecordingHandler()
+        lg.getLogger().addHandler(handler)
+
+    result = {
+        'input': str(task.in_file_path),
+        'output': str(task.output_path),
+        'ok': True,
+        'error': None,
+        'traceback': None,
+        'entry': None
+    }
+
+    start = time.perf_counter()
+
+    try:
+        lg.info(
+            f'Converting {task.in_file_path.name} '
+            f'from {task.params["x_format"]} to {task.params["target"]}'
+        )
+
+        result['entry'] = do_tracked_convert(
+            task.params, task.in_file_path, task.output_path, task.extra, task.checksum
+        )
+    except Exception as e:
+        result['ok'] = False
+        result['error'] = str(e)
+        result['traceback'] = traceback.format_exc()
+    finally:
+        result['seconds'] = time.perf_counter() - start
+
+        if handler:
+            lg.getLogger().removeHandler(handler)
+            result['log'] = handler.records
+
+    return result
+
+
+def init_worker(level):
+    # Worker output is recorded per task and replayed in order by the main process
+    root = lg.getLogger()
+
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    root.setLevel(level)
+
+
+def capture_task(task: CrawlTask):
+    return run_task(task, capture=True)
+
+
+def report_result(params, result):
+    for record in result.get('log', []):
+        lg.getLogger(record.name).handle(record)
+
+    name = Path(result['input']).name
+
+    if result['ok']:
+        lg.info(f'Converted {name} in {result["seconds"]:.2f} s')
+    else:
+        if params['verbose'] and result['traceback']:
+            print(result['traceback'], file=sys.stderr)
+
+        lg.error(f'Error converting {result["input"]}: {result["error"]}')
+
+
+def run_tasks(params, tasks, jobs: int):
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            result = run_task(task)
+            report_result(params, result)
+            yield result
+
+        return
+
+    workers = min(jobs, len(tasks))
+    lg.info(f'Running {len(tasks)} tasks in {workers} worker processes')
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(lg.getLogger().getEffectiveLevel(),)
+    ) as executor:
+        futures = [executor.submit(capture_task, task) for task in tasks]
+
+        try:
+            # Reporting in submission order keeps the log grouped per file
+            for future in futures:
+                result = future.result()
+                report_result(params, result)
+                yield result
+
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+@click.command(help='Scan for fvc.df.toml files and execute tasks')
+@click.pass_obj
+@click.option('--force', help='Reconvert files even if they are up to date', is_flag=True)
+@click.option(
+    '--checksum', is_flag=True,
+    help='Record input digests, so touched but unchanged inputs are not reconverted'
+)
+@click.option(
+    '--jobs', help='Number of parallel conversion processes (0 for all CPUs)',
+    type=click.IntRange(min=0), default=1
+)
+def crawl(params, force, checksum, jobs):
+    input_dir = params['input'].as_dir()
+    start = time.perf_counter()
+    manifests = Manifests()
+
+    tasks, skipped = collect_tasks(params, input_dir, force, manifests, checksum)
+
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    results = []
+
+    try:
+        for result in run_tasks(params, tasks, jobs):
+            results.append(result)
+
+            if result['entry']:
+                manifests[Path(result['output'])].record(Path(result['output']), result['entry'])
+
+    finally:
+        manifests.save()
+
+    elapsed = time.perf_counter() - start
+    converted = sum(1 for r in results if r['ok'])
+    failed = len(results) - converted
+    task_time = sum(r['seconds'] for r in results)
+
+    lg.info(
+        f'Crawl complete in {elapsed:.2f} s: {converted} converted, {failed} failed, '
+        f'{len(skipped)} skipped (total task time {task_time:.2f} s)'
+    )
+
+    if params['JSON']:
+        json_print(params, {
+            'converted': converted,
+            'failed': failed,
+            'skipped': len(skipped),
+            'seconds': elapsed,
+            'tasks': [
+                {
+                    'input': r['input'],
+                    'output': r['output'],
+                    'ok': r['ok'],
+                    'error': r['error'],
+                    'seconds': r['seconds']
+                }
+                for r in results
+            ]
+        })
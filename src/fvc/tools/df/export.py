@@ -0,0 +1,24 @@
+from pathlib import Path
+import logging as lg
+import importlib
+
+import click
+
+import fvc.tools.df.simplify as simplify
+
+
+@click.command(help='Convert data to an external format')
+@click.pass_obj
+@click.option('--x-format', help='External data format', required=True)
+@click.option('--with-cellular', help='Require cellular signal data', is_flag=True)
+@click.option('--tracks', help='Export a line per track (uaid) instead of points', is_flag=True)
+@click.option('--precision', help='Number of decimals of coordinates', type=click.IntRange(min=0))
+@click.option('--lod', help='Split long tracks into regions with level of detail (KML)', is_flag=True)
+@simplify.simplify_args
+@click.argument('output-file', type=Path, required=False)
+def export(params, x_format, output_file, **kwargs):
+    params.update(kwargs)
+    export_module = importlib.import_module(f'fvc.tools.df.xformats.{x_format}')
+    export_fun = getattr(export_module, 'export_from_fvc')
+    real_output = export_fun(params, output_file)
+    lg.info(f'Export complete, output written to {real_output}')
@@ -1,56 +1,225 @@
 import json
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, UTC
+from pathlib import Path
 
-from toolz.itertoolz import accumulate, last
-from pygeodesy.dms import latDMS, lonDMS, F_DMS
 
-from fvc.tools.df.util import JsonlinesIO
+import fvc.tools.df.util as u
+from fvc.tools.util import JSON
+from fvc.tools.df.codec import default_codec
 
 
-def stats(params, io: JsonlinesIO):
-    metadata = io.read()
+FIELDS = ['time', 'lat', 'lon', 'alt']
 
-    if not metadata:
-        raise UserWarning('No metadata found')
+# Lower bounds (ms) of the sample interval histogram bins
+INTERVAL_BINS = [0, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+DEFAULT_GAP = 10
 
-    if (content := metadata.get('content')) != 'flightlog':
-        raise UserWarning(f'Unsupported content type: {content}')
 
-    def fetch_loc(field):
-        def inner(rec):
-            pos = rec['pos']
-            return pos['loc'][field] if 'loc' in pos else None
+class TrackStats:
+    # Mergeable aggregates of the records of one track (or of all records): merging the
+    # stats of consecutive chunks in file order gives the stats of the whole file
+    def __init__(self):
+        self.count = 0
+        self.first = None  # type: int | None
+        self.last = None  # type: int | None
+        self.extents = {key: [float('inf'), float('-inf')] for key in FIELDS}
+        self.intervals = [0] * len(INTERVAL_BINS)
+        self.unordered = 0
+        self.gaps = 0
+        self.longest_gap = 0
+        self.longest_gap_at = None  # type: int | None
 
-        return inner
+    def add_interval(self, previous: int, t: int, gap: int):
+        interval = t - previous
 
-    targets = {
-        'time': lambda rec: rec['time']['unix'],
-        'lat': fetch_loc('lat'),
-        'lon': fetch_loc('lon'),
-        'alt': fetch_loc('alt')
-    }
+        if interval < 0:
+            self.unordered += 1
+            return
 
-    init = {
-        key: {
-            'min': float('inf'),
-            'max': float('-inf')
+        self.intervals[bisect_right(INTERVAL_BINS, interval) - 1] += 1
+
+        if interval > gap:
+            self.gaps += 1
+
+            if interval > self.longest_gap:
+                self.longest_gap = interval
+                self.longest_gap_at = previous
+
+    def add(self, values: tuple, gap: int):
+        self.count += 1
+
+        for extent, value in zip(self.extents.values(), values):
+            # Zero is a valid value, only missing ones are skipped
+            if value is not None:
+                if value < extent[0]:
+                    extent[0] = value
+
+                if value > extent[1]:
+                    extent[1] = value
+
+        if (t := values[0]) is not None:
+            if self.last is not None:
+                self.add_interval(self.last, t, gap)
+            else:
+                self.first = t
+
+            self.last = t
+
+    def merge(self, other: 'TrackStats', gap: int):
+        # 'other' follows this one in the file
+        if self.last is not None and other.first is not None:
+            self.add_interval(self.last, other.first, gap)
+
+        self.merge_totals(other)
+        self.first = self.first if self.first is not None else other.first
+        self.last = other.last if other.last is not None else self.last
+
+    def merge_totals(self, other: 'TrackStats'):
+        # Sums without the interval between them, for stats of different tracks
+        self.count += other.count
+
+        for key, extent in self.extents.items():
+            extent[0] = min(extent[0], other.extents[key][0])
+            extent[1] = max(extent[1], other.extents[key][1])
+
+        self.intervals = [a + b for a, b in zip(self.intervals, other.intervals)]
+        self.unordered += other.unordered
+        self.gaps += other.gaps
+
+        if other.longest_gap > self.longest_gap:
+            self.longest_gap = other.longest_gap
+            self.longest_gap_at = other.longest_gap_at
+
+    def to_json(self) -> JSON:
+        result = {
+            key: {'min': extent[0], 'max': extent[1]} if extent[0] <= extent[1] else {'min': None, 'max': None}
+            for key, extent in self.extents.items()
+        }  # type: JSON
+
+        result['records'] = self.count
+        result['intervals'] = {
+            interval_label(i): count for i, count in enumerate(self.intervals) if count
         }
-        for key in targets.keys()
-    }
+        result['unordered'] = self.unordered
+        result['gaps'] = {'count': self.gaps, 'longest': self.longest_gap or None, 'longest_at': self.longest_gap_at}
+        return result
+
+
+def interval_label(i: int) -> str:
+    if i + 1 < len(INTERVAL_BINS):
+        return f'{INTERVAL_BINS[i]}-{INTERVAL_BINS[i + 1]} ms'
+
+    return f'{INTERVAL_BINS[i]}+ ms'
+
+
+def record_values(record) -> tuple:
+    loc = (record.get('pos') or {}).get('loc') or {}
+    return ((record.get('time') or {}).get('unix'), loc.get('lat'), loc.get('lon'), loc.get('alt'))
+
+
+def record_uaid(record):
+    return (record.get('uaid') or {}).get('int')
+
+
+def add_record(tracks: dict[str | None, TrackStats], record, gap: int):
+    uaid = record_uaid(record)
+
+    if (track := tracks.get(uaid)) is None:
+        track = tracks[uaid] = TrackStats()
+
+    track.add(record_values(record), gap)
+
+
+def stats_chunk(filepath: Path, gap: int, index: int, start: int, end: int, frame=None, skip_first=False) -> JSON:
+    # Per-track stats of a chunk planned by plan_chunks, in a worker process
+    lines, size = u.read_chunk_lines(filepath, start, end, frame)
+    decode = default_codec().decode
+    tracks = {}  # type: dict[str | None, TrackStats]
+    blank = False
+
+    for line in lines[1:] if skip_first else lines:
+        if not line.strip():
+            # Reading stops at the first empty line
+            blank = True
+            break
 
-    def stat_acc(stats, rec):
-        for key, fetch in targets.items():
-            if val := fetch(rec):
-                stats[key]['min'] = min(stats[key]['min'], val)
-                stats[key]['max'] = max(stats[key]['max'], val)
+        add_record(tracks, decode(line), gap)
 
-        return stats
+    return {'tracks': tracks, 'blank': blank, 'size': size}
 
-    stats = last(accumulate(stat_acc, io.iterate(), initial=init))  # type: ignore
+
+def run_stats_chunks(filepath: Path, chunks: list[dict], gap: int, jobs: int):
+    if jobs <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield stats_chunk(filepath, gap, **chunk)
+
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(chunks))) as executor:
+        futures = [executor.submit(stats_chunk, filepath, gap, **chunk) for chunk in chunks]
+
+        try:
+            for future in futures:
+                yield future.result()
+
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def collect_stats(input_path: Path, gap: int, jobs=1) -> dict[str | None, TrackStats]:
+    tracks = {}  # type: dict[str | None, TrackStats]
+
+    with u.open_fvc(input_path, 'r') as io:
+        metadata = io.read()
+
+        if not metadata:
+            raise UserWarning('No metadata found')
+
+        if (content := metadata.get('content')) != 'flightlog':
+            raise UserWarning(f'Unsupported content type: {content}')
+
+        if (chunks := u.plan_chunks(input_path)) is None:
+            for record in io.iterate():
+                add_record(tracks, record, gap)
+
+            return tracks
+
+    for result in run_stats_chunks(input_path, chunks, gap, jobs):
+        for uaid, chunk_track in result['tracks'].items():
+            if (track := tracks.get(uaid)) is None:
+                tracks[uaid] = chunk_track
+            else:
+                track.merge(chunk_track, gap)
+
+        if result['blank']:
+            break
+
+    return tracks
+
+
+def stats(params, input_path: Path, jobs=1, gap_seconds=DEFAULT_GAP, per_track=False):
+    gap = int(gap_seconds * 1000)
+    tracks = collect_stats(input_path, gap, jobs)
+    total = TrackStats()
+
+    for track in tracks.values():
+        total.merge_totals(track)
+
+    stats = total.to_json()
+    stats['tracks'] = len(tracks)
+    stats['gaps']['threshold'] = gap
+
+    if per_track:
+        stats['uaids'] = {str(uaid): track.to_json() for uaid, track in tracks.items()}
 
     if params['JSON']:
         print(json.dumps(stats, indent=2))
     else:
+        from pygeodesy.dms import latDMS, lonDMS, F_DMS
+
         def ftime(ts):
             return datetime.fromtimestamp(ts/1000.0, tz=UTC).strftime('%Y-%m-%d %H:%M:%S UTC')
 
@@ -60,9 +229,35 @@ def stats(params, io: JsonlinesIO):
         def flon(lon):
             return lonDMS(lon, form=F_DMS)
 
-        print(f'Start: {ftime(stats["time"]["min"])}')
-        print(f'End: {ftime(stats["time"]["max"])}')
+        def print_stats(stats, indent=''):
+            if stats['time']['min'] is not None:
+                print(f'{indent}Start: {ftime(stats["time"]["min"])}')
+                print(f'{indent}End: {ftime(stats["time"]["max"])}')
+
+            if stats['lat']['min'] is not None:
+                print(f'{indent}From latutude {flat(stats["lat"]["min"])} to {flat(stats["lat"]["max"])}')
+                print(f'{indent}From longitude {flon(stats["lon"]["min"])} to {flon(stats["lon"]["max"])}')
+
+            if stats['alt']['min'] is not None:
+                print(f'{indent}From altitude {stats["alt"]["min"]:.2f} to {stats["alt"]["max"]:.2f}')
+
+            print(f'{indent}Records: {stats["records"]}')
+
+            if stats['intervals']:
+                print(f'{indent}Sample intervals: {", ".join(f"{k}: {v}" for k, v in stats["intervals"].items())}')
+
+            if stats['unordered']:
+                print(f'{indent}Records out of time order: {stats["unordered"]}')
+
+            if gaps := stats['gaps']['count']:
+                print(
+                    f'{indent}Gaps over {gap / 1000:g} s: {gaps}, longest {stats["gaps"]["longest"] / 1000:.1f} s '
+                    f'at {ftime(stats["gaps"]["longest_at"])}'
+                )
+
+        print_stats(stats)
+        print(f'Tracks: {stats["tracks"]}')
 
-        print(f'From latutude {flat(stats["lat"]["min"])} to {flat(stats["lat"]["max"])}')
-        print(f'From longitude {flon(stats["lon"]["min"])} to {flon(stats["lon"]["max"])}')
-        print(f'From altitude {stats["alt"]["min"]:.2f} to {stats["alt"]["max"]:.2f}')
+        for uaid, track in stats.get('uaids', {}).items():
+            print(f'Track {uaid}:')
+            print_stats(track, '  ')
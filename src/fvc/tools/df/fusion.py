@@ -1,5 +1,10 @@
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import logging as lg
+import os
+import queue
+import threading
 
 import click
 
@@ -7,9 +12,123 @@ import fvc.tools.util as u
 import fvc.tools.df.util as uf
 from fvc.tools.df.util import JsonlinesIO as JLIO
 import fvc.tools.df.xformats.safirmqtt as smq
+from fvc.tools.timestamps import TimestampParser
 
 
-def extract_flightlogs(params, replay: JLIO, plots: JLIO, tracks: JLIO):
+EVENTS = ['input', 'output']
+# Batches converted ahead of the writers, per conversion process
+PIPELINE_DEPTH = 2
+# Converted batches waiting for each writer; the pipeline stalls when a writer lags behind
+WRITER_QUEUE_SIZE = 4
+
+# Conversion state of the current process (see init_converter)
+_geoid = None
+_timestamps = None
+
+
+def init_converter(egm: str | None):
+    global _geoid, _timestamps
+    _geoid = u.load_geoid({'EGM': egm})
+    _timestamps = TimestampParser()
+
+
+def convert_batch(batch: list[tuple[str, dict]]) -> tuple[list, list]:
+    # (plots, tracks) flight log records of a batch of (event, message)
+    flightlog_recs = smq.flightlog_records([message for _, message in batch], _geoid, _timestamps)
+    plots = []
+    tracks = []
+
+    for (event, _), fligtlog_rec in zip(batch, flightlog_recs):
+        if event == 'input':
+            plots.append(fligtlog_rec)
+
+        if event == 'output':
+            fligtlog_rec['fusion'] = True
+            tracks.append(fligtlog_rec)
+
+    return plots, tracks
+
+
+def read_batches(replay: JLIO):
+    # Reader stage: (event, message) of the plots and tracks, in batches
+    batch = []
+
+    for record in replay.iterate():
+        if (event := record.get('event')) not in EVENTS:
+            continue
+
+        batch.append((event, record['message']))
+
+        if len(batch) >= u.GEOID_BATCH_SIZE:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def convert_batches(batches, egm: str | None, jobs: int):
+    # Conversion stage: converted batches in input order, at most 'jobs' * PIPELINE_DEPTH
+    # batches are in flight so the reader does not run ahead of the writers
+    if jobs <= 1:
+        init_converter(egm)
+        yield from map(convert_batch, batches)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_converter, initargs=(egm,)) as executor:
+        futures = deque()  # type: deque
+
+        try:
+            for batch in batches:
+                futures.append(executor.submit(convert_batch, batch))
+
+                if len(futures) >= jobs * PIPELINE_DEPTH:
+                    yield futures.popleft().result()
+
+            while futures:
+                yield futures.popleft().result()
+
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+class WriterStage:
+    # Writes batches of records to an output in its own thread, behind a bounded queue;
+    # an error is raised to the producer by the next put() or by close()
+    def __init__(self, output: JLIO, name: str):
+        self._output = output
+        self._queue = queue.Queue(WRITER_QUEUE_SIZE)  # type: queue.Queue
+        self._error = None  # type: BaseException | None
+        self._thread = threading.Thread(target=self._run, name=f'fvc-{name}-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while (records := self._queue.get()) is not None:
+            # After an error, batches are still taken so that the producer never blocks
+            if self._error is None:
+                try:
+                    self._output.write_many(records)
+                except BaseException as e:
+                    self._error = e
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def put(self, records: list):
+        self._check()
+
+        if records:
+            self._queue.put(records)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._check()
+
+
+def extract_flightlogs(params, replay: JLIO, plots: JLIO, tracks: JLIO, jobs=1):
     metadata = replay.read()
 
     if not metadata:
@@ -24,35 +143,38 @@ def extract_flightlogs(params, replay: JLIO, plots: JLIO, tracks: JLIO):
         'source': 'fusion.replay'
     }
 
-    geoid = u.load_geoid(params, out_metadata)
+    # Checks the geoid model and records it in the metadata, converters load their own
+    u.load_geoid(params, out_metadata)
     plots.write(out_metadata)
     tracks.write(out_metadata)
 
-    for record in replay.iterate():
-        event = record.get('event')
+    # Reader (this thread) -> conversion (processes) -> a writer thread per output
+    plot_writer = WriterStage(plots, 'plots')
+    track_writer = WriterStage(tracks, 'tracks')
 
-        if event not in ['input', 'output']:
-            continue
-
-        fligtlog_rec = smq.flightlog_record(record['message'], geoid)
+    try:
+        for plot_recs, track_recs in convert_batches(read_batches(replay), params.get('EGM'), jobs):
+            plot_writer.put(plot_recs)
+            track_writer.put(track_recs)
 
-        if record['event'] == 'input':
-            plots.write(fligtlog_rec)
-
-        if record['event'] == 'output':
-            fligtlog_rec['fusion'] = True
-            tracks.write(fligtlog_rec)
+    finally:
+        plot_writer.close()
+        track_writer.close()
 
 
 @click.command(help='Extract fused flight log data from a replay file')
 @click.option('--output-plots', type=Path, help='Output file for plots')
 @click.option('--output-tracks', type=Path, help='Output file for tracks')
+@click.option(
+    '--jobs', help='Number of parallel conversion processes (0 for all CPUs)',
+    type=click.IntRange(min=0), default=1
+)
 @click.pass_obj
-def flightlog(params, output_plots, output_tracks):
-    with uf.JsonlinesIO(params['input'].fetch(), 'r') as replay:
-        with uf.JsonlinesIO(output_plots, 'w') as plots:
-            with uf.JsonlinesIO(output_tracks, 'w') as tracks:
-                extract_flightlogs(params, replay, plots, tracks)
+def flightlog(params, output_plots, output_tracks, jobs):
+    with uf.open_fvc(params['input'].fetch(streamable=True), 'r') as replay:
+        with uf.open_fvc(output_plots, 'w') as plots:
+            with uf.open_fvc(output_tracks, 'w') as tracks:
+                extract_flightlogs(params, replay, plots, tracks, jobs or os.cpu_count() or 1)
 
     lg.info(f'Flight log data extracted from {params["input"]}')
 
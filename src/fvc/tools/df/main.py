@@ -1,67 +1,31 @@
-import sys
+import os
 from pathlib import Path
 import logging as lg
-import importlib
-import tomllib
-import traceback
 
 import click
-import jsonschema
 
-from fvc.tools.util import json_print
-import fvc.tools.df.schema as schema
+from fvc.tools.util import json_print, LazyGroup
 import fvc.tools.df.util as u
 
 import fvc.tools.df.flightlog as flightlog
 import fvc.tools.df.metadata as metadata
-import fvc.tools.df.fusion as fusion
+import fvc.tools.df.manifest as manifest
+from fvc.tools.df.convert import do_tracked_convert
 
 
-MAX_ERRORS = 100
-
-
-def isValid(input_path: Path):
-    with click.progressbar(
-        length=input_path.stat().st_size,
-        label='Validating data',
-        file=sys.stderr
-    ) as bar:
-        with u.JsonlinesIO(input_path, 'r', callback=lambda s: bar.update(s)) as f:
-            try:
-                metaline = f.read()
-
-                if not metaline:
-                    raise UserWarning('Cannon read a metadata line')
-
-                jsonschema.validate(metaline, schema.METADATA)
-                content = metaline['content']
-
-                if content not in schema.CONTENT_SCHEMA:
-                    raise UserWarning(f'Unknown content type: {content}')
-
-                content_schema = schema.CONTENT_SCHEMA[content]
-
-            except Exception as e:
-                lg.error(f'Metadata validation error at line {f.in_line_no()}: {e}')
-                return False
-
-            error_count = 0
-
-            for data in f.iterate():
-                try:
-                    jsonschema.validate(data, content_schema)
-
-                except Exception as e:
-                    lg.error(f'Validation error at line {f.in_line_no()}: {e}')
-                    error_count += 1
-
-                if error_count >= MAX_ERRORS:
-                    lg.error(f'Maximum number of errors reached ({MAX_ERRORS}), stopping')
-                    return False
-
-    success = error_count == 0
-    lg.info(f'Validation {"succeeded" if success else "failed"}')
-    return success
+# Commands of other modules, imported when used
+LAZY_COMMANDS = {
+    'export': 'fvc.tools.df.export:export',
+    'fusion': 'fvc.tools.df.fusion:fusion',
+    'crawl': 'fvc.tools.df.crawl:crawl',
+    'cache': 'fvc.tools.df.cache:cache',
+    'time-index': 'fvc.tools.df.timeindex:time_index',
+    'slice': 'fvc.tools.df.timeindex:slice_command',
+    'index': 'fvc.tools.df.spatial:index',
+    'query': 'fvc.tools.df.spatial:query',
+    'simplify': 'fvc.tools.df.simplify:simplify',
+    'split': 'fvc.tools.df.split:split'
+}
 
 
 DESCRIPTION = 'Data file conversion and manipulation tool'
@@ -72,19 +36,30 @@ Notes:
     For EGM geoid data download, visit:
     https://geographiclib.sourceforge.io/C++/doc/geoid.html#geoidinst
 
-    To set a default cache directory, use the FVC_CACHE environment variable.
+    To set a default cache directory, use the FVC_CACHE environment variable,
+    and FVC_CACHE_SIZE for its budget.
+
+    To use a local S3-compatible service instead of AWS, set the AWS_ENDPOINT_URL environment variable.
 
     From examples of 'fvc.df.toml' files, see 'examples/df' directory in the source code.
 '''
 
 
-@click.group(help=DESCRIPTION, epilog=EPILOG)
+@click.group(cls=LazyGroup, help=DESCRIPTION, epilog=EPILOG, lazy_commands=LAZY_COMMANDS)
 @click.pass_obj
 @click.option(
     '--cache-dir', help='Directory for caching external data',
     type=Path, envvar='FVC_CACHE', required=False
 )
+@click.option(
+    '--cache-size', help='Cache budget, least recently used files are evicted above it (e.g. 20G)',
+    envvar='FVC_CACHE_SIZE', required=False
+)
 @click.option('--in', 'input', required=False)
+@click.option(
+    '--stream', is_flag=True,
+    help='Process S3 input while it is downloaded with parallel ranged requests (cached at the end)'
+)
 def df(params, input, **kwargs):
     params.update(kwargs)
     params['input'] = u.Input(params, input)
@@ -92,35 +67,20 @@ def df(params, input, **kwargs):
 
 @df.command(help='Validate a FVC file against the known schema')
 @click.pass_obj
-def validate(params):
-    input_path = params['input'].fetch()
-    valid = isValid(input_path)
+@click.option(
+    '--jobs', help='Number of parallel validation processes (0 for all CPUs)',
+    type=click.IntRange(min=0), default=1
+)
+def validate(params, jobs):
+    from fvc.tools.df.validate import is_valid
+
+    input_path = params['input'].fetch(streamable=True)
+    valid = is_valid(input_path, jobs or os.cpu_count() or 1)
 
     if params['JSON']:
         json_print(params, {'valid': valid})
 
 
-def do_convert(params, input_path: Path, output_path: Path):
-    try:
-        params['output_path'] = output_path
-
-        x_format = params['x_format']
-
-        lg.debug(f'Using external format module: {x_format}')
-        ext_format_mod = importlib.import_module(f'fvc.tools.df.xformats.{x_format}')
-        lg.debug('Imported external format function')
-        convert_fun = getattr(ext_format_mod, 'convert_to_fvc')
-        meta = metadata.initial_metadata(params)
-
-        with u.JsonlinesIO(output_path, 'w') as io:
-            convert_fun(params, meta, input_path, io)
-
-        lg.info(f'Conversion complete, output written to {output_path}')
-    except ModuleNotFoundError as e:
-        lg.error(f'Error importing external format module: {e}')
-        raise UserWarning(f'Unknown external format: {params["x_format"]}')
-
-
 @df.command()
 @click.pass_obj
 @click.option(
@@ -133,10 +93,28 @@ def do_convert(params, input_path: Path, output_path: Path):
     type=click.DateTime(['%d %b %Y', '%Y-%m-%d']),
     required=False
 )
+@click.option(
+    '--columnar', is_flag=True,
+    help=f'Write the columnar format (default output suffix {u.COLUMNAR_SUFFIX})'
+)
+@click.option(
+    '--compress', type=click.Choice(['gz', 'zst']),
+    help='Write a compressed, frame-seekable file (default output suffix .fvc.gz or .fvc.zst)'
+)
+@click.option('--incremental', is_flag=True, help='Skip conversion if the output is up to date')
+@click.option(
+    '--checksum', is_flag=True,
+    help='Record the input digest, so a touched but unchanged input is not reconverted'
+)
+@click.option('--time-index', is_flag=True, help='Also build the time index of the output, used by slice')
+@click.option(
+    '--jobs', help='Number of parallel processes for formats which support it (0 for all CPUs)',
+    type=click.IntRange(min=0), default=1
+)
 @click.argument('x_format', type=str, required=True)
 @click.argument('output-file', type=Path, required=False)
 @metadata.metadata_args
-def convert(params, x_format, output_file, **kwargs):
+def convert(params, x_format, output_file, columnar, compress, incremental, checksum, time_index, jobs, **kwargs):
     '''Convert an external data file to the FVC format
 
     \b
@@ -150,97 +128,76 @@ def convert(params, x_format, output_file, **kwargs):
         - robinradar
         - safirmqtt
         - senhive
+
+    \b
+    The output format is chosen by the file name:
+        - *.fvc - JSON lines
+        - *.fvc.gz, *.fvc.zst - compressed JSON lines (zstd requires 'zstandard')
+        - *.parquet - columnar (requires 'pyarrow')
     '''
 
     params['x_format'] = x_format
+    params['jobs'] = jobs or os.cpu_count() or 1
     params.update(kwargs)
-    input_path = params['input'].fetch()
-    output_path = output_file if output_file else input_path.with_suffix('.fvc')
-    do_convert(params, input_path, output_path)
-
-
-@df.command(help='Calculate statistics for a FVC data file')
-@click.pass_obj
-def stats(params):
-    input_path = params['input'].fetch()
-
-    with u.JsonlinesIO(input_path, 'r') as io:
-        flightlog.stats(params, io)
-
-
-@df.command(help='Just download and cache external data')
-@click.pass_obj
-def fetch(params):
-    params['input'].fetch()
-
-    if not params['JSON']:
-        lg.info('This file is available in the cache')
-    else:
-        path = str(params['input'].fetch().resolve())
-        json_print(params, {'path': path})
-
-
-@df.command(help='Convert data to an external format')
-@click.pass_obj
-@click.option('--x-format', help='External data format', required=True)
-@click.option('--with-cellular', help='Require cellular signal data', is_flag=True)
-@click.argument('output-file', type=Path, required=False)
-def export(params, x_format, output_file, **kwargs):
-    params.update(kwargs)
-    export_module = importlib.import_module(f'fvc.tools.df.xformats.{x_format}')
-    export_fun = getattr(export_module, 'export_from_fvc')
-    real_output = export_fun(params, output_file)
-    lg.info(f'Export complete, output written to {real_output}')
 
+    if columnar and compress:
+        raise UserWarning('Columnar files are already compressed, --compress is not applicable')
 
-@df.command(help='Scan for fvc.df.toml files and execute tasks')
-@click.pass_obj
-@click.option('--force', help='Reconvert files even if they exist', is_flag=True)
-def crawl(params, force):
-    input_dir = params['input'].as_dir()
+    if columnar and time_index:
+        raise UserWarning('Columnar files are read by columns, --time-index is not applicable')
 
-    for toml_file in input_dir.glob('**/fvc.df.toml'):
-        lg.info(f'Found DF local config {toml_file}')
-        crawl_config = tomllib.loads(toml_file.read_text())
+    # An up to date output is detected from the S3 object metadata, before downloading it
+    input_path = params['input'].peek() if incremental else params['input'].fetch(streamable=True)
+    output_suffix = u.COLUMNAR_SUFFIX if columnar else '.fvc' + (f'.{compress}' if compress else '')
+    output_path = output_file if output_file else input_path.with_suffix(output_suffix)
+    output_manifest = manifest.Manifest(output_path.parent)
 
-        if convert_task := crawl_config.get('convert'):
-            for file_def in convert_task:
-                x_format = convert_task[file_def]['x-format']
-                target = convert_task[file_def].get('target', 'flightlog')
+    if incremental:
+        reason = output_manifest.stale_reason(params, None, input_path, output_path, checksum)
 
-                params.update(convert_task[file_def].get('extra', {}))
-                params.update({'x_format': x_format, 'target': target})
+        if not reason:
+            lg.info(f'Output file {output_path} is up to date, skipping')
 
-                task_dir = toml_file.parent
+            if time_index:
+                import fvc.tools.df.timeindex as timeindex
+                timeindex.ensure_time_index(output_path)
 
-                for in_file_path in task_dir.glob(file_def):
-                    if in_file_path.is_dir():
-                        lg.info(f'Found directory {in_file_path}, skipping')
-                        continue
+            return
 
-                    if in_file_path.name == 'fvc.df.toml':
-                        continue
+        lg.debug(f'Output file {output_path} is out of date ({reason})')
+        input_path = params['input'].fetch(streamable=True)
 
-                    if in_file_path.suffix == '.fvc':
-                        lg.info(f'File {in_file_path.name} is already in FVC format, skipping')
-                        continue
+    entry = do_tracked_convert(params, input_path, output_path, checksum=checksum)
+    output_manifest.record(output_path, entry)
+    output_manifest.save()
 
-                    output_path = in_file_path.with_suffix('.fvc')
+    if time_index:
+        import fvc.tools.df.timeindex as timeindex
+        timeindex.build_time_index(output_path)
 
-                    if not output_path.exists() or force:
-                        try:
-                            lg.info(
-                                f'Converting {in_file_path.name} from {x_format} to {target}'
-                            )
 
-                            do_convert(params, in_file_path, output_path)
-                        except Exception as e:
-                            if params['verbose']:
-                                traceback.print_exc(file=sys.stderr)
+@df.command(help='Calculate statistics for a FVC data file')
+@click.pass_obj
+@click.option(
+    '--jobs', help='Number of parallel processes (0 for all CPUs)',
+    type=click.IntRange(min=0), default=1
+)
+@click.option(
+    '--gap', help='Interval between two records of a track reported as a gap, in seconds',
+    type=click.FloatRange(min=0), default=flightlog.DEFAULT_GAP
+)
+@click.option('--tracks', 'per_track', is_flag=True, help='Also report the statistics of each track (uaid)')
+def stats(params, jobs, gap, per_track):
+    input_path = params['input'].fetch(streamable=True)
+    flightlog.stats(params, input_path, jobs or os.cpu_count() or 1, gap, per_track)
 
-                            lg.error(f'Error converting {in_file_path}: {e}')
-                    else:
-                        lg.info(f'Output file {output_path.name} exists, skipping')
 
+@df.command(help='Just download and cache external data')
+@click.pass_obj
+def fetch(params):
+    input_path = params['input'].fetch()
 
-df.add_command(fusion.fusion)
+    if not params['JSON']:
+        lg.info('This file is available in the cache')
+    else:
+        json_print(params, {'path': str(input_path.resolve())})
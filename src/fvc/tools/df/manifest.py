@@ -0,0 +1,199 @@
+from pathlib import Path
+from functools import lru_cache
+import hashlib
+import importlib.util
+import json
+import logging as lg
+import os
+
+from fvc.tools.util import JSON
+
+
+MANIFEST_NAME = '.fvc.manifest.json'
+MANIFEST_VERSION = 1
+HASH_BLOCK_SIZE = 1 << 20
+
+# Parameters which change the output of a conversion (in addition to crawl 'extra' tables)
+CONVERT_PARAMS = [
+    'x_format',
+    'target',
+    'base_date',
+    'EGM',
+    'polar_sensor_source',
+    'polar_sensor_format'
+]
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+
+    with path.open('rb') as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def file_fingerprint(path: Path, checksum=False) -> JSON:
+    stat = path.stat()
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}  # type: JSON
+
+    if checksum:
+        fingerprint['sha256'] = file_digest(path)
+
+    return fingerprint
+
+
+@lru_cache
+def package_version() -> str:
+    # Digest of the sources of the package: converters share modules (tabular, timestamps,
+    # geoid, codec...), so an edit to any of them may change their output
+    root = Path(__file__).parent.parent
+    digest = hashlib.sha256()
+
+    for path in sorted(root.rglob('*.py')):
+        digest.update(path.relative_to(root).as_posix().encode('utf-8'))
+        digest.update(path.read_bytes())
+
+    return digest.hexdigest()
+
+
+@lru_cache
+def module_version(x_format: str) -> str:
+    # The converter version is the digest of the package sources, so any edit invalidates outputs
+    spec = importlib.util.find_spec(f'fvc.tools.df.xformats.{x_format}')
+
+    if not spec or not spec.origin:
+        return ''
+
+    return package_version()
+
+
+def effective_params(params, extra=None) -> JSON:
+    effective = {key: params.get(key) for key in CONVERT_PARAMS}
+    effective.update(extra or {})
+
+    # Normalize through JSON so recorded and computed values compare equal
+    return json.loads(json.dumps(effective, sort_keys=True, default=str))
+
+
+def build_entry(params, extra, input_path: Path, input_fingerprint: JSON, output_path: Path) -> JSON:
+    return {
+        'input': {
+            'path': str(input_path.resolve()),
+            **input_fingerprint
+        },
+        'converter': {
+            'x_format': params['x_format'],
+            'version': module_version(params['x_format'])
+        },
+        'params': effective_params(params, extra),
+        'output': file_fingerprint(output_path)
+    }
+
+
+class Manifest:
+    def __init__(self, directory: Path):
+        self._path = directory / MANIFEST_NAME
+        self._entries = None  # type: JSON | None
+        self._dirty = False
+
+    def _load(self) -> JSON:
+        if self._entries is None:
+            self._entries = {}
+
+            if self._path.exists():
+                try:
+                    data = json.loads(self._path.read_text())
+
+                    if data.get('version') == MANIFEST_VERSION:
+                        self._entries = data.get('entries', {})
+                    else:
+                        lg.warning(f'Ignoring manifest {self._path} of unknown version')
+
+                except ValueError as e:
+                    lg.warning(f'Ignoring broken manifest {self._path}: {e}')
+
+        return self._entries
+
+    def entry(self, output_path: Path) -> JSON | None:
+        return self._load().get(output_path.name)
+
+    def record(self, output_path: Path, entry: JSON):
+        self._load()[output_path.name] = entry
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        data = {'version': MANIFEST_VERSION, 'entries': self._load()}
+        temp_path = self._path.with_name(f'{self._path.name}.{os.getpid()}.tmp')
+        temp_path.write_text(json.dumps(data, indent=1, sort_keys=True))
+        os.replace(temp_path, self._path)
+        self._dirty = False
+
+    def stale_reason(
+        self, params, extra, input_path: Path, output_path: Path, checksum=False
+    ) -> str | None:
+        if not output_path.exists():
+            return 'no output'
+
+        entry = self.entry(output_path)
+
+        if not entry:
+            return 'no manifest entry'
+
+        if entry['output'] != file_fingerprint(output_path):
+            return 'output changed'
+
+        recorded = entry['input']
+
+        if recorded.get('path') != str(input_path.resolve()):
+            return 'different input'
+
+        current = file_fingerprint(input_path)
+
+        if (current['size'], current['mtime_ns']) != (recorded['size'], recorded['mtime_ns']):
+            # A touched but otherwise identical file is still fresh when its digest is known
+            if not (checksum and recorded.get('sha256') and current['size'] == recorded['size']):
+                return 'input changed'
+
+            if file_digest(input_path) != recorded['sha256']:
+                return 'input changed'
+
+            recorded['mtime_ns'] = current['mtime_ns']
+            self._dirty = True
+
+        converter = entry['converter']
+
+        if converter.get('x_format') != params['x_format']:
+            return 'converter changed'
+
+        if converter.get('version') != module_version(params['x_format']):
+            return 'converter changed'
+
+        if entry['params'] != effective_params(params, extra):
+            return 'parameters changed'
+
+        return None
+
+
+class Manifests:
+    def __init__(self):
+        self._manifests = {}  # type: dict[Path, Manifest]
+
+    def __getitem__(self, output_path: Path) -> Manifest:
+        directory = output_path.parent.resolve()
+
+        if directory not in self._manifests:
+            self._manifests[directory] = Manifest(directory)
+
+        return self._manifests[directory]
+
+    def save(self):
+        for manifest in self._manifests.values():
+            try:
+                manifest.save()
+            except OSError as e:
+                lg.error(f'Unable to save manifest: {e}')
@@ -1,9 +1,25 @@
-import click
+from pathlib import Path
 from functools import wraps
+import importlib
+import json
+import logging as lg
+import os
+
+import click
 
 from fvc.tools.util import JSON
-from fvc.tools.df.util import Input
-import fvc.tools.df.xformats.nmea as nmea
+from fvc.tools.df.util import Input, SENSOR_CACHE_SUFFIX
+from fvc.tools.df.cache import read_json
+import fvc.tools.df.manifest as manifest
+
+
+# Modules with an extract_sensor_data function, by sensor format
+SENSOR_FORMATS = {
+    'nmea': 'fvc.tools.df.xformats.nmea'
+}
+
+# Sensor data of this process by sensor file, e.g. for a crawl with one sensor file
+_sensor_cache = {}  # type: dict[tuple, JSON]
 
 
 def metadata_args(command_func):
@@ -15,7 +31,7 @@ def metadata_args(command_func):
     @click.option(
         '--polar-sensor-format',
         help='Format for polar sensor information',
-        type=click.Choice(['nmea'])
+        type=click.Choice(list(SENSOR_FORMATS))
     )
     @wraps(command_func)
     def wrapper(*args, **kwargs):
@@ -24,9 +40,46 @@ def metadata_args(command_func):
     return wrapper
 
 
+def sensor_cache_path(source: Path) -> Path:
+    return source.with_name(source.name + SENSOR_CACHE_SUFFIX)
+
+
+def sensor_data(params, format: str, source: Path) -> JSON:
+    # Sensor data is extracted once per sensor file: the result is kept next to it, valid
+    # while the file fingerprint and the extractor module are the same
+    key = {
+        'format': format,
+        'version': manifest.module_version(format),
+        'source': manifest.file_fingerprint(source)
+    }
+    memo_key = (str(source.resolve()), key['version'], *key['source'].values())
+
+    if (data := _sensor_cache.get(memo_key)) is not None:
+        return data
+
+    cache_path = sensor_cache_path(source)
+
+    if (cached := read_json(cache_path)) and cached.get('key') == key:
+        lg.debug(f'Using cached sensor data: {cache_path}')
+        data = cached['sensor']
+    else:
+        data = importlib.import_module(SENSOR_FORMATS[format]).extract_sensor_data(params, source)
+
+        try:
+            # Keys are not sorted: the data goes into metadata as is
+            temp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+            temp_path.write_text(json.dumps({'key': key, 'sensor': data}))
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            lg.debug(f'Unable to cache sensor data in {cache_path}: {e}')
+
+    _sensor_cache[memo_key] = data
+    return data
+
+
 def initial_metadata(params) -> JSON:
     metadata = {}  # type: JSON
-    metadata['origin'] = str(params['input'].fetch().name)
+    metadata['origin'] = str(params['input'].fetch(streamable=True).name)
 
     if not params.get('polar_sensor_source'):
         return metadata
@@ -36,18 +89,15 @@ def initial_metadata(params) -> JSON:
 
     filename = params['polar_sensor_source']
     source = Input(params, filename).fetch()
+    format = params.get('polar_sensor_format')
 
-    if format := params.get('polar_sensor_format'):
-        if format == 'nmea':
-            metadata['polar_sensor'] = {
-                'source': 'nmea',
-                'origin': source.name
-            }
-
-            metadata['polar_sensor'].update(
-                nmea.extract_sensor_data(params, source)
-            )
+    if format not in SENSOR_FORMATS:
+        raise UserWarning(f'Unknown sensor format: {format}')
 
-            return metadata
+    metadata['polar_sensor'] = {
+        'source': format,
+        'origin': source.name
+    }
 
-    raise UserWarning(f'Unknown sensor format: {format}')
+    metadata['polar_sensor'].update(sensor_data(params, format, source))
+    return metadata
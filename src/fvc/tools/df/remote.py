@@ -0,0 +1,202 @@
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+import io
+import logging as lg
+import os
+
+from fvc.tools.util import JSON
+
+
+# Ranged GETs of PART_SIZE bytes, at most STREAM_WINDOW parts in flight or waiting to be read
+PART_SIZE = int(os.getenv('FVC_S3_PART_SIZE', 8 << 20))
+STREAM_WORKERS = int(os.getenv('FVC_S3_WORKERS', 8))
+STREAM_WINDOW = 2 * STREAM_WORKERS
+
+
+class RemoteStat(NamedTuple):
+    st_size: int
+    st_mtime: float
+    st_mtime_ns: int
+
+
+class RangedStream(io.RawIOBase):
+    # Object bytes in order, while the following parts are downloaded concurrently;
+    # the bytes are also written to a temporary file which is handed over to the cache at EOF
+    def __init__(self, remote: 'RemotePath', cache_path: Path | None):
+        super().__init__()
+        self._remote = remote
+        self._executor = ThreadPoolExecutor(STREAM_WORKERS, thread_name_prefix='fvc-s3')
+        self._offsets = iter(range(0, remote.size, PART_SIZE))
+        self._futures = deque()  # type: deque
+        self._chunk = memoryview(b'')
+        self._position = 0
+        self._cache_path = cache_path
+        self._cache_file = None
+
+        if cache_path:
+            try:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                self._temp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+                self._cache_file = self._temp_path.open('wb')
+            except OSError as e:
+                lg.warning(f'Unable to cache {remote}: {e}')
+
+        self._fill()
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        while len(self._futures) < STREAM_WINDOW:
+            offset = next(self._offsets, None)
+
+            if offset is None:
+                return
+
+            self._futures.append(self._executor.submit(self._remote.read_range, offset, PART_SIZE))
+
+    def _next_chunk(self) -> bool:
+        if not self._futures:
+            self._finish()
+            return False
+
+        data = self._futures.popleft().result()
+        self._fill()
+
+        if self._cache_file:
+            self._cache_file.write(data)
+
+        self._chunk = memoryview(data)
+        self._position = 0
+        return True
+
+    def _finish(self):
+        if not self._cache_file:
+            return
+
+        self._cache_file.close()
+        self._cache_file = None
+
+        try:
+            self._remote.store(self._temp_path)
+            lg.info(f'Cached {self._remote} as {self._cache_path}')
+        except (OSError, UserWarning) as e:
+            lg.warning(f'Unable to cache {self._remote}: {e}')
+        finally:
+            self._temp_path.unlink(missing_ok=True)
+
+    def readinto(self, buffer) -> int:
+        while self._position >= len(self._chunk):
+            if not self._next_chunk():
+                return 0
+
+        size = min(len(buffer), len(self._chunk) - self._position)
+        buffer[:size] = self._chunk[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            if self._cache_file:
+                # Closed before EOF (readers stop at the first empty line): complete the cached copy
+                try:
+                    while self._next_chunk():
+                        pass
+                except Exception as e:
+                    lg.warning(f'Unable to cache {self._remote}: {e}')
+
+                    if self._cache_file:
+                        self._cache_file.close()
+                        self._cache_file = None
+
+                    self._temp_path.unlink(missing_ok=True)
+
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._futures.clear()
+
+        super().close()
+
+
+# Read-only stand-in for the Path of a cached S3 object, usable by the converters and
+# JsonlinesIO before (or without) a local copy: 'open' streams the object content.
+# 'head' is the object ETag, size and mtime_ns; 'store' moves a complete download into the cache
+class RemotePath:
+    def __init__(self, s3, bucket: str, key: str, cache_path: Path, head: JSON, store):
+        self._s3 = s3
+        self._bucket = bucket
+        self._key = key
+        self._cache_path = cache_path
+        self._head = head
+        self._store = store
+        self._stored = False
+        self.size = head['size']  # type: int
+        self._stat = RemoteStat(self.size, head['mtime_ns'] / 1e9, head['mtime_ns'])
+
+    def __str__(self) -> str:
+        return f's3://{self._bucket}/{self._key}'
+
+    @property
+    def name(self):
+        return self._cache_path.name
+
+    @property
+    def stem(self):
+        return self._cache_path.stem
+
+    @property
+    def suffix(self):
+        return self._cache_path.suffix
+
+    @property
+    def parent(self):
+        return self._cache_path.parent
+
+    def with_suffix(self, suffix: str) -> Path:
+        return self._cache_path.with_suffix(suffix)
+
+    def resolve(self) -> Path:
+        return self._cache_path.resolve()
+
+    def exists(self) -> bool:
+        return True
+
+    def stat(self) -> RemoteStat:
+        return self._stat
+
+    def read_range(self, offset: int, size: int) -> bytes:
+        # IfMatch makes the download fail instead of mixing two versions of the object
+        response = self._s3.get_object(
+            Bucket=self._bucket, Key=self._key, IfMatch=self._head['etag'],
+            Range=f'bytes={offset}-{offset + size - 1}'
+        )
+
+        return response['Body'].read()
+
+    def store(self, temp_path: Path):
+        self._store(self._cache_path, temp_path, self._head)
+        self._stored = True
+
+    def open(self, mode='r', buffering=-1, encoding=None, errors=None, newline=None):
+        if set(mode) - set('rbt'):
+            raise UserWarning(f'Remote files are read-only: {self}')
+
+        if self._stored:
+            return self._cache_path.open(mode, buffering, encoding, errors, newline)
+
+        raw = RangedStream(self, self._cache_path)
+        stream = io.BufferedReader(raw, buffering if buffering > 1 else io.DEFAULT_BUFFER_SIZE)
+
+        if 'b' in mode:
+            return stream
+
+        return io.TextIOWrapper(stream, encoding, errors, newline)
+
+    def read_text(self, encoding=None, errors=None) -> str:
+        with self.open('r', encoding=encoding, errors=errors) as f:
+            return f.read()
+
+    def read_bytes(self) -> bytes:
+        with self.open('rb') as f:
+            return f.read()
@@ -1,15 +1,46 @@
 from pathlib import Path
-import yaml
+import hashlib
+import json
+import logging as lg
 from typing import Dict, Any
 
 
-def load_schema() -> Dict[str, Any]:
-    schema_path = Path(__file__).parent / 'schema.yaml'
+SOURCE_PATH = Path(__file__).parent / 'schema.yaml'
+# schema.yaml compiled to JSON, which loads without PyYAML and much faster
+COMPILED_PATH = Path(__file__).parent / 'schema.json'
+
+
+def source_digest() -> str:
+    return hashlib.sha256(SOURCE_PATH.read_bytes()).hexdigest()
+
 
-    with open(schema_path, 'r') as f:
+def load_source() -> Dict[str, Any]:
+    import yaml
+
+    with open(SOURCE_PATH, 'r') as f:
         return yaml.safe_load(f)
 
 
+def compile_schema():
+    # To be run after editing schema.yaml: python -m fvc.tools.df.schema
+    compiled = {'source_sha256': source_digest(), 'schema': load_source()}
+    COMPILED_PATH.write_text(json.dumps(compiled, indent=1) + '\n')
+
+
+def load_schema() -> Dict[str, Any]:
+    try:
+        compiled = json.loads(COMPILED_PATH.read_text())
+    except (OSError, ValueError):
+        compiled = {}
+
+    # The compiled schema is used while it matches schema.yaml (if shipped)
+    if compiled and (not SOURCE_PATH.exists() or compiled.get('source_sha256') == source_digest()):
+        return compiled['schema']
+
+    lg.warning(f'{COMPILED_PATH.name} is out of date, run: python -m fvc.tools.df.schema')
+    return load_source()
+
+
 # Load the schema
 SCHEMA = load_schema()
 
@@ -29,3 +60,7 @@ FLIGHTLOG = SCHEMA['FLIGHTLOG']
 RADARLOG = SCHEMA['RADARLOG']
 FUSION_REPLAY = SCHEMA['FUSION_REPLAY']
 CONTENT_SCHEMA = SCHEMA['CONTENT_SCHEMA']
+
+
+if __name__ == '__main__':
+    compile_schema()
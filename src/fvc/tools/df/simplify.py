@@ -0,0 +1,251 @@
+from functools import wraps
+from pathlib import Path
+import heapq
+import logging as lg
+import math
+
+import click
+import numpy as np
+
+from fvc.tools.util import JSON, json_print
+from fvc.tools.df.tracks import TrackSpool
+import fvc.tools.df.util as u
+
+
+EARTH_RADIUS = 6371008.8
+METHODS = ['douglas-peucker', 'visvalingam']
+
+
+def local_xyz(lon: np.ndarray, lat: np.ndarray, alt: np.ndarray) -> np.ndarray:
+    # Local east-north-up meters around the track center: an equirectangular projection,
+    # accurate to a fraction of the tolerance over the extent of a track
+    lat0 = np.radians(np.nanmean(lat))
+    lon0 = np.nanmean(lon)
+    x = np.radians((lon - lon0 + 180.0) % 360.0 - 180.0) * EARTH_RADIUS * math.cos(lat0)
+    y = np.radians(lat) * EARTH_RADIUS
+    z = np.nan_to_num(alt)
+    return np.column_stack((x, y, z))
+
+
+def segment_distances(points: np.ndarray, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    # 3D distances of points to the segment start-end
+    direction = end - start
+    length = direction @ direction
+
+    if length == 0.0:
+        return np.linalg.norm(points - start, axis=1)
+
+    t = np.clip((points - start) @ direction / length, 0.0, 1.0)
+    return np.linalg.norm(points - (start + t[:, None] * direction), axis=1)
+
+
+def douglas_peucker(xyz: np.ndarray) -> np.ndarray:
+    # Importance of each point: the largest tolerance for which Douglas-Peucker keeps it,
+    # so both a tolerance and a point budget select from the same ranking
+    n = len(xyz)
+    importance = np.zeros(n)
+    importance[[0, -1]] = np.inf
+    stack = [(0, n - 1, np.inf)]
+
+    while stack:
+        first, last, limit = stack.pop()
+
+        if last - first < 2:
+            continue
+
+        distances = segment_distances(xyz[first + 1:last], xyz[first], xyz[last])
+        i = int(np.argmax(distances))
+        split = first + 1 + i
+        importance[split] = min(distances[i], limit)
+        stack.append((first, split, importance[split]))
+        stack.append((split, last, importance[split]))
+
+    return importance
+
+
+def triangle_areas(a: np.ndarray, b: np.ndarray, c: np.ndarray) -> np.ndarray:
+    return 0.5 * np.linalg.norm(np.cross(b - a, c - a), axis=-1)
+
+
+def visvalingam(xyz: np.ndarray) -> np.ndarray:
+    # Importance of each point: the effective area (m2) of its triangle when Visvalingam-Whyatt
+    # removes it, made non-decreasing in removal order
+    n = len(xyz)
+    importance = np.full(n, np.inf)
+
+    if n < 3:
+        return importance
+
+    areas = np.full(n, np.inf)
+    areas[1:-1] = triangle_areas(xyz[:-2], xyz[1:-1], xyz[2:])
+    previous = np.arange(-1, n - 1)
+    following = np.arange(1, n + 1)
+    heap = [(area, i) for i, area in enumerate(areas[1:-1].tolist(), 1)]
+    heapq.heapify(heap)
+    largest = 0.0
+
+    while heap:
+        area, i = heapq.heappop(heap)
+
+        if area != areas[i]:
+            # Outdated entry, or a removed point (NaN)
+            continue
+
+        largest = max(largest, area)
+        importance[i] = largest
+        p, f = previous[i], following[i]
+        following[p] = f
+        previous[f] = p
+        previous[i] = -1
+
+        for j in (p, f):
+            if 0 < j < n - 1:
+                areas[j] = float(triangle_areas(xyz[previous[j]], xyz[j], xyz[following[j]]))
+                heapq.heappush(heap, (areas[j], j))
+
+        areas[i] = np.nan
+
+    return importance
+
+
+class Simplification:
+    def __init__(self, method: str | None, tolerance: float, min_interval: float | None, max_points: int | None):
+        self.method = method
+        self.tolerance = tolerance
+        self.min_interval = min_interval
+        self.max_points = max_points
+
+    def __bool__(self):
+        return bool(self.method or self.min_interval or self.max_points)
+
+    def select(self, points: np.ndarray) -> np.ndarray:
+        # Sorted indices of the points of a track (time, lon, lat, alt, ... rows) to keep
+        order = np.argsort(points[:, 0], kind='stable')
+        times = points[order, 0]
+
+        if self.min_interval:
+            # The first point of every min_interval time slot
+            _, first = np.unique(np.floor(times / (self.min_interval * 1000.0)), return_index=True)
+            order = order[np.union1d(first, [len(order) - 1])]
+
+        if len(order) <= 2 or not (self.method or (self.max_points and len(order) > self.max_points)):
+            return np.sort(order)
+
+        track = points[order]
+        xyz = local_xyz(track[:, 1], track[:, 2], track[:, 3])
+
+        if self.method == 'visvalingam':
+            importance = visvalingam(xyz)
+            threshold = self.tolerance ** 2
+        else:
+            importance = douglas_peucker(xyz)
+            threshold = self.tolerance
+
+        keep = importance >= threshold if self.method else np.ones(len(order), dtype=bool)
+
+        if self.max_points and keep.sum() > self.max_points:
+            # The most important points, ties broken by order
+            ranked = np.argsort(-importance, kind='stable')[:max(self.max_points, 2)]
+            keep = np.zeros(len(order), dtype=bool)
+            keep[ranked] = True
+
+        return np.sort(order[keep])
+
+
+def simplify_args(command_func):
+    @click.option(
+        '--simplify', 'simplify_method', type=click.Choice(METHODS),
+        help='Simplify tracks (per uaid) with this algorithm'
+    )
+    @click.option(
+        '--tolerance', type=click.FloatRange(min=0), default=1.0,
+        help='Simplification tolerance in meters (3D distance; the square is the area for visvalingam)'
+    )
+    @click.option(
+        '--min-interval', type=click.FloatRange(min=0),
+        help='Keep at most one point per track in each time slot of this length, in seconds'
+    )
+    @click.option('--max-points', type=click.IntRange(min=2), help='Maximum number of points per track')
+    @wraps(command_func)
+    def wrapper(*args, **kwargs):
+        command_func(*args, **kwargs)
+
+    return wrapper
+
+
+def simplification(params) -> Simplification | None:
+    result = Simplification(
+        params.get('simplify_method'), params.get('tolerance') or 0.0,
+        params.get('min_interval'), params.get('max_points')
+    )
+
+    return result if result else None
+
+
+def track_point(record, index: int) -> tuple | None:
+    loc = (record.get('pos') or {}).get('loc') or {}
+    t = (record.get('time') or {}).get('unix')
+
+    if t is None or loc.get('lat') is None or loc.get('lon') is None:
+        return None
+
+    alt = loc.get('alt')
+    return (t, loc['lon'], loc['lat'], math.nan if alt is None else alt, index)
+
+
+def simplify_file(input_path: Path, output_path: Path, simplifier: Simplification) -> JSON:
+    # Two passes: track points are collected first, then the kept records are copied.
+    # Records without time or position are kept.
+    with TrackSpool(5) as spool, u.open_fvc(input_path, 'r') as f:
+        metadata = f.read()
+
+        if not metadata:
+            raise UserWarning('No metadata found')
+
+        if (content := metadata.get('content')) != 'flightlog':
+            raise UserWarning(f'Unsupported content type: {content}')
+
+        count = 0
+
+        for record in f.iterate():
+            if (point := track_point(record, count)) is not None:
+                spool.add(record.get('uaid', {}).get('int'), point)
+
+            count += 1
+
+        drop = np.zeros(count, dtype=bool)
+        tracks = len(spool)
+
+        for _, points in spool.tracks():
+            indices = points[:, 4].astype(np.int64)
+            drop[indices] = True
+            drop[indices[simplifier.select(points)]] = False
+
+    kept = 0
+
+    with u.open_fvc(input_path, 'r') as f, u.open_fvc(output_path, 'w') as output:
+        output.write(f.read())
+
+        for i, record in enumerate(f.iterate()):
+            if not drop[i]:
+                output.write(record)
+                kept += 1
+
+    return {'records': count, 'kept': kept, 'tracks': tracks, 'output': str(output_path)}
+
+
+@click.command(help='Write a FVC file with simplified tracks')
+@click.pass_obj
+@simplify_args
+@click.argument('output-file', type=Path, required=True)
+def simplify(params, output_file, **kwargs):
+    params.update(kwargs)
+
+    if not (simplifier := simplification(params)):
+        raise UserWarning('No simplification given (--simplify, --min-interval or --max-points)')
+
+    result = simplify_file(params['input'].fetch(), output_file, simplifier)
+    lg.info(f'{result["kept"]} of {result["records"]} records kept, output written to {output_file}')
+
+    if params['JSON']:
+        json_print(params, result)
@@ -0,0 +1,342 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import logging as lg
+import os
+import sqlite3
+import time
+
+import click
+
+from fvc.tools.util import JSON, json_print
+from fvc.tools.df.codec import default_codec
+from fvc.tools.df.timeindex import iterate_lines, merge_ranges, parse_time
+import fvc.tools.df.util as u
+
+
+SPATIAL_INDEX_NAME = '.fvc-spatial.sqlite'
+SPATIAL_INDEX_VERSION = 1
+
+# A track segment ends after SEGMENT_POINTS points or a gap longer than SEGMENT_GAP,
+# which keeps its bounding box tight for tracks crossing a large area
+SEGMENT_POINTS = 256
+SEGMENT_GAP = 60000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    uaid TEXT,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    time_from INTEGER NOT NULL,
+    time_to INTEGER NOT NULL,
+    points INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_file ON segments (file_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS segment_boxes USING rtree (
+    id, min_lon, max_lon, min_lat, max_lat, min_time, max_time
+);
+'''
+
+
+class Segment:
+    # Bounding box, time span and byte range of consecutive points of one track
+    def __init__(self, uaid, offset: int, end: int, t: int, lat: float, lon: float):
+        self.uaid = uaid
+        self.start = offset
+        self.end = end
+        self.time_from = self.time_to = t
+        self.min_lat = self.max_lat = lat
+        self.min_lon = self.max_lon = lon
+        self.points = 1
+
+    def add(self, end: int, t: int, lat: float, lon: float):
+        self.end = end
+        self.time_from = min(self.time_from, t)
+        self.time_to = max(self.time_to, t)
+        self.min_lat = min(self.min_lat, lat)
+        self.max_lat = max(self.max_lat, lat)
+        self.min_lon = min(self.min_lon, lon)
+        self.max_lon = max(self.max_lon, lon)
+        self.points += 1
+
+    def row(self) -> tuple:
+        return (
+            self.uaid, self.start, self.end, self.time_from, self.time_to, self.points,
+            self.min_lon, self.max_lon, self.min_lat, self.max_lat
+        )
+
+
+def file_segments(filepath: Path) -> list[tuple]:
+    # Byte offsets are content offsets, as in the time index
+    decode = default_codec().decode
+    open_segments = {}  # type: dict[str | None, Segment]
+    segments = []
+
+    lines = iterate_lines(filepath)
+    next(lines, None)
+
+    for offset, line in lines:
+        if not line.strip():
+            break
+
+        try:
+            record = decode(line)
+        except ValueError:
+            continue
+
+        t = (record.get('time') or {}).get('unix')
+        loc = (record.get('pos') or {}).get('loc') or {}
+        lat = loc.get('lat')
+        lon = loc.get('lon')
+
+        if t is None or lat is None or lon is None:
+            continue
+
+        uaid = (record.get('uaid') or {}).get('int')
+        end = offset + len(line)
+        segment = open_segments.get(uaid)
+
+        if segment and (segment.points >= SEGMENT_POINTS or abs(t - segment.time_to) > SEGMENT_GAP):
+            segments.append(segment.row())
+            segment = None
+
+        if segment:
+            segment.add(end, t, lat, lon)
+        else:
+            open_segments[uaid] = Segment(uaid, offset, end, t, lat, lon)
+
+    segments.extend(segment.row() for segment in open_segments.values())
+    return segments
+
+
+def index_file(filepath: Path) -> JSON:
+    # Runs in worker processes
+    stat = filepath.stat()
+
+    try:
+        return {'path': str(filepath), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                'segments': file_segments(filepath), 'error': None}
+    except Exception as e:
+        return {'path': str(filepath), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                'segments': [], 'error': str(e)}
+
+
+class SpatialIndex:
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path)
+        self._db.execute('PRAGMA foreign_keys = ON')
+        self._db.executescript(SCHEMA)
+        row = self._db.execute("SELECT value FROM info WHERE key = 'version'").fetchone()
+
+        if row is None:
+            with self._db:
+                self._db.execute("INSERT INTO info VALUES ('version', ?)", (str(SPATIAL_INDEX_VERSION),))
+        elif int(row[0]) != SPATIAL_INDEX_VERSION:
+            raise UserWarning(f'Spatial index {db_path} has an unsupported version, remove it and index again')
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def files(self) -> dict[str, tuple[int, int, int]]:
+        return {
+            path: (file_id, size, mtime_ns)
+            for file_id, path, size, mtime_ns in self._db.execute('SELECT id, path, size, mtime_ns FROM files')
+        }
+
+    def remove(self, file_id: int):
+        self._db.execute(
+            'DELETE FROM segment_boxes WHERE id IN (SELECT id FROM segments WHERE file_id = ?)', (file_id,)
+        )
+        self._db.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+    def add(self, result: JSON):
+        cursor = self._db.execute(
+            'INSERT INTO files (path, size, mtime_ns) VALUES (?, ?, ?)',
+            (result['path'], result['size'], result['mtime_ns'])
+        )
+        file_id = cursor.lastrowid
+
+        for row in result['segments']:
+            cursor = self._db.execute(
+                'INSERT INTO segments (file_id, uaid, start, end, time_from, time_to, points) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (file_id, *row[:6])
+            )
+            # R*Tree coordinates are 32-bit floats rounded outwards, exact times are checked on segments
+            self._db.execute(
+                'INSERT INTO segment_boxes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (cursor.lastrowid, *row[6:], row[3], row[4])
+            )
+
+    def update(self, input_dir: Path, jobs: int) -> JSON:
+        known = self.files()
+        found = set()
+        tasks = []
+
+        for filepath in sorted(input_dir.glob('**/*')):
+            if not filepath.is_file() or not u.is_fvc_file(filepath) or u.is_columnar(filepath):
+                continue
+
+            path = str(filepath.resolve())
+            found.add(path)
+            stat = filepath.stat()
+
+            if (entry := known.get(path)) and entry[1:] == (stat.st_size, stat.st_mtime_ns):
+                continue
+
+            tasks.append(Path(path))
+
+        removed = [entry[0] for path, entry in known.items() if path not in found]
+        errors = 0
+
+        with self._db:
+            for file_id in removed:
+                self.remove(file_id)
+
+        for result in run_index_tasks(tasks, jobs):
+            if result['error']:
+                lg.error(f'Unable to index {result["path"]}: {result["error"]}')
+                errors += 1
+                continue
+
+            # One transaction per file, an interrupted update keeps the files indexed so far
+            with self._db:
+                if entry := known.get(result['path']):
+                    self.remove(entry[0])
+
+                self.add(result)
+
+            lg.debug(f'Indexed {result["path"]} ({len(result["segments"])} segments)')
+
+        return {'indexed': len(tasks) - errors, 'removed': len(removed), 'failed': errors, 'files': len(found)}
+
+    def query(self, bbox: tuple[float, float, float, float], time_from: int | None, time_to: int | None) -> list[JSON]:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        conditions = ['b.max_lon >= ?', 'b.min_lon <= ?', 'b.max_lat >= ?', 'b.min_lat <= ?']
+        args = [min_lon, max_lon, min_lat, max_lat]  # type: list
+
+        if time_from is not None:
+            conditions.append('s.time_to >= ?')
+            args.append(time_from)
+
+        if time_to is not None:
+            conditions.append('s.time_from < ?')
+            args.append(time_to)
+
+        rows = self._db.execute(
+            'SELECT f.path, s.uaid, s.start, s.end, s.time_from, s.time_to '
+            'FROM segment_boxes b JOIN segments s ON s.id = b.id JOIN files f ON f.id = s.file_id '
+            f'WHERE {" AND ".join(conditions)} ORDER BY f.path, s.uaid, s.start',
+            args
+        )
+
+        tracks = {}  # type: dict[tuple, JSON]
+
+        for path, uaid, start, end, t0, t1 in rows:
+            track = tracks.setdefault((path, uaid), {'file': path, 'uaid': uaid, 'from': t0, 'to': t1, 'ranges': []})
+            track['from'] = min(track['from'], t0)
+            track['to'] = max(track['to'], t1)
+            track['ranges'].append((start, end))
+
+        for track in tracks.values():
+            track['ranges'] = merge_ranges(track['ranges'])
+
+        return list(tracks.values())
+
+
+def run_index_tasks(tasks: list[Path], jobs: int):
+    if jobs <= 1 or len(tasks) <= 1:
+        yield from map(index_file, tasks)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+        yield from executor.map(index_file, tasks)
+
+
+def index_db_path(input_dir: Path, db: Path | None) -> Path:
+    return db if db else input_dir / SPATIAL_INDEX_NAME
+
+
+def parse_bbox(value: str) -> tuple[float, float, float, float]:
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in value.split(','))
+    except ValueError:
+        raise UserWarning(f'Invalid bounding box: {value}, expected min_lon,min_lat,max_lon,max_lat')
+
+    if min_lon > max_lon or min_lat > max_lat:
+        raise UserWarning(f'Invalid bounding box: {value}, minimum above maximum')
+
+    return (min_lon, min_lat, max_lon, max_lat)
+
+
+def parse_interval(value: str | None) -> tuple[int | None, int | None]:
+    # 'from/to' (ISO 8601 interval), either end can be empty
+    if not value:
+        return (None, None)
+
+    if '/' not in value:
+        raise UserWarning(f'Invalid time interval: {value}, expected FROM/TO')
+
+    time_from, time_to = value.split('/', 1)
+    return (parse_time(time_from) if time_from else None, parse_time(time_to) if time_to else None)
+
+
+@click.command(name='index', help='Build or update the spatial index of the FVC files of a directory')
+@click.pass_obj
+@click.option('--db', type=Path, help=f'Index database (default {SPATIAL_INDEX_NAME} in the directory)')
+@click.option(
+    '--jobs', help='Number of parallel indexing processes (0 for all CPUs)',
+    type=click.IntRange(min=0), default=1
+)
+def index(params, db, jobs):
+    input_dir = params['input'].as_dir()
+    start = time.perf_counter()
+
+    with SpatialIndex(index_db_path(input_dir, db)) as spatial_index:
+        result = spatial_index.update(input_dir, jobs or os.cpu_count() or 1)
+
+    lg.info(
+        f'Index updated in {time.perf_counter() - start:.2f} s: {result["indexed"]} indexed, '
+        f'{result["removed"]} removed, {result["failed"]} failed, {result["files"]} files'
+    )
+
+    if params['JSON']:
+        json_print(params, result)
+
+
+@click.command(help='Find the tracks of indexed FVC files crossing a bounding box')
+@click.pass_obj
+@click.option('--db', type=Path, help=f'Index database (default {SPATIAL_INDEX_NAME} in the directory)')
+@click.option('--bbox', required=True, help='Bounding box: min_lon,min_lat,max_lon,max_lat')
+@click.option('--time', 'interval', help='Time interval: FROM/TO (ISO 8601 or Unix epoch, either can be empty)')
+def query(params, db, bbox, interval):
+    input_dir = params['input'].as_dir()
+    db_path = index_db_path(input_dir, db)
+
+    if not db_path.exists():
+        raise UserWarning(f'No spatial index in {input_dir}, run "index" first')
+
+    with SpatialIndex(db_path) as spatial_index:
+        tracks = spatial_index.query(parse_bbox(bbox), *parse_interval(interval))
+
+    if params['JSON']:
+        json_print(params, {'tracks': tracks})
+        return
+
+    for track in tracks:
+        ranges = ' '.join(f'{start}-{end}' for start, end in track['ranges'])
+        print(f'{track["file"]}\t{track["uaid"]}\t{track["from"]}\t{track["to"]}\t{ranges}')
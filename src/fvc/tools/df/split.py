@@ -0,0 +1,198 @@
+from collections import OrderedDict
+from datetime import datetime, UTC
+from pathlib import Path
+import logging as lg
+import re
+
+import click
+
+from fvc.tools.util import JSON, json_print
+from fvc.tools.df.codec import default_codec
+import fvc.tools.df.util as u
+
+
+SPLIT_KEYS = ['uaid', 'hour', 'day']
+# Output files kept open at once, the least recently written ones are closed
+DEFAULT_MAX_OPEN = 256
+# Records are buffered per output file, written when the file has FILE_BUFFER bytes pending
+# or all files together have BUFFER_SIZE bytes pending
+FILE_BUFFER = 64 << 10
+BUFFER_SIZE = 64 << 20
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+UNSAFE_RE = re.compile(r'[^A-Za-z0-9._-]')
+
+
+def uaid_key(record: JSON) -> str:
+    uaid = (record.get('uaid') or {}).get('int')
+    return 'unknown' if uaid is None else str(uaid)
+
+
+def time_key(period_ms: int, layout: str):
+    # Keys of time windows (UTC), formatted once per window
+    names = {}  # type: dict[int, str]
+
+    def key(record: JSON) -> str:
+        if (t := (record.get('time') or {}).get('unix')) is None:
+            return 'notime'
+
+        window = int(t // period_ms)
+
+        if (name := names.get(window)) is None:
+            name = names[window] = datetime.fromtimestamp(window * period_ms / 1000, UTC).strftime(layout)
+
+        return name
+
+    return key
+
+
+def split_key(by: str):
+    if by == 'uaid':
+        return uaid_key
+    elif by == 'hour':
+        return time_key(HOUR_MS, '%Y-%m-%dT%H')
+    else:
+        return time_key(DAY_MS, '%Y-%m-%d')
+
+
+# Output files by key, each starting with the same header line. At most 'max_open' files
+# are open: the least recently written one is closed to open another, and reopened later
+# for appending. Records are buffered per file, so files are written in blocks.
+class FilePool:
+    def __init__(self, directory: Path, header: str, max_open: int):
+        self._directory = directory
+        self._header = header
+        self._max_open = max_open
+        self._paths = {}  # type: dict[str, Path]
+        self._names = set()  # type: set[str]
+        self._created = set()  # type: set[str]
+        self._files = OrderedDict()  # type: OrderedDict
+        self._pending = {}  # type: dict[str, list[str]]
+        self._pending_sizes = {}  # type: dict[str, int]
+        self._pending_size = 0
+        self.opened = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            for f in self._files.values():
+                f.close()
+
+            self._files.clear()
+
+    def paths(self) -> dict[str, Path]:
+        return self._paths
+
+    def _new_path(self, key: str) -> Path:
+        # A file name safe on any platform, made unique if two keys differ only in unsafe characters
+        name = UNSAFE_RE.sub('_', key) or '_'
+        unique = name
+        n = 1
+
+        while unique.lower() in self._names:
+            n += 1
+            unique = f'{name}-{n}'
+
+        self._names.add(unique.lower())
+        return self._directory / f'{unique}.fvc'
+
+    def _open(self, key: str):
+        if (f := self._files.get(key)) is not None:
+            self._files.move_to_end(key)
+            return f
+
+        if len(self._files) >= self._max_open:
+            _, lru = self._files.popitem(last=False)
+            lru.close()
+
+        if key in self._created:
+            f = self._paths[key].open('ab')
+        else:
+            f = self._paths[key].open('wb')
+            f.write(self._header.encode('utf-8'))
+            self._created.add(key)
+
+        self.opened += 1
+        self._files[key] = f
+        return f
+
+    def _flush_key(self, key: str):
+        if not (lines := self._pending.pop(key, None)):
+            return
+
+        self._open(key).write(''.join(lines).encode('utf-8'))
+        self._pending_size -= self._pending_sizes.pop(key)
+
+    def write(self, key: str, line: str):
+        if (lines := self._pending.get(key)) is None:
+            lines = self._pending[key] = []
+            self._pending_sizes[key] = 0
+
+            if key not in self._paths:
+                # Files are named in the order keys appear
+                self._paths[key] = self._new_path(key)
+
+        lines.append(line)
+        self._pending_sizes[key] += len(line)
+        self._pending_size += len(line)
+
+        if self._pending_sizes[key] >= FILE_BUFFER:
+            self._flush_key(key)
+        elif self._pending_size >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        for key in list(self._pending):
+            self._flush_key(key)
+
+
+def split_file(input_path: Path, output_dir: Path, by: str, max_open: int) -> JSON:
+    codec = default_codec()
+    key = split_key(by)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    with u.open_fvc(input_path, 'r') as f:
+        metadata = f.read()
+
+        if not metadata:
+            raise UserWarning('No metadata found')
+
+        if (content := metadata.get('content')) not in ['flightlog', 'radarlog']:
+            raise UserWarning(f'Unsupported content type: {content}')
+
+        header = codec.encode(metadata) + u.LINE_SEPARATOR
+        count = 0
+
+        with FilePool(output_dir, header, max_open) as pool:
+            for record in f.iterate():
+                pool.write(key(record), codec.encode(record) + u.LINE_SEPARATOR)
+                count += 1
+
+    lg.debug(f'Output files opened {pool.opened} times')
+
+    return {
+        'records': count,
+        'files': {k: str(path) for k, path in pool.paths().items()}
+    }
+
+
+@click.command(help='Split a flightlog or radarlog into one file per track (uaid) or time window (UTC)')
+@click.pass_obj
+@click.option('--by', type=click.Choice(SPLIT_KEYS), required=True, help='Split key')
+@click.option(
+    '--max-open', type=click.IntRange(min=1), default=DEFAULT_MAX_OPEN,
+    help='Maximum number of output files open at once'
+)
+@click.argument('output-dir', type=Path, required=True)
+def split(params, by, max_open, output_dir):
+    result = split_file(params['input'].fetch(streamable=True), output_dir, by, max_open)
+    lg.info(f'{result["records"]} records split into {len(result["files"])} files in {output_dir}')
+
+    if params['JSON']:
+        json_print(params, result)
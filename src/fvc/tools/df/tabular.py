@@ -0,0 +1,332 @@
+from pathlib import Path
+import logging as lg
+
+import numpy as np
+import pandas as pd
+
+from fvc.tools.util import JSON
+from fvc.tools.timestamps import TimestampParser
+
+
+# Rows converted at once
+CHUNK_ROWS = 1 << 16
+
+# Fields with this value are left out of the record
+OMIT = object()
+
+DTYPES = {
+    int: np.dtype(np.int64),
+    float: np.dtype(np.float64),
+    str: np.dtype(object)
+}
+
+
+def scaled(divisor: int):
+    # Integers divided with a floor, e.g. nanoseconds to milliseconds
+    def convert(values: np.ndarray) -> np.ndarray:
+        return values // divisor
+
+    return convert
+
+
+def timestamps(parser: TimestampParser | None = None):
+    # Timestamps in any layout of TimestampParser, one parser per file
+    parser = parser or TimestampParser()
+
+    def convert(values: np.ndarray) -> np.ndarray:
+        return parser.parse_many(values.tolist())
+
+    return convert
+
+
+def each(function):
+    # A converter from a function of one value
+    def convert(values: np.ndarray) -> list:
+        return [function(value) for value in values.tolist()]
+
+    return convert
+
+
+class Column:
+    # A record field from one CSV column: its values are read as 'type' (int() and float()
+    # semantics), then converted. Optional fields are left out when the column is empty.
+    def __init__(self, name: str, type=str, convert=None, optional=False):
+        self.names = [name]
+        self.dtype = DTYPES[type]
+        self.convert = convert
+        self.optional = optional
+
+    def values(self, columns: dict[str, np.ndarray]) -> list:
+        raw = columns[self.names[0]]
+        values = raw if raw.dtype == self.dtype else raw.astype(self.dtype)
+
+        if self.convert:
+            values = self.convert(values)
+
+        values = values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+        if self.optional:
+            values = [OMIT if r == '' else v for r, v in zip(raw.tolist(), values)]
+
+        return values
+
+
+class Compose(Column):
+    # A record field from several CSV columns (strings), e.g. an identifier; the function
+    # takes a value of each column
+    def __init__(self, names: list[str], function, optional=False):
+        self.names = names
+        self.dtype = DTYPES[str]
+        self.function = function
+        self.optional = optional
+
+    def values(self, columns: dict[str, np.ndarray]) -> list:
+        values = list(map(self.function, *(columns[name].tolist() for name in self.names)))
+
+        if self.optional:
+            values = [OMIT if v == '' else v for v in values]
+
+        return values
+
+
+def without_omitted(node: dict) -> dict:
+    return {k: v for k, v in node.items() if v is not OMIT}
+
+
+def template_source(template: JSON, names: dict[str, str], prefix='') -> str:
+    items = []
+    optional = False
+
+    for key, value in template.items():
+        path = f'{prefix}{key}'
+
+        if isinstance(value, dict):
+            items.append(f'{key!r}: {template_source(value, names, f"{path}.")}')
+        else:
+            items.append(f'{key!r}: {names[path]}')
+            optional = optional or value.optional
+
+    source = '{' + ', '.join(items) + '}'
+    return f'without_omitted({source})' if optional else source
+
+
+def record_builder(template: JSON, paths: list[str]):
+    # A function of the field values (lists, in 'paths' order) returning the records: the
+    # template is compiled into a comprehension, as fast as building the dicts by hand
+    names = {path: f'v{i}' for i, path in enumerate(paths)}
+    variables = ', '.join(names.values())
+    source = f'lambda values: [{template_source(template, names)} for ({variables},) in zip(*values)]'
+    return eval(source, {'without_omitted': without_omitted})
+
+
+class TabularFormat:
+    # A CSV-like format declared as a record template, whose leaves are Column fields:
+    # - delimiter: the field delimiter
+    # - header: a function of the first line returning column names, by default the first
+    #   line is parsed as a CSV row
+    # - expect: column values every row must have, e.g. {'TimeZone': 'UTC'}
+    # - filters: column values of the rows to convert, other rows are skipped
+    # - required: columns which must not be empty, other rows are skipped with a warning
+    # - skip_errors: rows which fail to convert are skipped with an error (by default the
+    #   conversion stops)
+    def __init__(
+        self, source: str, template: JSON, delimiter=',', header=None,
+        expect=None, filters=None, required=None, skip_errors=False
+    ):
+        self.source = source
+        self.template = template
+        self.delimiter = delimiter
+        self.header = header
+        self.expect = expect or {}
+        self.filters = filters or {}
+        self.required = required or []
+        self.skip_errors = skip_errors
+        self.fields = dict(flatten_template(template))
+        self.build = record_builder(template, list(self.fields))
+
+    def dtypes(self) -> dict[str, np.dtype]:
+        # Columns read as numbers when all their fields are numbers, else as strings
+        dtypes = {name: DTYPES[str] for name in [*self.expect, *self.filters, *self.required]}
+
+        for field in self.fields.values():
+            for name in field.names:
+                dtypes[name] = field.dtype if dtypes.get(name, field.dtype) == field.dtype else DTYPES[str]
+
+        return dtypes
+
+    def is_flat(self) -> bool:
+        # All fields fit typed columns of columnar files, records can be written as columns
+        from fvc.tools.df.columnar import COLUMNS
+
+        return all(path in COLUMNS and not field.optional for path, field in self.fields.items())
+
+
+def flatten_template(template: JSON, prefix=''):
+    for key, value in template.items():
+        if isinstance(value, dict):
+            yield from flatten_template(value, f'{prefix}{key}.')
+        else:
+            yield f'{prefix}{key}', value
+
+
+class TabularReader:
+    # Rows are numbered as csv.DictReader does, from 2 for the first data row
+    def __init__(self, spec: TabularFormat):
+        self._spec = spec
+
+    def select(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        spec = self._spec
+
+        for name, expected in spec.expect.items():
+            if not (unexpected := (chunk[name] != expected).to_numpy()).any():
+                continue
+
+            value = chunk[name].to_numpy()[unexpected][0]
+            line = int(chunk.index[unexpected.argmax()]) + 2
+            raise UserWarning(f"Unexpected {name} '{value}' at line {line}, expected '{expected}'")
+
+        for name, value in spec.filters.items():
+            chunk = chunk[(chunk[name] == value).to_numpy()]
+
+        if spec.required:
+            missing = (chunk[spec.required] == '').any(axis=1).to_numpy()
+
+            for index in chunk.index[missing]:
+                lg.warning(f'Invalid data at line {int(index) + 2}')
+
+            chunk = chunk[~missing]
+
+        return chunk
+
+    def values(self, columns: dict[str, np.ndarray]) -> dict[str, list]:
+        return {path: field.values(columns) for path, field in self._spec.fields.items()}
+
+    def field_values(self, field: Column, columns: dict[str, np.ndarray], count: int, errors: dict[int, Exception]) -> list:
+        # Values of a field, converted value by value if the column has errors
+        try:
+            return field.values(columns)
+        except Exception:
+            pass
+
+        values = []
+
+        for i in range(count):
+            try:
+                values.extend(field.values({name: columns[name][i:i + 1] for name in field.names}))
+            except Exception as e:
+                errors.setdefault(i, e)
+                values.append(None)
+
+        return values
+
+    def records(self, columns: dict[str, np.ndarray], count: int) -> list:
+        spec = self._spec
+
+        if not spec.skip_errors:
+            return spec.build(self.values(columns).values())
+
+        # The first error of each row (in field order) is reported, as if records were built
+        # row by row, and the row is skipped
+        errors = {}  # type: dict[int, Exception]
+        values = [self.field_values(field, columns, count, errors) for field in spec.fields.values()]
+
+        if not errors:
+            return spec.build(values)
+
+        for i in sorted(errors):
+            lg.error(f'Error reading record: {errors[i]}')
+
+        rows = [i for i in range(count) if i not in errors]
+        return spec.build([[field_values[i] for i in rows] for field_values in values])
+
+
+def read_chunks(spec: TabularFormat, f, names: list[str] | None, typed: bool):
+    # Chunks of the rows of a binary handle, with typed columns or only strings
+    dtypes = spec.dtypes()
+
+    if not typed:
+        dtypes = {name: DTYPES[str] for name in dtypes}
+
+    try:
+        yield from pd.read_csv(
+            f, sep=spec.delimiter, names=names, header=None if names else 0,
+            usecols=list(dtypes), dtype=dtypes, keep_default_na=False, na_filter=False,
+            index_col=False, float_precision='round_trip', chunksize=CHUNK_ROWS
+        )
+    except pd.errors.EmptyDataError:
+        return
+
+
+def open_rows(spec: TabularFormat, input_path: Path):
+    # A binary handle at the first row (or at the header line the CSV parser reads) and the column
+    # names, None if the file is empty; inputs are opened, not given to pandas, so that streamed
+    # remote files are read as local ones
+    f = input_path.open('rb')
+
+    if not spec.header:
+        return f, None
+
+    if not (line := f.readline()):
+        f.close()
+        return None, None
+
+    return f, spec.header(line.decode('utf-8'))
+
+
+def iterate_chunks(spec: TabularFormat, input_path: Path, f, names: list[str] | None):
+    # Numbers are parsed by the CSV parser; if a chunk has a value it does not parse, the rest is
+    # read again as strings and values are converted with int() and float()
+    done = 0
+
+    try:
+        for chunk in read_chunks(spec, f, names, True):
+            yield chunk
+            done += len(chunk)
+
+    except pd.errors.ParserError:
+        # Malformed rows, not values: reading them as strings would fail the same way
+        raise
+
+    except (ValueError, OverflowError) as e:
+        if 'Usecols' in str(e):
+            raise UserWarning(f'Unexpected {spec.source} columns: {e}')
+
+        lg.debug(f'Reading the rest of {input_path} as strings ({e})')
+
+    else:
+        return
+
+    f, names = open_rows(spec, input_path)
+
+    with f:
+        for chunk in read_chunks(spec, f, names, False):
+            if chunk.index[0] < done:
+                chunk = chunk[chunk.index >= done]
+
+            if not chunk.empty:
+                yield chunk
+
+
+def convert(spec: TabularFormat, metadata: JSON, input_path: Path, output):
+    f, names = open_rows(spec, input_path)
+
+    if f is None:
+        return
+
+    with f:
+        metadata.update({'content': 'flightlog', 'source': spec.source})
+        output.write(metadata)
+
+        reader = TabularReader(spec)
+        as_columns = hasattr(output, 'write_columns') and spec.is_flat() and not spec.skip_errors
+
+        for chunk in iterate_chunks(spec, input_path, f, names):
+            if (chunk := reader.select(chunk)).empty:
+                continue
+
+            columns = {name: chunk[name].to_numpy() for name in chunk.columns}
+
+            if as_columns:
+                output.write_columns(reader.values(columns))
+            else:
+                output.write_many(reader.records(columns, len(chunk)))
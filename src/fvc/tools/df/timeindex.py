@@ -0,0 +1,275 @@
+from pathlib import Path
+from bisect import bisect_right
+import json
+import logging as lg
+import os
+
+import click
+
+from fvc.tools.util import JSON, json_print
+from fvc.tools.timestamps import TimestampParser
+from fvc.tools.df.codec import default_codec
+from fvc.tools.df.compressed import frame_index, open_compressed, read_frames
+import fvc.tools.df.util as u
+
+
+TIME_INDEX_SUFFIX = '.tidx'
+TIME_INDEX_VERSION = 1
+DEFAULT_BUCKET_SECONDS = 60
+
+# Line ranges closer than this are read together, so the index stays small for
+# interleaved tracks; records outside of the requested window are filtered out anyway
+RANGE_GAP = 64 << 10
+
+
+def index_path(filepath: Path) -> Path:
+    return filepath.with_name(filepath.name + TIME_INDEX_SUFFIX)
+
+
+def source_fingerprint(filepath: Path) -> JSON:
+    stat = filepath.stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def add_range(ranges: list[list[int]], start: int, end: int):
+    if ranges and start - ranges[-1][1] <= RANGE_GAP:
+        ranges[-1][1] = max(ranges[-1][1], end)
+    else:
+        ranges.append([start, end])
+
+
+def merge_ranges(ranges) -> list[list[int]]:
+    merged = []  # type: list[list[int]]
+
+    for start, end in sorted(ranges):
+        add_range(merged, start, end)
+
+    return merged
+
+
+def iterate_lines(filepath: Path):
+    # (content offset, line) of every line; offsets of compressed files are uncompressed offsets
+    if u.is_columnar(filepath):
+        raise UserWarning('Time index is not supported for columnar files')
+
+    opener = open_compressed(filepath, 'r') if u.is_compressed(filepath) else filepath.open('rb')
+    offset = 0
+
+    with opener as f:
+        for line in f:
+            yield offset, line
+            offset += len(line)
+
+
+def build_time_index(filepath: Path, bucket_seconds=DEFAULT_BUCKET_SECONDS, by_uaid=False) -> JSON:
+    bucket_ms = bucket_seconds * 1000
+    decode = default_codec().decode
+    buckets = {}  # type: dict[int, list[list[int]]]
+    uaids = {}  # type: dict[str, dict[int, list[list[int]]]]
+    data_start = None
+    records = 0
+
+    lg.info(f'Building time index of {filepath}')
+
+    for offset, line in iterate_lines(filepath):
+        if data_start is None:
+            # The metadata line
+            data_start = offset + len(line)
+            continue
+
+        if not line.strip():
+            break
+
+        try:
+            record = decode(line)
+        except ValueError as e:
+            lg.warning(f'Invalid JSON at offset {offset}, not indexed: {e}')
+            continue
+
+        time = (record.get('time') or {}).get('unix')
+
+        if time is None:
+            continue
+
+        bucket = int(time // bucket_ms)
+        end = offset + len(line)
+        add_range(buckets.setdefault(bucket, []), offset, end)
+        records += 1
+
+        if by_uaid and (uaid := (record.get('uaid') or {}).get('int')) is not None:
+            add_range(uaids.setdefault(str(uaid), {}).setdefault(bucket, []), offset, end)
+
+    index = {
+        'version': TIME_INDEX_VERSION,
+        'source': source_fingerprint(filepath),
+        'bucket_ms': bucket_ms,
+        'data_start': data_start or 0,
+        'records': records,
+        'buckets': {str(b): r for b, r in sorted(buckets.items())}
+    }  # type: JSON
+
+    if by_uaid:
+        index['uaids'] = {
+            uaid: {str(b): r for b, r in sorted(uaid_buckets.items())}
+            for uaid, uaid_buckets in uaids.items()
+        }
+
+    path = index_path(filepath)
+    temp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    temp_path.write_text(json.dumps(index, separators=(',', ':')))
+    os.replace(temp_path, path)
+    lg.info(f'Time index written to {path} ({len(buckets)} buckets, {records} records)')
+    return index
+
+
+def read_time_index(filepath: Path) -> JSON:
+    # Empty if there is no index
+    try:
+        return json.loads(index_path(filepath).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def is_current(index: JSON, filepath: Path) -> bool:
+    return index.get('version') == TIME_INDEX_VERSION and index.get('source') == source_fingerprint(filepath)
+
+
+def select_ranges(index: JSON, time_from: int, time_to: int, uaid: str | None = None) -> list[list[int]]:
+    bucket_ms = index['bucket_ms']
+    # Without a uaid index, the records of the time buckets are filtered by slice_records
+    buckets = index['uaids'].get(uaid, {}) if uaid is not None and 'uaids' in index else index['buckets']
+    first = time_from // bucket_ms
+    last = (time_to - 1) // bucket_ms
+    ranges = []
+
+    for key, bucket_ranges in buckets.items():
+        if first <= int(key) <= last:
+            ranges.extend(bucket_ranges)
+
+    return merge_ranges(ranges)
+
+
+def read_ranges(filepath: Path, ranges: list[list[int]]):
+    # Content of the ranges, for compressed files by decompressing only the frames they overlap
+    if not u.is_compressed(filepath):
+        with filepath.open('rb') as f:
+            for start, end in ranges:
+                f.seek(start)
+                yield f.read(end - start)
+
+        return
+
+    frames = frame_index(filepath)
+
+    if frames is None:
+        raise UserWarning(f'Compressed file {filepath} has no frame index, it cannot be sliced')
+
+    starts = [frame.content_offset for frame in frames]
+    cached = (None, b'')
+
+    for start, end in ranges:
+        parts = []
+        i = bisect_right(starts, start) - 1
+
+        while i < len(frames) and frames[i].content_offset < end:
+            frame = frames[i]
+
+            if cached[0] != frame:
+                cached = (frame, next(read_frames(filepath, [frame])))
+
+            data = cached[1]
+            parts.append(data[max(start - frame.content_offset, 0):end - frame.content_offset])
+            i += 1
+
+        yield b''.join(parts)
+
+
+def read_metadata_line(filepath: Path) -> bytes:
+    for _, line in iterate_lines(filepath):
+        return line
+
+    raise UserWarning('No metadata found')
+
+
+def slice_records(filepath: Path, index: JSON, time_from: int, time_to: int, uaid: str | None = None):
+    decode = default_codec().decode
+
+    for data in read_ranges(filepath, select_ranges(index, time_from, time_to, uaid)):
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+
+            record = decode(line)
+            time = (record.get('time') or {}).get('unix')
+
+            if time is None or not time_from <= time < time_to:
+                continue
+
+            if uaid is not None and str((record.get('uaid') or {}).get('int')) != uaid:
+                continue
+
+            yield record
+
+
+def parse_time(value: str) -> int:
+    try:
+        return TimestampParser().parse(value)
+    except (ValueError, OverflowError):
+        raise UserWarning(f'Invalid time: {value}')
+
+
+def ensure_time_index(filepath: Path, by_uaid=False) -> JSON:
+    # An index is rebuilt only if the file changed, with the same bucket length and uaid index
+    index = read_time_index(filepath)
+
+    if is_current(index, filepath):
+        return index
+
+    if index:
+        lg.info(f'Time index of {filepath} is out of date')
+
+    bucket_ms = index.get('bucket_ms')
+    compatible = index.get('version') == TIME_INDEX_VERSION and isinstance(bucket_ms, int) and bucket_ms > 0 and bucket_ms % 1000 == 0
+    bucket_seconds = bucket_ms // 1000 if compatible else DEFAULT_BUCKET_SECONDS
+    return build_time_index(filepath, bucket_seconds, by_uaid or 'uaids' in index)
+
+
+@click.command(name='time-index', help='Build the time index of a FVC file, used by slice')
+@click.pass_obj
+@click.option(
+    '--bucket', 'bucket_seconds', type=click.IntRange(min=1), default=DEFAULT_BUCKET_SECONDS,
+    help='Time bucket length in seconds'
+)
+@click.option('--by-uaid', is_flag=True, help='Also index by unique identifier (uaid.int)')
+def time_index(params, bucket_seconds, by_uaid):
+    build_time_index(params['input'].fetch(), bucket_seconds, by_uaid)
+
+
+@click.command(name='slice', help='Extract a time window (and optionally one aircraft) from a FVC file')
+@click.pass_obj
+@click.option('--from', 'time_from', required=True, help='Start time, inclusive (ISO 8601 or Unix epoch)')
+@click.option('--to', 'time_to', required=True, help='End time, exclusive (ISO 8601 or Unix epoch)')
+@click.option('--uaid', help='Unique identifier (uaid.int) to extract')
+@click.argument('output-file', type=Path, required=True)
+def slice_command(params, time_from, time_to, uaid, output_file):
+    input_path = params['input'].fetch()
+    time_from = parse_time(time_from)
+    time_to = parse_time(time_to)
+
+    if time_to <= time_from:
+        raise UserWarning('The end of the time window must be after its start')
+
+    index = ensure_time_index(input_path, by_uaid=uaid is not None)
+    count = 0
+
+    with u.open_fvc(output_file, 'w') as output:
+        output.write(default_codec().decode(read_metadata_line(input_path)))
+
+        for record in slice_records(input_path, index, time_from, time_to, uaid):
+            output.write(record)
+            count += 1
+
+    lg.info(f'{count} records written to {output_file}')
+
+    if params['JSON']:
+        json_print(params, {'records': count, 'output': str(output_file)})
@@ -0,0 +1,87 @@
+import logging as lg
+import tempfile
+
+import numpy as np
+
+
+# Points kept in memory before they are spilled to a temporary file
+SPOOL_POINTS = 1 << 20
+
+
+class TrackSpool:
+    # Points of interleaved tracks grouped by track with bounded memory: points are kept
+    # in memory up to max_points, then spilled to a temporary file in runs, with each run
+    # holding the points of a track contiguously. Points are rows of 'width' floats.
+    def __init__(self, width: int, max_points=SPOOL_POINTS):
+        self.width = width
+        self._max_points = max_points
+        self._tracks = {}  # type: dict[str | None, list[tuple]]
+        self._order = {}  # type: dict[str | None, None]
+        self._runs = []  # type: list[dict[str | None, tuple[int, int]]]
+        self._file = None
+        self._points = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def add(self, uaid: str | None, point: tuple):
+        if (points := self._tracks.get(uaid)) is None:
+            points = self._tracks[uaid] = []
+            self._order[uaid] = None
+
+        points.append(point)
+        self._points += 1
+
+        if self._points >= self._max_points:
+            self._spill()
+
+    def _spill(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='fvc-tracks-')
+            lg.debug(f'Spilling track points to a temporary file (over {self._max_points} points)')
+
+        run = {}
+
+        for uaid, points in self._tracks.items():
+            data = np.asarray(points, dtype=np.float64).tobytes()
+            run[uaid] = (self._file.tell(), len(points))
+            self._file.write(data)
+
+        self._runs.append(run)
+        self._tracks = {}
+        self._points = 0
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def tracks(self):
+        # (uaid, points as an array of shape (n, width)) in the order tracks first appear
+        for uaid in self._order:
+            parts = []
+
+            for run in self._runs:
+                if (entry := run.get(uaid)) is not None:
+                    offset, count = entry
+                    self._file.seek(offset)
+                    data = self._file.read(count * self.width * 8)
+                    parts.append(np.frombuffer(data, dtype=np.float64).reshape(count, self.width))
+
+            if points := self._tracks.get(uaid):
+                parts.append(np.asarray(points, dtype=np.float64))
+
+            yield uaid, np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+
+def split_at_gaps(times: np.ndarray, gap: float) -> list[slice]:
+    # Parts of a track separated by gaps longer than 'gap' (same unit as times)
+    cuts = np.flatnonzero(np.diff(times) > gap) + 1
+    bounds = [0, *cuts.tolist(), len(times)]
+    return [slice(a, b) for a, b in zip(bounds, bounds[1:])]
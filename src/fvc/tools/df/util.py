@@ -1,30 +1,53 @@
-import json
+import os
+from itertools import islice
 from pathlib import Path
 from typing import Literal
 import logging as lg
 
-import boto3
-
 from fvc.tools.util import JSON
+from fvc.tools.df.codec import default_codec
+from fvc.tools.df.cache import open_cache
+from fvc.tools.df.compressed import COMPRESSIONS, open_compressed, content_size, frame_index, read_frames
+
+
+BLOCK_SIZE = 1 << 20
+# Records encoded at once by write_many
+WRITE_BATCH = 1024
+# Size of the byte ranges processed in parallel
+CHUNK_SIZE = 16 << 20
+
+# Written as text mode files used to be, so outputs stay byte-compatible
+LINE_SEPARATOR = os.linesep
 
 
 class JsonlinesIO:
-    def __init__(self, filepath: Path, mode: Literal['r', 'w'], callback=None):
+    def __init__(self, filepath: Path, mode: Literal['r', 'w'], callback=None, codec=None):
         self._filepath = filepath
         self._mode = mode
         self._file = None  # IO | None
         self._callback = callback
+        self._codec = codec or default_codec()
+        self._pending = []  # type: list[str]
 
     def stat_size(self):
-        return self._filepath.stat().st_size
+        return content_size(self._filepath)
 
     def __enter__(self):
-        self._file = self._filepath.open(f'{self._mode}t', encoding='utf-8', newline=None)
+        if is_compressed(self._filepath):
+            self._file = open_compressed(self._filepath, self._mode, BLOCK_SIZE)
+        else:
+            self._file = self._filepath.open(f'{self._mode}b', buffering=BLOCK_SIZE)
+
         self._in_line_no = 0
+        self._pending = []
+        self._pending_size = 0
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         if self._file:
+            if self._mode == 'w':
+                self.flush()
+
             self._file.close()
 
     def _check_entered(self):
@@ -40,32 +63,146 @@ class JsonlinesIO:
             raise RuntimeError('File is not open')
 
         self._in_line_no += 1
-        last_read_bytes = len(line) + 2  # \n\r
 
         if self._callback:
-            self._callback(last_read_bytes)
+            self._callback(len(line))
 
         if not line.strip():
             return None
 
-        return json.loads(line)
+        return self._codec.decode(line)
 
     def in_line_no(self):
         return self._in_line_no
 
     def write(self, data):
         self._check_entered()
+        line = self._codec.encode(data)
+        self._pending.append(line)
+        self._pending_size += len(line)
 
-        if self._file:
-            self._file.write(json.dumps(data) + '\n')
-        else:
-            raise RuntimeError('File is not open')
+        if self._pending_size >= BLOCK_SIZE:
+            self.flush()
+
+    def write_many(self, records):
+        # As write() on each record, encoded in batches
+        self._check_entered()
+        records = iter(records)
+
+        while lines := list(map(self._codec.encode, islice(records, WRITE_BATCH))):
+            self._pending.extend(lines)
+            self._pending_size += sum(map(len, lines))
+
+            if self._pending_size >= BLOCK_SIZE:
+                self.flush()
+
+    def flush(self):
+        self._check_entered()
+
+        if self._pending:
+            self._pending.append('')
+            block = LINE_SEPARATOR.join(self._pending)
+            self._file.write(block.encode('utf-8'))  # type: ignore
+            self._pending = []
+            self._pending_size = 0
 
     def iterate(self):
         while data := self.read():
             yield data
 
 
+COLUMNAR_SUFFIX = '.fvc.parquet'
+# Index files kept next to FVC files, and cached data next to input files
+SENSOR_CACHE_SUFFIX = '.fvcsensor'
+SIDECAR_SUFFIXES = {'.tidx', SENSOR_CACHE_SUFFIX}
+
+
+def is_columnar(filepath: Path) -> bool:
+    return filepath.name.endswith('.parquet')
+
+
+def is_compressed(filepath: Path) -> bool:
+    return filepath.suffix in COMPRESSIONS
+
+
+def is_fvc_file(filepath: Path) -> bool:
+    if is_compressed(filepath):
+        filepath = filepath.with_suffix('')
+
+    return filepath.suffix == '.fvc' or filepath.name.endswith(COLUMNAR_SUFFIX)
+
+
+def is_sidecar(filepath: Path) -> bool:
+    return filepath.suffix in SIDECAR_SUFFIXES
+
+
+def with_fvc_suffix(filepath: Path, suffix: str) -> Path:
+    # 'x.fvc.zst' becomes 'x<suffix>' as 'x.fvc' does
+    if is_compressed(filepath):
+        filepath = filepath.with_suffix('')
+
+    return filepath.with_suffix(suffix)
+
+
+def open_fvc(filepath: Path, mode: Literal['r', 'w'], callback=None):
+    if is_columnar(filepath):
+        # Imported on demand, pyarrow is an optional dependency
+        from fvc.tools.df.columnar import ParquetIO
+        return ParquetIO(filepath, mode, callback)
+
+    return JsonlinesIO(filepath, mode, callback)
+
+
+def plan_chunks(filepath: Path) -> list[dict] | None:
+    # Newline-aligned byte ranges, or the frames of a compressed file; the first chunk
+    # starts with the metadata line. None if the file can only be read sequentially.
+    if not isinstance(filepath, Path) or is_columnar(filepath):
+        return None
+
+    if is_compressed(filepath):
+        frames = frame_index(filepath)
+
+        if frames is None:
+            return None
+
+        return [
+            {'index': i, 'start': 0, 'end': 0, 'frame': frame, 'skip_first': i == 0}
+            for i, frame in enumerate(frames)
+        ]
+
+    chunks = []
+    size = filepath.stat().st_size
+
+    with filepath.open('rb') as f:
+        start = 0
+
+        while start < size:
+            f.seek(min(start + CHUNK_SIZE, size))
+            f.readline()
+            end = min(f.tell(), size)
+            chunks.append({'index': len(chunks), 'start': start, 'end': end, 'frame': None, 'skip_first': start == 0})
+            start = end
+
+    return chunks
+
+
+def read_chunk_lines(filepath: Path, start: int, end: int, frame=None) -> tuple[list[bytes], int]:
+    # Lines of a chunk planned by plan_chunks and its content size
+    if frame:
+        data = b''.join(read_frames(filepath, [frame]))
+    else:
+        with filepath.open('rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+
+    lines = data.split(b'\n')
+
+    if lines and not lines[-1]:
+        lines.pop()
+
+    return lines, len(data)
+
+
 def progress_bar(bytes_amount):
     lg.info(f'Downloaded {bytes_amount} bytes')
 
@@ -74,6 +211,9 @@ class Input:
     def __init__(self, params, input_uri):
         self._params = params
         self._input_uri = input_uri
+        self._remote = None
+        # The cached copy of an S3 input, so that the cache is looked up once per command
+        self._local = None  # type: Path | None
 
     def __str__(self) -> str:
         return str(self._input_uri)
@@ -89,35 +229,45 @@ class Input:
 
         return directory
 
-    def fetch(self) -> Path:
+    def _s3_location(self):
+        path = Path(self._input_uri)
+        bucket_name = path.parts[1]
+        key = '/'.join(path.parts[2:])
+        lg.debug(f'Bucket: {bucket_name}, Key: {key}')
+        return bucket_name, key
+
+    def fetch(self, streamable=False):
+        # With 'streamable', the caller only opens and reads the input (no random access),
+        # so in streaming mode an S3 object is processed while it is being downloaded
         if not self._input_uri:
             raise UserWarning('Input file or URI (--input-file) is not specified')
 
         path = Path(self._input_uri)
 
         if self._input_uri.startswith('s3://'):
-            cache_dir = self._params.get('cache_dir')
+            if self._remote:
+                return self._remote
 
-            if not cache_dir:
-                raise UserWarning('Cache directory should be specified for external data')
+            if self._local:
+                return self._local
 
-            cache_dir_path = Path(cache_dir)
-            cache_dir_path.mkdir(parents=True, exist_ok=True)
-            rel_path = path.relative_to('s3://')
-            local_path = (cache_dir_path / rel_path).resolve()
+            import boto3
+            s3_cache = open_cache(self._params)
+            bucket_name, key = self._s3_location()
+            s3 = boto3.client('s3')
+            local_path = s3_cache.path_for(bucket_name, key)
 
-            if local_path.exists():
-                lg.info(f'Using cached file: {local_path}')
-                return local_path
+            if streamable and self._params.get('stream') and not is_columnar(local_path):
+                head = s3_cache.head(s3, bucket_name, key)
 
-            lg.info(f'Fetching to {local_path}')
-            local_path.parent.mkdir(parents=True, exist_ok=True)
-            bucket_name = path.parts[1]
-            key = '/'.join(path.parts[2:])
-            lg.debug(f'Bucket: {bucket_name}, Key: {key}')
-            s3 = boto3.client('s3')
-            s3.download_file(bucket_name, key, str(local_path), Callback=progress_bar)
-            return local_path
+                if head and not s3_cache.is_valid(local_path, head):
+                    from fvc.tools.df.remote import RemotePath
+                    lg.info(f'Streaming {self} to {local_path}')
+                    self._remote = RemotePath(s3, bucket_name, key, local_path, head, s3_cache.store)
+                    return self._remote
+
+            self._local = s3_cache.fetch(s3, bucket_name, key, callback=progress_bar)
+            return self._local
 
         else:
             if path.exists():
@@ -125,6 +275,25 @@ class Input:
 
         raise UserWarning(f'Unable to resolve input file: {self}')
 
+    def peek(self):
+        # The input as far as checking whether an output is up to date: an S3 object is described
+        # by its metadata (HEAD), without downloading it. Its size and mtime match the cached copy.
+        if not (self._input_uri and self._input_uri.startswith('s3://')) or self._remote or self._local:
+            return self.fetch()
+
+        import boto3
+        s3_cache = open_cache(self._params)
+        bucket_name, key = self._s3_location()
+        s3 = boto3.client('s3')
+        head = s3_cache.head(s3, bucket_name, key)
+
+        if head is None:
+            # Offline, the cached copy (if any) is checked instead
+            return self.fetch()
+
+        from fvc.tools.df.remote import RemotePath
+        return RemotePath(s3, bucket_name, key, s3_cache.path_for(bucket_name, key), head, s3_cache.store)
+
 
 class JsonQuery:
     def __init__(self, query: str, default=None):
@@ -0,0 +1,312 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import logging as lg
+import multiprocessing
+import sys
+
+import click
+import jsonschema
+from jsonschema.exceptions import best_match
+
+import fvc.tools.df.schema as schema
+import fvc.tools.df.util as u
+from fvc.tools.df.codec import default_codec
+
+
+MAX_ERRORS = 100
+STOP_CHECK_LINES = 4096
+
+
+class Unsupported(Exception):
+    pass
+
+
+TYPE_EXPRESSIONS = {
+    'object': 'isinstance({v}, dict)',
+    'array': 'isinstance({v}, list)',
+    'string': 'isinstance({v}, str)',
+    'number': '(type({v}) is float or type({v}) is int or (isinstance({v}, (int, float)) and not isinstance({v}, bool)))',
+    'integer': '((isinstance({v}, int) and not isinstance({v}, bool)) or (isinstance({v}, float) and {v}.is_integer()))',
+    'boolean': 'isinstance({v}, bool)',
+    'null': '{v} is None'
+}
+
+# Keywords understood by the generated checks ('optional' is an annotation of our schema)
+CHECK_KEYWORDS = {'type', 'properties', 'required', 'anyOf', 'enum', 'items', 'additionalProperties', 'optional'}
+
+
+class CheckGenerator:
+    # Generates the source of plain Python functions checking a schema subset,
+    # with nested conditions instead of a walk over the schema for every record
+    def __init__(self):
+        self.sources = []  # type: list[str]
+        self.namespace = {'MISSING': object()}
+        self._names = 0
+
+    def name(self, prefix: str) -> str:
+        self._names += 1
+        return f'{prefix}{self._names}'
+
+    def function(self, node) -> str:
+        name = self.name('check')
+        body = self.body(node, 'v', 1)
+        self.sources.append('\n'.join([f'def {name}(v):', *body, '    return True', '']))
+        return name
+
+    def body(self, node, var: str, indent: int) -> list[str]:
+        if not isinstance(node, dict) or set(node) - CHECK_KEYWORDS:
+            raise Unsupported()
+
+        if node.get('additionalProperties', True) is not True:
+            raise Unsupported()
+
+        pad = '    ' * indent
+        lines = []
+
+        if 'type' in node:
+            names = node['type'] if isinstance(node['type'], list) else [node['type']]
+
+            if any(name not in TYPE_EXPRESSIONS for name in names):
+                raise Unsupported()
+
+            condition = ' or '.join(TYPE_EXPRESSIONS[name].format(v=var) for name in names)
+            lines.append(f'{pad}if not ({condition}): return False')
+
+        if 'enum' in node:
+            if not all(isinstance(value, str) for value in node['enum']):
+                raise Unsupported()
+
+            values = self.name('values')
+            self.namespace[values] = frozenset(node['enum'])
+            lines.append(f'{pad}if not (isinstance({var}, str) and {var} in {values}): return False')
+
+        if 'properties' in node or 'required' in node:
+            # Like in JSON schema, these keywords do not apply to other types
+            lines.append(f'{pad}if isinstance({var}, dict):')
+            inner = pad + '    '
+            lines.extend(f'{inner}if {key!r} not in {var}: return False' for key in node.get('required', []))
+
+            for key, sub in node.get('properties', {}).items():
+                child = self.name('v')
+
+                if sub_lines := self.body(sub, child, indent + 2):
+                    lines.append(f'{inner}{child} = {var}.get({key!r}, MISSING)')
+                    lines.append(f'{inner}if {child} is not MISSING:')
+                    lines.extend(sub_lines)
+
+            lines.append(f'{inner}pass')
+
+        if 'anyOf' in node:
+            alternatives = [self.function(sub) for sub in node['anyOf']]
+            lines.append(f'{pad}if not ({" or ".join(f"{name}({var})" for name in alternatives)}): return False')
+
+        if 'items' in node:
+            item_check = self.function(node['items'])
+            lines.append(f'{pad}if isinstance({var}, list) and not all(map({item_check}, {var})): return False')
+
+        return lines
+
+    def build(self, node):
+        name = self.function(node)
+        exec('\n'.join(self.sources), self.namespace)
+        return self.namespace[name]
+
+
+def compile_check(node):
+    # A generated predicate: True means valid, False means "run the full validator"
+    # (which also produces the error message); None if the schema is not supported
+    try:
+        return CheckGenerator().build(node)
+    except Unsupported:
+        return None
+
+
+class Checker:
+    def __init__(self, content_schema):
+        validator_class = jsonschema.validators.validator_for(content_schema)
+        validator_class.check_schema(content_schema)
+        self._validator = validator_class(content_schema)
+        self._fast_check = compile_check(content_schema)
+
+    def error(self, record) -> str | None:
+        if self._fast_check and self._fast_check(record):
+            return None
+
+        if error := best_match(self._validator.iter_errors(record)):
+            return str(error)
+
+        return None
+
+
+@lru_cache
+def checker(content: str) -> Checker:
+    # Built once per content type (and process)
+    return Checker(schema.CONTENT_SCHEMA[content])
+
+
+class ErrorCounts:
+    # Errors found per chunk, shared by the worker processes: a chunk stops when the chunks
+    # up to it have MAX_ERRORS errors, so the reported errors are the first ones of the file
+    def __init__(self, counts):
+        self._counts = counts
+
+    def add(self, index: int):
+        self._counts[index] += 1
+
+    def reached(self, index: int) -> bool:
+        return sum(self._counts[:index + 1]) >= MAX_ERRORS
+
+
+_error_counts = ErrorCounts([])
+
+
+def init_worker(counts):
+    global _error_counts
+    _error_counts = ErrorCounts(counts)
+
+
+def validate_chunk(content: str, filepath: Path, index: int, start: int, end: int, frame=None, skip_first=False):
+    # Validates the lines of a byte range (or a compressed frame); line numbers are relative
+    # to the chunk and made absolute by the caller from the line counts of previous chunks
+    lines, size = u.read_chunk_lines(filepath, start, end, frame)
+    result = {'lines': len(lines), 'errors': [], 'blank': None, 'size': size}
+    decode = default_codec().decode
+    check = checker(content)
+
+    for line_no, line in enumerate(lines, 1):
+        if skip_first and line_no == 1:
+            continue
+
+        if not line.strip():
+            # Reading stops at the first empty line
+            result['blank'] = line_no
+            break
+
+        if line_no % STOP_CHECK_LINES == 0 and _error_counts.reached(index):
+            break
+
+        try:
+            message = check.error(decode(line))
+        except ValueError as e:
+            message = f'Invalid JSON: {e}'
+
+        if message:
+            result['errors'].append((line_no, message))
+            _error_counts.add(index)
+
+            if _error_counts.reached(index):
+                break
+
+    return result
+
+
+def run_chunks(content: str, filepath: Path, chunks: list[dict], jobs: int, bar):
+    if jobs <= 1 or len(chunks) <= 1:
+        init_worker([0] * len(chunks))
+
+        for chunk in chunks:
+            result = validate_chunk(content, filepath, **chunk)
+            bar.update(result['size'])
+            yield result
+
+        return
+
+    # Without a lock: each chunk count is written by one process only
+    counts = multiprocessing.Array('i', len(chunks), lock=False)
+
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(chunks)), initializer=init_worker, initargs=(counts,)
+    ) as executor:
+        futures = [executor.submit(validate_chunk, content, filepath, **chunk) for chunk in chunks]
+
+        try:
+            for future in futures:
+                result = future.result()
+                bar.update(result['size'])
+                yield result
+
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def validate_records(f, check: Checker):
+    # Sequential validation, for input which cannot be split (streamed or columnar)
+    error_count = 0
+
+    while True:
+        try:
+            if (data := f.read()) is None:
+                break
+
+            message = check.error(data)
+
+        except ValueError as e:
+            message = f'Invalid JSON: {e}'
+
+        if message:
+            lg.error(f'Validation error at line {f.in_line_no()}: {message}')
+            error_count += 1
+
+        if error_count >= MAX_ERRORS:
+            lg.error(f'Maximum number of errors reached ({MAX_ERRORS}), stopping')
+            return None
+
+    return error_count
+
+
+def is_valid(input_path: Path, jobs=1):
+    with click.progressbar(
+        length=u.content_size(input_path),
+        label='Validating data',
+        file=sys.stderr
+    ) as bar:
+        with u.open_fvc(input_path, 'r', callback=lambda s: bar.update(s)) as f:
+            try:
+                metaline = f.read()
+
+                if not metaline:
+                    raise UserWarning('Cannon read a metadata line')
+
+                jsonschema.validate(metaline, schema.METADATA)
+                content = metaline['content']
+
+                if content not in schema.CONTENT_SCHEMA:
+                    raise UserWarning(f'Unknown content type: {content}')
+
+                check = checker(content)
+
+            except Exception as e:
+                lg.error(f'Metadata validation error at line {f.in_line_no()}: {e}')
+                return False
+
+            chunks = u.plan_chunks(input_path)
+
+            if chunks is None:
+                error_count = validate_records(f, check)
+
+                if error_count is None:
+                    return False
+
+        if chunks is not None:
+            error_count = 0
+            line_offset = 0
+
+            for result in run_chunks(content, input_path, chunks, jobs, bar):
+                for line_no, message in result['errors']:
+                    lg.error(f'Validation error at line {line_offset + line_no}: {message}')
+                    error_count += 1
+
+                    if error_count >= MAX_ERRORS:
+                        lg.error(f'Maximum number of errors reached ({MAX_ERRORS}), stopping')
+                        return False
+
+                if result['blank']:
+                    break
+
+                line_offset += result['lines']
+
+    success = error_count == 0
+    lg.info(f'Validation {"succeeded" if success else "failed"}')
+    return success
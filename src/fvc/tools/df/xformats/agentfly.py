@@ -1,34 +1,26 @@
-
 from pathlib import Path
-import csv
-import logging as lg
 
 from fvc.tools.df.util import JsonlinesIO
+from fvc.tools.df.tabular import TabularFormat, Column, convert
 
 
-def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
-    metadata.update({'content': 'flightlog', 'source': 'agentfly'})
-    output.write(metadata)
-    with input_path.open('rt') as input:
-        reader = csv.DictReader(input)
-
-        for row in reader:
-            try:
-                record = {
-                    'time': {'unix': int(row['#unix_timestamp'])},
-                    'uaid': {'int': row['flight_id']},
-                    'pos': {
-                        'loc': {
-                            'lat': float(row['latitude_deg']),
-                            'lon': float(row['longitude_deg']),
-                            'alt': float(row['altitude_m'])
-                        }
-                    },
-                    'sensor': row['source_id']
-                }
+AGENTFLY = TabularFormat(
+    'agentfly',
+    {
+        'time': {'unix': Column('#unix_timestamp', int)},
+        'uaid': {'int': Column('flight_id')},
+        'pos': {
+            'loc': {
+                'lat': Column('latitude_deg', float),
+                'lon': Column('longitude_deg', float),
+                'alt': Column('altitude_m', float)
+            }
+        },
+        'sensor': Column('source_id')
+    },
+    skip_errors=True
+)
 
-                output.write(record)
 
-            except Exception as e:
-                lg.error(f'Error reading record: {e}')
-                continue
+def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
+    convert(AGENTFLY, metadata, input_path, output)
@@ -1,37 +1,30 @@
 from pathlib import Path
-import csv
 
 from fvc.tools.df.util import JsonlinesIO
+from fvc.tools.df.tabular import TabularFormat, Column, convert, scaled
+
+
+ARTLOG = TabularFormat(
+    'artlog',
+    {
+        'time': {
+            'unix': Column('Timestamp_nsec', int, scaled(1_000_000))  # nanoseconds to milliseconds
+        },
+        'uaid': {
+            'int': Column('TrackUUID')
+        },
+        'pos': {
+            'loc': {
+                'lat': Column('Latitude', float),
+                'lon': Column('Longitude', float),
+                'alt': Column('Altitude', float)
+            }
+        }
+    },
+    delimiter=' ',
+    expect={'TimeZone': 'UTC'}
+)
 
 
 def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
-    with input_path.open('rt') as input:
-        reader = csv.DictReader(input, delimiter=' ')
-
-        metadata.update({
-            'content': 'flightlog',
-            'source': 'artlog'
-        })
-
-        output.write(metadata)
-
-        for row in reader:
-            assert row['TimeZone'] == 'UTC'
-
-            record = {
-                'time': {
-                    'unix': int(row['Timestamp_nsec']) // int(1_000_000)
-                },
-                'uaid': {
-                    'int': row['TrackUUID']
-                },
-                'pos': {
-                    'loc': {
-                        'lat': float(row['Latitude']),
-                        'lon': float(row['Longitude']),
-                        'alt': float(row['Altitude'])
-                    }
-                }
-            }
-
-            output.write(record)
+    convert(ARTLOG, metadata, input_path, output)
@@ -1,9 +1,167 @@
 import json
+import heapq
+import tempfile
 from pathlib import Path
 import logging as lg
 
+from toolz.itertoolz import partition_all
+
 import fvc.tools.util as u
 from fvc.tools.df.util import JsonlinesIO
+from fvc.tools.df.codec import default_codec
+
+
+READ_SIZE = 1 << 20
+# Read buffer of each run during the merge
+RUN_BUFFER_SIZE = 1 << 14
+
+_decoder = json.JSONDecoder()
+
+
+class JsonStream:
+    # Incremental reading of JSON values from a text file: values are decoded with
+    # raw_decode once they are complete in the buffer, which grows for large values
+    def __init__(self, f):
+        self._file = f
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+
+    def _read_more(self):
+        if self._eof:
+            raise ValueError('Unexpected end of JSON document')
+
+        # Growing reads keep the retries of a large value linear in its size
+        data = self._file.read(max(READ_SIZE, len(self._buffer) - self._position))
+        self._buffer = self._buffer[self._position:] + data
+        self._position = 0
+        self._eof = not data
+
+    def peek(self) -> str:
+        # The next non-whitespace character
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in ' \t\r\n':
+                self._position += 1
+
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+
+            self._read_more()
+
+    def expect(self, char: str):
+        if (found := self.peek()) != char:
+            raise ValueError(f'Expected {char!r} in JSON document, found {found!r}')
+
+        self._position += 1
+
+    def value(self):
+        self.peek()
+
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+
+                self._read_more()
+                continue
+
+            if end == len(self._buffer) and not self._eof:
+                # A number might continue in the next read
+                self._read_more()
+                continue
+
+            self._position = end
+            return value
+
+    def separated(self, close: str) -> bool:
+        # True if another member or item follows
+        if self.peek() == close:
+            self._position += 1
+            return False
+
+        self.expect(',')
+        return True
+
+    def members(self):
+        # Keys of an object, the stream is left at each value
+        self.expect('{')
+
+        if self.peek() == '}':
+            self._position += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+
+            if not self.separated('}'):
+                return
+
+    def items(self):
+        self.expect('[')
+
+        if self.peek() == ']':
+            self._position += 1
+            return
+
+        while True:
+            yield self.value()
+
+            if not self.separated(']'):
+                return
+
+
+def iterate_tracks(f):
+    # Tracks of the document one at a time, other top-level members are skipped
+    stream = JsonStream(f)
+
+    for key in stream.members():
+        if key == 'tracks':
+            yield from stream.items()
+        else:
+            stream.value()
+
+
+class RunFile:
+    # Time-sorted runs of encoded records in a temporary file, read back concurrently
+    # for the merge with a small buffer each
+    def __init__(self):
+        self._file = tempfile.TemporaryFile(prefix='fvc-runs-')
+        self._codec = default_codec()
+        self._runs = []  # type: list[tuple[int, int]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+
+    def add(self, records: list):
+        start = self._file.tell()
+        self._file.write(''.join(self._codec.encode(record) + '\n' for record in records).encode('utf-8'))
+        self._runs.append((start, self._file.tell()))
+
+    def _read_run(self, start: int, end: int):
+        decode = self._codec.decode
+        pending = b''
+
+        while start < end:
+            self._file.seek(start)
+            data = pending + self._file.read(min(RUN_BUFFER_SIZE, end - start))
+            start += len(data) - len(pending)
+            lines = data.split(b'\n')
+            pending = lines.pop()
+
+            for line in lines:
+                yield decode(line)
+
+    def merged(self):
+        # heapq.merge is stable: records with equal times keep the order of their runs
+        runs = [self._read_run(start, end) for start, end in self._runs]
+        return heapq.merge(*runs, key=lambda record: record['time']['unix'])
 
 
 class Courageous:
@@ -14,72 +172,91 @@ class Courageous:
         self.output = output
         self.geoid = u.load_geoid(self.params, self.metadata)
 
-    def build_position(self, loc):
+    def build_positions(self, locs):
         pass
 
     def content(self):
         pass
 
-    def convert(self):
-        self.metadata.update({'content': self.content(), 'source': 'courageous'})
-        self.output.write(self.metadata)
-        data = json.loads(self.input_path.read_text())
+    def track_entries(self, track) -> list:
+        track_name = track.get('name', 'unknown')
+        track_id = track.get('uas_id', 'noid')
 
-        entries = []
+        uaid = {
+            'int': f'{track_name}-{track_id}',
+        }
 
-        for track in data.get('tracks', []):
-            track_name = track.get('name', 'unknown')
-            track_id = track.get('uas_id', 'noid')
+        def record_to_entry(record, position):
+            timestamp = {'unix': record['time']}
+            flog_record = {'time': timestamp, 'uaid': uaid}
 
-            uaid = {
-                'int': f'{track_name}-{track_id}',
-            }
+            if position:
+                flog_record.update({'pos': position})
 
-            def record_to_entry(record):
-                timestamp = {'unix': record['time']}
-                flog_record = {'time': timestamp, 'uaid': uaid}
-                position = self.build_position(record['location'])
-                
-                if position:
-                    flog_record.update({'pos': position})
+            return flog_record
 
-                return flog_record
+        entries = []
 
-            entries.extend(map(record_to_entry, track['records']))
+        for records in partition_all(u.GEOID_BATCH_SIZE, track['records']):
+            positions = self.build_positions([r['location'] for r in records])
+            entries.extend(map(record_to_entry, records, positions))
 
+        # Tracks are usually sorted already, which makes this sort linear
         entries.sort(key=lambda e: e['time']['unix'])
+        return entries
+
+    def convert(self):
+        self.metadata.update({'content': self.content(), 'source': 'courageous'})
+        self.output.write(self.metadata)
+
+        # Each track becomes a sorted run, runs are merged by time: memory is bounded
+        # by the largest track and a read buffer per track, not by the whole export
+        with self.input_path.open('rt') as f, RunFile() as runs:
+            for track in iterate_tracks(f):
+                if entries := self.track_entries(track):
+                    runs.add(entries)
 
-        for entry in entries:
-            self.output.write(entry)
+            for entry in runs.merged():
+                self.output.write(entry)
 
 
 class CourageousCartesian(Courageous):
     def content(self):
         return 'flightlog'
 
-    def build_position(self, loc):
-        if 't' in loc and loc['t'] == 'Position3d':
-            pos = loc['c']
-        elif 'Position3d' in loc:
-            pos = loc['Position3d']
-        else:
-            lg.warning(f'Unused location format: {loc.get("t")}')
-            return None
+    def build_positions(self, locs):
+        positions = []
+        coords = []
 
-        lat = pos['lat']
-        lon = pos['lon']
-        amsl = pos['height_amsl']
-        alt = u.amsl_to_ellipsoidal(self.geoid, lat, lon, amsl)
+        for loc in locs:
+            if 't' in loc and loc['t'] == 'Position3d':
+                pos = loc['c']
+            elif 'Position3d' in loc:
+                pos = loc['Position3d']
+            else:
+                lg.warning(f'Unused location format: {loc.get("t")}')
+                positions.append(None)
+                continue
 
-        position = {
-            'loc': {
-                'lat': lat,
-                'lon': lon,
-                'alt': alt
+            position = {
+                'loc': {
+                    'lat': pos['lat'],
+                    'lon': pos['lon']
+                }
             }
-        }
 
-        return position
+            positions.append(position)
+            coords.append((pos['lat'], pos['lon'], pos['height_amsl']))
+
+        if coords:
+            (lats, lons, amsls) = zip(*coords)
+            alts = u.amsl_to_ellipsoidal_batch(self.geoid, lats, lons, amsls).tolist()
+            located = (p for p in positions if p)
+
+            for position, alt in zip(located, alts):
+                position['loc']['alt'] = alt
+
+        return positions
 
 
 class CourageousPolar(Courageous):
@@ -104,6 +281,9 @@ class CourageousPolar(Courageous):
 
         return position
 
+    def build_positions(self, locs):
+        return [self.build_position(loc) for loc in locs]
+
 
 def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
     if params.get('target') == 'flightlog':
@@ -112,5 +292,5 @@ def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
         Converter = CourageousPolar
     else:
         raise ValueError(f'Unsupported content type: {params.get("content")}')
-    
+
     Converter(params, metadata, input_path, output).convert()
@@ -1,52 +1,29 @@
 from pathlib import Path
-import csv
 
 from fvc.tools.df.util import JsonlinesIO
-
-
-def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
-    with input_path.open('rt') as input:
-        reader = csv.DictReader(input)
-
-        metadata.update({
-            'content': 'flightlog',
-            'source': 'csgroup'
-        })
-
-        output.write(metadata)
-
-        for row in reader:
-            event = row.get('event_type')
-
-            if event != 'TRACK':
-                continue
-
-            timestamp = row['datetime_ms']
-            track_id = row['track_id']
-            lat = row['latitude']
-            lon = row['longitude']
-            alt = row['altitude']
-
-            uaid = {
-                'int': track_id
-            }
-
-            time = {
-                'unix': int(timestamp)
+from fvc.tools.df.tabular import TabularFormat, Column, convert
+
+
+CSGROUP = TabularFormat(
+    'csgroup',
+    {
+        'time': {
+            'unix': Column('datetime_ms', int)
+        },
+        'uaid': {
+            'int': Column('track_id')
+        },
+        'pos': {
+            'loc': {
+                'lat': Column('latitude', float),
+                'lon': Column('longitude', float),
+                'alt': Column('altitude', float)
             }
+        }
+    },
+    filters={'event_type': 'TRACK'}
+)
 
-            position = {
-                'loc': {
-                    'lat': float(lat),
-                    'lon': float(lon),
-                    'alt': float(alt)
-                }
-            }
 
-            record = {
-                'time': time,
-                'uaid': uaid,
-                'pos': position
-            }
-
-            output.write(record)
+def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
+    convert(CSGROUP, metadata, input_path, output)
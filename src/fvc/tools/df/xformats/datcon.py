@@ -1,8 +1,8 @@
 from pathlib import Path
-import csv
 import pyparsing as pp
 
 from fvc.tools.df.util import JsonlinesIO
+from fvc.tools.df.tabular import TabularFormat, Column, Compose, convert, scaled
 
 
 def grammar():
@@ -14,35 +14,32 @@ def grammar():
     return pp.OneOrMore(column)
 
 
-def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
-    with input_path.open('rt') as input:
-        header = input.readline()
-
-        if not header:
-            return
-
-        columns = grammar().parse_string(header)
-        reader = csv.DictReader(input, fieldnames=columns, delimiter=' ')  # type: ignore
-        metadata.update({'content': 'flightlog', 'source': 'datcon'})
-        output.write(metadata)
-
-        for row in reader:
-            assert row['TZ'] == 'UTC'
-
-            record = {
-                'time': {
-                    'unix': int(row['TS']) // 1_000_000,  # nanoseconds to milliseconds
-                },
-                'uaid': {
-                    'int': row['GUID'] if row['GUID'] != 'N/A' else row['ID']
-                },
-                'pos': {
-                    'loc': {
-                        'lat': float(row['Latitude']),
-                        'lon': float(row['Longitude']),
-                        'alt': float(row['Altitude'])
-                    }
-                }
+def header_columns(header: str) -> list[str]:
+    return list(grammar().parse_string(header))
+
+
+DATCON = TabularFormat(
+    'datcon',
+    {
+        'time': {
+            'unix': Column('TS', int, scaled(1_000_000)),  # nanoseconds to milliseconds
+        },
+        'uaid': {
+            'int': Compose(['GUID', 'ID'], lambda guid, id: guid if guid != 'N/A' else id)
+        },
+        'pos': {
+            'loc': {
+                'lat': Column('Latitude', float),
+                'lon': Column('Longitude', float),
+                'alt': Column('Altitude', float)
             }
+        }
+    },
+    delimiter=' ',
+    header=header_columns,
+    expect={'TZ': 'UTC'}
+)
+
 
-            output.write(record)
+def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
+    convert(DATCON, metadata, input_path, output)
@@ -1,22 +1,59 @@
 from pathlib import Path
 import json
 import logging as lg
+import math
 
+import numpy as np
 
 import fvc.tools.df.util as u
+from fvc.tools.df.flightlog import DEFAULT_GAP
+from fvc.tools.df.tracks import TrackSpool, split_at_gaps
+from fvc.tools.df.simplify import simplification
 
 
-def generate_point(params, record):
-    pos = record['pos']
-    loc = pos['loc']
+WRITE_BUFFER_SIZE = 1 << 20
 
+
+def encode(data) -> str:
+    # Compact, the output of large logs is mostly coordinates
+    return json.dumps(data, separators=(',', ':'))
+
+
+def rounded(value, precision: int | None):
+    return value if precision is None else round(value, precision)
+
+
+def coordinates(loc, precision: int | None) -> list:
+    coords = [rounded(loc['lon'], precision), rounded(loc['lat'], precision)]
+
+    if (alt := loc.get('alt')) is not None:
+        coords.append(rounded(alt, precision))
+
+    return coords
+
+
+def track_coordinates(points: np.ndarray, precision: int | None) -> list:
+    # points: time, lon, lat, alt (NaN if missing) rows
+    if precision is not None:
+        points = np.round(points, precision)
+
+    if np.isnan(points[:, 3]).any():
+        return [[lon, lat] if math.isnan(alt) else [lon, lat, alt] for lon, lat, alt in points[:, 1:].tolist()]
+
+    return points[:, 1:].tolist()
+
+
+def generate_point(params, record, loc):
     point = {
         'type': 'Feature',
         'geometry': {
             'type': 'Point',
-            'coordinates': [loc['lon'], loc['lat'], loc['alt']]
+            'coordinates': coordinates(loc, params.get('precision'))
         },
-        'properties': {}
+        'properties': {
+            'uaid': record.get('uaid', {}).get('int'),
+            'time': record.get('time', {}).get('unix')
+        }
     }
 
     if params['with_cellular']:
@@ -24,89 +61,158 @@ def generate_point(params, record):
             raise UserWarning('Cellular signal data not found')
 
         signal = record['cellsig']
-        point['properties'] = {'rsrp': signal['RSRP']}
+        point['properties']['rsrp'] = signal['RSRP']
 
     return point
 
 
-def generate_line(params, record, curr_pos):
-    pos = record['pos']
-    loc = pos['loc']
-
-    line = {
+def generate_line(params, previous, loc):
+    return {
         'type': 'Feature',
         'geometry': {
             'type': 'LineString',
             'coordinates': [
-                [curr_pos['lon'], curr_pos['lat'], curr_pos['alt']],
-                [loc['lon'], loc['lat'], loc['alt']]
+                coordinates(previous, params.get('precision')),
+                coordinates(loc, params.get('precision'))
             ]
         },
         'properties': {}
     }
 
-    curr_pos['lat'] = loc['lat']
-    curr_pos['lon'] = loc['lon']
-    curr_pos['alt'] = loc['alt']
 
-    return line
+def generate_track(params, uaid, points: np.ndarray):
+    # One LineString per track, or a MultiLineString if the track has gaps
+    precision = params.get('precision')
+    parts = [
+        track_coordinates(points[part], precision)
+        for part in split_at_gaps(points[:, 0], DEFAULT_GAP * 1000)
+    ]
 
+    if len(parts) == 1:
+        geometry = {'type': 'LineString', 'coordinates': parts[0]}
+    else:
+        geometry = {'type': 'MultiLineString', 'coordinates': parts}
 
-def generate_features(params, record, curr_pos):
-    return [
-        generate_point(params, record),
-        generate_line(params, record, curr_pos)
+    return {
+        'type': 'Feature',
+        'geometry': geometry,
+        'properties': {
+            'uaid': uaid,
+            'start': int(points[:, 0].min()),
+            'end': int(points[:, 0].max()),
+            'points': len(points)
+        }
+    }
 
-    ]
 
+class FeatureWriter:
+    # A FeatureCollection written one feature at a time
+    def __init__(self, f):
+        self._file = f
+        self._count = 0
 
-def generate_geojson(features):
-    collection = {
-        'type': 'FeatureCollection',
-        'features': features
-    }
+    def __enter__(self):
+        self._file.write('{"type":"FeatureCollection","features":[\n')
+        return self
 
-    return json.dumps(collection, indent=2)
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.write('\n]}\n')
 
+    def write(self, feature):
+        if self._count:
+            self._file.write(',\n')
 
-def export_from_fvc(params, output_path: Path | None):
-    input_path = params['input'].fetch()
+        self._file.write(encode(feature))
+        self._count += 1
 
-    if not output_path:
-        output = input_path.with_suffix('.geo.json')  # type: Path
-    else:
-        output = output_path
 
-    with u.JsonlinesIO(input_path, 'r') as io:
-        metadata = io.read()
+def record_location(record):
+    loc = (record.get('pos') or {}).get('loc')
 
-        if not metadata:
-            raise UserWarning('No metadata found')
+    if not loc or loc.get('lat') is None or loc.get('lon') is None:
+        raise UserWarning('Position not found')
 
-        if (content := metadata.get('content')) != 'flightlog':
-            raise UserWarning(f'Unsupported content type: {content}')
+    return loc
 
-        first = io.read()
 
-        if not first:
-            return
+def record_time(record):
+    if (t := (record.get('time') or {}).get('unix')) is None:
+        raise UserWarning('Time not found')
 
-        curr_pos = {
-            'lat': first['pos']['loc']['lat'],
-            'lon': first['pos']['loc']['lon'],
-            'alt': first['pos']['loc']['alt']
-        }
+    return t
+
+
+def write_points(params, io, writer: FeatureWriter):
+    # A point per record, and a segment from the previous point of the same track
+    previous = {}
+
+    for record in io.iterate():
+        try:
+            loc = record_location(record)
+            writer.write(generate_point(params, record, loc))
+        except UserWarning as e:
+            lg.warning(f'Unable to process record: {e}')
+            continue
+
+        uaid = record.get('uaid', {}).get('int')
+
+        if (previous_loc := previous.get(uaid)) is not None:
+            writer.write(generate_line(params, previous_loc, loc))
+
+        previous[uaid] = loc
 
-        features = []
 
+def write_tracks(params, io, writer: FeatureWriter):
+    with TrackSpool(4) as spool:
         for record in io.iterate():
             try:
-                features.extend(generate_features(params, record, curr_pos))
+                loc = record_location(record)
+                t = record_time(record)
             except UserWarning as e:
                 lg.warning(f'Unable to process record: {e}')
                 continue
 
-        geojson = generate_geojson(features)
+            alt = loc.get('alt')
+            spool.add(record.get('uaid', {}).get('int'), (t, loc['lon'], loc['lat'], math.nan if alt is None else alt))
+
+        simplifier = simplification(params)
+
+        for uaid, points in spool.tracks():
+            if simplifier:
+                points = points[simplifier.select(points)]
+
+            writer.write(generate_track(params, uaid, points))
+
+
+def export_from_fvc(params, output_path: Path | None):
+    input_path = params['input'].fetch(streamable=True)
+
+    if not output_path:
+        output = u.with_fvc_suffix(input_path, '.geo.json')  # type: Path
+    else:
+        output = output_path
+
+    if params.get('tracks') and params['with_cellular']:
+        raise UserWarning('Cellular signal data is exported with points, not with tracks')
+
+    if not params.get('tracks') and simplification(params):
+        raise UserWarning('Simplification applies to tracks (--tracks)')
+
+    with u.open_fvc(input_path, 'r') as io:
+        metadata = io.read()
+
+        if not metadata:
+            raise UserWarning('No metadata found')
+
+        if (content := metadata.get('content')) != 'flightlog':
+            raise UserWarning(f'Unsupported content type: {content}')
+
         output.parent.mkdir(parents=True, exist_ok=True)
-        output.write_text(geojson)
+
+        with output.open('w', buffering=WRITE_BUFFER_SIZE) as f, FeatureWriter(f) as writer:
+            if params.get('tracks'):
+                write_tracks(params, io, writer)
+            else:
+                write_points(params, io, writer)
+
         return output
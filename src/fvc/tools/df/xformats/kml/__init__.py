@@ -1,66 +1,150 @@
 from pathlib import Path
+from datetime import datetime, UTC
+from xml.sax.saxutils import escape
+from zipfile import ZipFile, ZIP_DEFLATED
+import io
 import logging as lg
-from zipfile import ZipFile
 import math
 
-import simplekml
+import numpy as np
 
 import fvc.tools.df.util as u
+from fvc.tools.df.tracks import TrackSpool
+from fvc.tools.df.simplify import simplification
 
 
-def generate_point(params, record, kml):
-    loc = record['pos']['loc']
+# With level of detail, tracks are split into regions of LOD_POINTS points, shown when
+# their region covers LOD_PIXELS on screen; a track overview of at most LOD_OVERVIEW_POINTS
+# points is shown below that
+LOD_POINTS = 1000
+LOD_PIXELS = 256
+LOD_OVERVIEW_POINTS = 500
 
-    pnt = kml.newpoint(
-        coords=[(loc['lon'], loc['lat'], loc['alt'])],
-        extrude=1,
-        altitudemode = simplekml.AltitudeMode.absolute
-    )
+IMAGES = ['arrow.png', 'circle.png']
 
-    pnt.style.iconstyle.scale = 1
+HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2" xmlns:gx="http://www.google.com/kml/ext/2.2">
+<Document>
+<name>{name}</name>
+<Style id="heading"><IconStyle><scale>1</scale><Icon><href>images/arrow.png</href></Icon></IconStyle>\
+<LineStyle><color>ff00ffff</color><width>2</width></LineStyle></Style>
+<Style id="position"><IconStyle><scale>1</scale><Icon><href>images/circle.png</href></Icon></IconStyle>\
+<LineStyle><color>ff00ffff</color><width>2</width></LineStyle></Style>
+<Style id="overview"><LineStyle><color>9900ffff</color><width>2</width></LineStyle></Style>
+'''
 
-    if yaw := record.get('pos', {}).get('att', {}).get('yaw'):
-        pnt.style.iconstyle.heading = yaw
-        pnt.style.iconstyle.icon.href = 'images/arrow.png'
-    else:
-        pnt.style.iconstyle.icon.href = 'images/circle.png'
-    
-
-def generate_line(params, record, curr_pos, kml):
-    pos = record['pos']
-    loc = pos['loc']
-
-    kml.newlinestring(
-        coords=[
-            (curr_pos['lon'], curr_pos['lat'], curr_pos['alt']),
-            (loc['lon'], loc['lat'], loc['alt'])
-        ],
-        altitudemode = simplekml.AltitudeMode.absolute
-    )
+FOOTER = '''</Document>
+</kml>
+'''
+
+
+def format_time(ms: float) -> str:
+    return datetime.fromtimestamp(ms / 1000.0, tz=UTC).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def format_number(precision: int | None):
+    if precision is None:
+        return repr
+
+    return lambda value: f'{value:.{precision}f}'
+
+
+class KmlWriter:
+    def __init__(self, f, precision: int | None, lod: bool):
+        self._file = f
+        self._number = format_number(precision)
+        self._lod = lod
+
+    def write_track(self, uaid, points: np.ndarray):
+        # points: time, lon, lat, alt, yaw (NaN if missing) rows
+        name = escape(str(uaid))
+
+        if not self._lod or len(points) <= LOD_POINTS:
+            self._placemark(name, points)
+            return
+
+        self._file.write(f'<Folder><name>{name}</name>\n')
+        self._file.write(f'<Placemark><name>{name}</name><styleUrl>#overview</styleUrl>{self._region(points, 0, LOD_PIXELS)}')
+        self._file.write(self._line(points[::math.ceil(len(points) / LOD_OVERVIEW_POINTS)]))
+        self._file.write('</Placemark>\n')
+
+        for start in range(0, len(points), LOD_POINTS):
+            # Parts overlap by a point, so the track is continuous
+            part = points[max(start - 1, 0):start + LOD_POINTS]
+            self._placemark(name, part, self._region(part, LOD_PIXELS, -1))
+
+        self._file.write('</Folder>\n')
+
+    def _coordinates(self, points: np.ndarray):
+        number = self._number
+        return (
+            f'{number(lon)} {number(lat)} {0 if math.isnan(alt) else number(alt)}'
+            for lon, lat, alt in points[:, 1:4].tolist()
+        )
+
+    def _line(self, points: np.ndarray) -> str:
+        coordinates = ' '.join(c.replace(' ', ',') for c in self._coordinates(points))
+        return f'<LineString><altitudeMode>absolute</altitudeMode><coordinates>{coordinates}</coordinates></LineString>'
+
+    def _region(self, points: np.ndarray, min_pixels: int, max_pixels: int) -> str:
+        lon = points[:, 1]
+        lat = points[:, 2]
 
-    
-    curr_pos['lat'] = loc['lat']
-    curr_pos['lon'] = loc['lon']
-    curr_pos['alt'] = loc['alt']
+        return (
+            f'<Region><LatLonAltBox><north>{lat.max()!r}</north><south>{lat.min()!r}</south>'
+            f'<east>{lon.max()!r}</east><west>{lon.min()!r}</west></LatLonAltBox>'
+            f'<Lod><minLodPixels>{min_pixels}</minLodPixels><maxLodPixels>{max_pixels}</maxLodPixels></Lod></Region>'
+        )
 
+    def _placemark(self, name: str, points: np.ndarray, region=''):
+        yaws = points[:, 4]
+        # Headings are written if every point has one, gx:angles is all or nothing
+        headings = not np.isnan(yaws).any()
+        write = self._file.write
 
-def generate_features(params, record, curr_pos, kml):
-    generate_point(params, record, kml)
-    generate_line(params, record, curr_pos, kml)
+        # KML 2.2 element order: styleUrl before Region
+        write(f'<Placemark><name>{name}</name><styleUrl>#{"heading" if headings else "position"}</styleUrl>{region}\n')
+        write('<gx:Track><altitudeMode>absolute</altitudeMode>\n')
+        write(''.join(f'<when>{format_time(t)}</when>' for t in points[:, 0].tolist()))
+        write('\n')
+        write(''.join(f'<gx:coord>{c}</gx:coord>' for c in self._coordinates(points)))
+        write('\n')
+
+        if headings:
+            write(''.join(f'<gx:angles>{self._number(yaw)} 0 0</gx:angles>' for yaw in yaws.tolist()))
+            write('\n')
+
+        write('</gx:Track></Placemark>\n')
+
+
+def track_point(record) -> tuple:
+    loc = (record.get('pos') or {}).get('loc')
+
+    if not loc or loc.get('lat') is None or loc.get('lon') is None:
+        raise UserWarning('Position not found')
+
+    if (t := (record.get('time') or {}).get('unix')) is None:
+        raise UserWarning('Time not found')
+
+    alt = loc.get('alt')
+    yaw = ((record.get('pos') or {}).get('att') or {}).get('yaw')
+
+    return (
+        t, loc['lon'], loc['lat'],
+        math.nan if alt is None else alt, math.nan if yaw is None else yaw
+    )
 
 
 def export_from_fvc(params, output_path: Path | None):
-    input_path = params['input'].fetch()
+    input_path = params['input'].fetch(streamable=True)
 
     if not output_path:
-        output = input_path.with_suffix('.kmz')  # type: Path
+        output = u.with_fvc_suffix(input_path, '.kmz')  # type: Path
     else:
         output = output_path
 
-    kml = simplekml.Kml()
-
-    with u.JsonlinesIO(input_path, 'r') as io:
-        metadata = io.read()
+    with u.open_fvc(input_path, 'r') as fvc, TrackSpool(5) as spool:
+        metadata = fvc.read()
 
         if not metadata:
             raise UserWarning('No metadata found')
@@ -68,32 +152,33 @@ def export_from_fvc(params, output_path: Path | None):
         if (content := metadata.get('content')) != 'flightlog':
             raise UserWarning(f'Unsupported content type: {content}')
 
-        first = io.read()
-
-        if not first:
-            return
-
-        curr_pos = {
-            'lat': first['pos']['loc']['lat'],
-            'lon': first['pos']['loc']['lon'],
-            'alt': first['pos']['loc']['alt']
-        }
-
-        for record in io.iterate():
+        # gx:Track holds a whole track, so points are grouped by track before writing
+        for record in fvc.iterate():
             try:
-                generate_features(params, record, curr_pos, kml)
+                spool.add(record.get('uaid', {}).get('int'), track_point(record))
             except UserWarning as e:
                 lg.warning(f'Unable to process record: {e}')
                 continue
 
-        kml_string = kml.kml()
-        arrow = Path(__file__).parent / 'images' / 'arrow.png'
-        arrow = Path(__file__).parent / 'images' / 'circle.png'
         output.parent.mkdir(parents=True, exist_ok=True)
-        
-        with ZipFile(output, 'w') as kmz:
-            kmz.writestr('doc.kml', kml_string)
-            kmz.write(arrow, 'images/arrow.png')
-            kmz.write(arrow, 'images/circle.png')
+        writer_params = (params.get('precision'), params.get('lod', False))
+        simplifier = simplification(params)
+
+        with ZipFile(output, 'w', ZIP_DEFLATED) as kmz:
+            # doc.kml is written first, some readers expect it as the first entry
+            with kmz.open('doc.kml', 'w', force_zip64=True) as entry, io.TextIOWrapper(entry, encoding='utf-8') as f:
+                f.write(HEADER.format(name=escape(input_path.name)))
+                writer = KmlWriter(f, *writer_params)
+
+                for uaid, points in spool.tracks():
+                    if simplifier:
+                        points = points[simplifier.select(points)]
+
+                    writer.write_track(uaid, points)
+
+                f.write(FOOTER)
+
+            for image in IMAGES:
+                kmz.write(Path(__file__).parent / 'images' / image, f'images/{image}')
 
         return output
@@ -1,24 +1,182 @@
 from pathlib import Path
-from datetime import datetime, UTC
+from collections import Counter
+from datetime import datetime, time, UTC
 import logging as lg
-import statistics
+import math
+import re
 
+import numpy as np
 import pynmea2
 from dateutil.parser import parse as dateparse
 
 from fvc.tools.df.util import JsonlinesIO, JSON
 
 
-def iterate_nmea_file(input_path: Path):
-    with input_path.open() as f:
-        while line := f.readline():
+READ_SIZE = 1 << 22
+
+# Sentences handled without pynmea2: GGA is used, RMC is skipped once its checksum is checked
+FAST_SENTENCES = {b'GGA', b'RMC'}
+TALKER_RE = re.compile(rb'[A-OQ-Z0-9][A-Z0-9]')
+CHECKSUM_RE = re.compile(rb'\*[A-F0-9]{2}')
+TIMESTAMP_RE = re.compile(rb'^(\d\d)(\d\d)(\d\d)(\.\d+)?$')
+DM_RE = re.compile(rb'^(\d+)(\d\d\.\d+)$')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+DAY_US = 86400 * 10**6
+
+# Distinct values counted by StreamingMedian before values are binned
+MEDIAN_MAX_BINS = 1 << 16
+
+
+class Fallback(Exception):
+    # The line is not a plain well-formed sentence, pynmea2 decides
+    pass
+
+
+def iterate_lines(f):
+    # (line, XOR prefix of the block, offset of the line in the block) of a binary file;
+    # the checksum of bytes [a, b) of a line is prefix[offset + b] ^ prefix[offset + a]
+    pending = b''
+
+    while True:
+        data = f.read(READ_SIZE)
+        block = pending + data
+
+        if data:
+            cut = block.rfind(b'\n') + 1
+            block, pending = block[:cut], block[cut:]
+
+        if not block:
+            if not data:
+                return
+
+            continue
+
+        array = np.frombuffer(block, dtype=np.uint8)
+        prefix = np.zeros(len(array) + 1, dtype=np.uint8)
+        np.bitwise_xor.accumulate(array, out=prefix[1:])
+        prefix = prefix.tobytes()
+        offset = 0
+
+        for line in block.split(b'\n'):
+            yield line, prefix, offset
+            offset += len(line) + 1
+
+        if not data:
+            return
+
+
+def dm_to_sd(dm: bytes) -> float:
+    # As pynmea2, 'dddmm.mmmm' to degrees
+    if not dm or dm == b'0':
+        return 0.
+
+    if not (match := DM_RE.match(dm)):
+        raise Fallback()
+
+    d, m = match.groups()
+    return float(d) + float(m) / 60
+
+
+def signed(sd: float, direction: bytes, positive: bytes, negative: bytes) -> float:
+    if direction == positive:
+        return +sd
+    elif direction == negative:
+        return -sd
+    else:
+        return 0.
+
+
+def time_of_day_us(value: bytes) -> int:
+    # As pynmea2 timestamps, 'hhmmss[.ss]' to microseconds
+    if not (match := TIMESTAMP_RE.match(value)):
+        raise Fallback()
+
+    hours, minutes, seconds, fraction = match.groups()
+
+    if int(hours) > 23 or int(minutes) > 59 or int(seconds) > 59:
+        raise Fallback()
+
+    us = fraction and int(float(fraction) * 1000000) or 0
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 10**6 + us
+
+
+def fast_sentence(line: bytes, prefix: bytes, offset: int):
+    # GGA fields (time of day in us, lat, lon, altitude, geo_sep) or None for other fast sentences;
+    # raises Fallback for anything pynmea2 should parse (or report)
+    line = line.rstrip()
+
+    # NB: pynmea2 reads '$P...' as a proprietary sentence
+    if line[:1] != b'$' or line[6:7] != b',' or line[3:6] not in FAST_SENTENCES or not TALKER_RE.match(line, 1):
+        raise Fallback()
+
+    star = line.find(b'*')
+
+    if star >= 0:
+        if not CHECKSUM_RE.fullmatch(line, star) or prefix[offset + star] ^ prefix[offset + 1] != int(line[star + 1:], 16):
+            raise Fallback()
+    else:
+        star = len(line)
+
+    if line[3:6] != b'GGA':
+        return None
+
+    fields = line[7:star].split(b',')
+
+    if len(fields) < 11 or not fields[8]:
+        raise Fallback()
+
+    try:
+        altitude = float(fields[8])
+    except ValueError:
+        raise Fallback()
+
+    return (
+        time_of_day_us(fields[0]),
+        signed(dm_to_sd(fields[1]), fields[2], b'N', b'S'),
+        signed(dm_to_sd(fields[3]), fields[4], b'E', b'W'),
+        altitude,
+        fields[10].decode('ascii', 'replace')
+    )
+
+
+def message_fields(message):
+    # The fields of fast_sentence from a pynmea2 GGA message
+    timestamp = message.timestamp
+
+    if isinstance(timestamp, time):
+        tod = ((timestamp.hour * 60 + timestamp.minute) * 60 + timestamp.second) * 10**6 + timestamp.microsecond
+    else:
+        tod = None
+
+    return (tod, message.latitude, message.longitude, message.altitude, message.geo_sep)
+
+
+def iterate_gga(input_path: Path):
+    # (time of day in us or None, lat, lon, altitude, geo_sep) of GGA sentences
+    with input_path.open('rb') as f:
+        for line, prefix, offset in iterate_lines(f):
             try:
-                message = pynmea2.parse(line)
+                if fields := fast_sentence(line, prefix, offset):
+                    yield fields
 
-                yield message
+                continue
+            except Fallback:
+                pass
 
+            text = line.decode('utf-8', 'replace')
+
+            if not text.strip():
+                continue
+
+            try:
+                message = pynmea2.parse(text)
             except ValueError as e:
-                lg.warning(f'Unable to parse line ({line}) with error: {e}')
+                lg.warning(f'Unable to parse line ({text}) with error: {e}')
+                continue
+
+            if isinstance(message, pynmea2.GGA):
+                yield message_fields(message)
 
 
 def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
@@ -41,24 +199,26 @@ def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
 
     output.write(metadata)
 
-    for message in iterate_nmea_file(input_path):
-        if not isinstance(message, pynmea2.GGA):
-            continue
+    # Microseconds since the epoch at the start of the base date; the arithmetic below is the one
+    # of datetime.timestamp(), so times are the same as with datetime.combine per record
+    base_us = (base_date.date() - EPOCH.date()).days * DAY_US
 
-        timestamp = datetime.combine(base_date, message.timestamp, tzinfo=UTC)  # type: ignore
+    for (tod, lat, lon, altitude, geo_sep) in iterate_gga(input_path):
+        if tod is None:
+            raise UserWarning('GGA sentence without a valid timestamp')
 
-        if not message.geo_sep:
+        if not geo_sep:
             continue
 
         # TODO: handle feet
-        alt = message.altitude + float(message.geo_sep)  # type: ignore
+        alt = altitude + float(geo_sep)  # type: ignore
 
         record = {
-            'time': {'unix': int(timestamp.timestamp()*1000)},
+            'time': {'unix': int((base_us + tod) / 10**6 * 1000)},
             'pos': {
                 'loc': {
-                    'lat': message.latitude,
-                    'lon': message.longitude,
+                    'lat': lat,
+                    'lon': lon,
                     'alt': alt
                 }
             }
@@ -67,20 +227,87 @@ def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
         output.write(record)
 
 
+class StreamingMedian:
+    # The median of a stream in bounded memory: values are counted exactly (a fixed sensor
+    # reports few distinct values), and only above MEDIAN_MAX_BINS distinct values they are
+    # binned, with a bin width doubled until they fit. The median is then the bin center.
+    def __init__(self, resolution: float):
+        self._counts = Counter()  # type: Counter
+        self._resolution = resolution
+        self._width = None  # type: float | None
+        self.count = 0
+
+    def add(self, value: float):
+        if self._width is not None:
+            value = math.floor(value / self._width)
+
+        self._counts[value] += 1
+        self.count += 1
+
+        if len(self._counts) > MEDIAN_MAX_BINS:
+            self._coarsen()
+
+    def _coarsen(self):
+        if self._width is None:
+            self._width = self._resolution
+            factor = 1.0 / self._resolution
+        else:
+            self._width *= 2
+            factor = 0.5
+
+        counts = Counter()  # type: Counter
+
+        for value, count in self._counts.items():
+            counts[math.floor(value * factor)] += count
+
+        self._counts = counts
+
+    def _value(self, key) -> float:
+        return key if self._width is None else (key + 0.5) * self._width
+
+    def median(self) -> float:
+        # As statistics.median: the mean of the middle values for an even count
+        if not self.count:
+            raise UserWarning('No values to take the median of')
+
+        middle = [(self.count - 1) // 2, self.count // 2]
+        values = []
+        seen = 0
+
+        for key in sorted(self._counts):
+            seen += self._counts[key]
+
+            while middle and middle[0] < seen:
+                values.append(self._value(key))
+                middle.pop(0)
+
+            if not middle:
+                break
+
+        return (values[0] + values[1]) / 2
+
+
 def extract_sensor_data(params, sensor_source: Path) -> JSON:
+    # One pass over the GGA sentences, the median position in bounded memory
     lg.info(f'Extracting sensor data from {sensor_source}')
+    lat = StreamingMedian(1e-7)
+    lon = StreamingMedian(1e-7)
+    alt = StreamingMedian(1e-3)
 
-    def iterate():
-        for message in iterate_nmea_file(sensor_source):
-            if isinstance(message, pynmea2.GGA):
-                yield (message.latitude, message.longitude, message.altitude)
+    for (_, latitude, longitude, altitude, _) in iterate_gga(sensor_source):
+        lat.add(latitude)
+        lon.add(longitude)
+
+        if altitude is not None:
+            alt.add(altitude)
 
-    (latitudes, longitudes, altitudes) = zip(*iterate())
+    if not lat.count:
+        raise UserWarning(f'No GGA sentence found in {sensor_source}')
 
     return {
         'loc': {
-            'lat': statistics.median(latitudes),
-            'lon': statistics.median(longitudes),
-            'alt': statistics.median(altitudes)
+            'lat': lat.median(),
+            'lon': lon.median(),
+            'alt': alt.median()
         }
     }
@@ -1,185 +1,318 @@
 from pathlib import Path
-from xml.parsers.expat import ParserCreate
-from typing import TextIO
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from xml.parsers.expat import ParserCreate, ErrorString, ExpatError
 import logging as lg
 
-import fvc.tools.util as u
 from fvc.tools.df.util import JsonlinesIO
+from fvc.tools.timestamps import TimestampParser
 
 
-def iterate_robin(f: TextIO):
+BLOCK_START = b'<Robin>'
+BLOCK_END = b'</Robin>'
+READ_SIZE = 1 << 20
+# Input ranges parsed by each worker when converting in parallel
+RANGE_SIZE = 16 << 20
+# Ranges parsed ahead of the writer, per worker: parsed records are held until written
+PIPELINE_DEPTH = 2
+
+
+def iterate_robin(f):
+    # (line number of the block end, bytes) of each <Robin> block of a binary file
+    buffer = b''
+    position = 0
     line_no = 0
+    eof = False
 
     while True:
-        line = f.readline()
-        line_no += 1
+        start = buffer.find(BLOCK_START, position)
+        end = buffer.find(BLOCK_END, start) if start >= 0 else -1
+
+        if end < 0:
+            if eof:
+                return
+
+            # Keep an incomplete block (or a possibly split start tag) for the next read
+            keep = start if start >= 0 else max(len(buffer) - len(BLOCK_START), position)
+            line_no += buffer.count(b'\n', position, keep)
+            buffer = buffer[keep:]
+            position = 0
+            data = f.read(READ_SIZE)
+            eof = not data
+            buffer += data
+            continue
+
+        line_no += buffer.count(b'\n', position, start)
+        end += len(BLOCK_END)
+        line_no += buffer.count(b'\n', start, end)
+        yield (line_no + 1, buffer[start:end])
+        position = end
+
+
+class BlockError(Exception):
+    pass
+
+
+class RobinParser:
+    # One expat parser for all blocks, fed block by block inside a synthetic root element;
+    # element handlers are looked up in tables by element name. A block with an error
+    # is skipped as a whole, a parser is only recreated after malformed XML.
+    def __init__(self, write):
+        self._write = write
+        self._timestamps = TimestampParser()
+        self._starts = {
+            'Track': self._start_track,
+            'Position': self._start_position
+        }
+        self._ends = {
+            'Track': self._end_track,
+            'Timestamp': self._end_timestamp,
+            'Position': self._end_position,
+            'Latitude': self._end_coordinate,
+            'Longitude': self._end_coordinate,
+            'Altitude': self._end_coordinate
+        }
+        self._parser = None
+        self._stack = []  # type: list[str]
+        self._text = []  # type: list[str]
+        self._reset_block()
+
+    def _reset_block(self):
+        self._stack.clear()
+        self._text.clear()
+        self._record = None
+        self._position = None
+        self._error = None  # type: str | None
+
+    def _new_parser(self):
+        parser = ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start_element
+        parser.CharacterDataHandler = self._text.append
+        parser.EndElementHandler = self._end_element
+        parser.Parse(b'<RobinBlocks>', False)
+        return parser
+
+    def parse_block(self, block: bytes):
+        # Raises BlockError on any error in the block
+        self._reset_block()
+
+        if self._parser is None:
+            self._parser = self._new_parser()
+
+        try:
+            self._parser.Parse(block, False)
+        except ExpatError as e:
+            # Positions are relative to the parser input, not to the file
+            self._parser = None
+            raise BlockError(ErrorString(e.code))
+
+        if self._error:
+            raise BlockError(self._error)
+
+    def _start_element(self, name, attrs):
+        self._text.clear()
+        self._stack.append(name)
+
+        if not self._error and (handler := self._starts.get(name)):
+            try:
+                handler(attrs)
+            except Exception as e:
+                self._error = str(e)
+
+    def _end_element(self, name):
+        if not self._stack:
+            # The synthetic root
+            return
+
+        self._stack.pop()
+        handler = self._ends.get(name)
 
-        if not line:
+        if handler is None or self._error:
+            self._text.clear()
             return
 
-        if '<Robin>' in line:
-            lines = [line]
-
-            while '</Robin>' not in line:
-                if line := f.readline():
-                    line_no += 1
-                    lines.append(line)
-                else:
-                    return
-            
-            yield (line_no, ''.join(lines))
-
-
-class Context:
-    def __init__(self, output: JsonlinesIO):
-        self.output = output
-
-
-class Converter:
-    class Top:
-        pass
-
-    class Dummy():
-        def __init__(self, parent):
-            self.parent = parent
-
-    class Track:
-        def __init__(self, ctx, parent, attrs):
-            self.ctx = ctx
-            self.parent = parent
-            self.record = {'uid': {'int': attrs['id']}}
-
-        def close(self):
-            self.ctx.output.write(self.record)
-
-    class Timestamp:
-        def __init__(self, ctx, parent, attrs):
-            self.ctx = ctx
-            self.parent = parent
-            self.time = None
-
-        def cdata(self, data):
-            self.time = u.datestring_to_ts(data)
-
-        def close(self):
-            if self.time is None:
-                raise ValueError('Incomplete timestamp record')
-
-            if type(self.parent) is Converter.Track:
-                self.parent.record['time'] = {'unix': self.time}
-
-    class Position:
-        def __init__(self, ctx, parent, attrs):
-            self.ctx = ctx
-            self.parent = parent
-            self.lat = None  # type: float | None
-            self.lon = None  # type: float | None
-            self.alt = None  # type: float | None
-
-        def close(self):
-            if self.lat is None or self.lon is None or self.alt is None:
-                raise ValueError('Incomplete position record')
-
-            if type(self.parent) is Converter.Track:
-                self.parent.record['pos'] = {
-                    'loc': {
-                        'lat': self.lat,
-                        'lon': self.lon,
-                        'alt': self.alt
-                    }
+        text = ''.join(self._text)
+        self._text.clear()
+
+        try:
+            handler(name, text)
+        except Exception as e:
+            self._error = str(e)
+
+    def _parent(self) -> str | None:
+        return self._stack[-1] if self._stack else None
+
+    def _start_track(self, attrs):
+        self._record = {'uid': {'int': attrs['id']}}
+
+    def _end_track(self, name, text):
+        self._write(self._record)
+        self._record = None
+
+    def _end_timestamp(self, name, text):
+        if not text:
+            raise ValueError('Incomplete timestamp record')
+
+        time = self._timestamps.parse(text)
+
+        if self._parent() == 'Track':
+            self._record['time'] = {'unix': time}  # type: ignore
+
+    def _start_position(self, attrs):
+        self._position = {'Latitude': None, 'Longitude': None, 'Altitude': None}
+
+    def _end_position(self, name, text):
+        position = self._position
+
+        if position is None or None in position.values():
+            raise ValueError('Incomplete position record')
+
+        if self._parent() == 'Track':
+            self._record['pos'] = {  # type: ignore
+                'loc': {
+                    'lat': position['Latitude'],
+                    'lon': position['Longitude'],
+                    'alt': position['Altitude']
                 }
+            }
+
+    def _end_coordinate(self, name, text):
+        if not text:
+            raise ValueError(f'Incomplete {name.lower()} record')
+
+        value = float(text)
 
-    class Latitude:
-        def __init__(self, ctx, parent, attrs):
-            self.ctx = ctx
-            self.parent = parent
-            self.lat = None  # type: float | None
+        if self._parent() == 'Position' and self._position is not None:
+            self._position[name] = value
 
-        def cdata(self, data):
-            self.lat = float(data)
 
-        def close(self):
-            if self.lat is None:
-                raise ValueError('Incomplete latitude record')
+def report_error(block_no: int, line_no: int, message: str):
+    lg.warning(f'Error parsing block {block_no} line {line_no}: {message}')
 
-            if type(self.parent) is Converter.Position:
-                self.parent.lat = self.lat
 
-    class Longitude:
-        def __init__(self, ctx, parent, attrs):
-            self.ctx = ctx
-            self.parent = parent
-            self.lon = None
+def parse_blocks(f, write, on_error=report_error) -> int:
+    # Returns the number of blocks
+    parser = RobinParser(write)
+    block_no = 0
 
-        def cdata(self, data):
-            self.lon = float(data)
+    for (line_no, block) in iterate_robin(f):
+        block_no += 1
 
-        def close(self):
-            if self.lon is None:
-                raise ValueError('Incomplete longitude record')
+        try:
+            parser.parse_block(block)
+        except BlockError as e:
+            on_error(block_no, line_no, str(e))
 
-            if type(self.parent) is Converter.Position:
-                self.parent.lon = self.lon
+    return block_no
 
-    class Altitude:
-        def __init__(self, ctx, parent, attrs):
-            self.ctx = ctx
-            self.parent = parent
-            self.alt = None
 
-        def cdata(self, data):
-            self.alt = float(data)
+def plan_ranges(input_path: Path) -> list[tuple[int, int]]:
+    # Byte ranges ending after a block end tag, so that no block is split
+    ranges = []
+    size = input_path.stat().st_size
 
-        def close(self):
-            if self.alt is None:
-                raise ValueError('Incomplete altitude record')
+    with input_path.open('rb') as f:
+        start = 0
 
-            if type(self.parent) is Converter.Position:
-                self.parent.alt = self.alt
+        while start < size:
+            end = min(start + RANGE_SIZE, size)
+            f.seek(end)
 
-    def __init__(self, ctx: Context):
-        self.ctx = ctx
-        self.current = Converter.Top()
+            while end < size:
+                window = f.read(READ_SIZE)
 
-    def start_element(self, name, attrs):
-        Class = getattr(Converter, name, None)
+                if (found := window.find(BLOCK_END)) >= 0:
+                    end += found + len(BLOCK_END)
+                    break
 
-        if Class:
-            element = Class(self.ctx, self.current, attrs)
-        else:
-            element = Converter.Dummy(self.current)
+                # Keep the bytes of a tag which might be split by the window
+                end += max(len(window) - len(BLOCK_END), 1)
+                f.seek(end)
+            else:
+                end = size
 
-        self.current = element
+            ranges.append((start, end))
+            start = end
 
-    def cdata(self, data):
-        if cdata_method := getattr(self.current, 'cdata', None):
-            cdata_method(data)
+    return ranges
 
-    def end_element(self, name):
-        if close_method := getattr(self.current, 'close', None):
-            close_method()
 
-        self.current = self.current.parent  # type: ignore
+class RangeReader:
+    # File-like reading of a byte range, counting its lines
+    def __init__(self, f, start: int, end: int):
+        self._file = f
+        self._remaining = end - start
+        self.lines = 0
+        f.seek(start)
+
+    def read(self, size: int) -> bytes:
+        data = self._file.read(min(size, self._remaining))
+        self._remaining -= len(data)
+        self.lines += data.count(b'\n')
+        return data
+
+
+def parse_range(input_path: Path, start: int, end: int):
+    # In a worker process: records, block count, errors and line count of a byte range
+    records = []
+    errors = []
+
+    with input_path.open('rb') as f:
+        reader = RangeReader(f, start, end)
+        blocks = parse_blocks(reader, records.append, lambda *error: errors.append(error))
+
+        # The rest of the range after the last block
+        while reader.read(READ_SIZE):
+            pass
+
+    return records, blocks, errors, reader.lines
+
+
+def convert_parallel(input_path: Path, output: JsonlinesIO, jobs: int):
+    ranges = plan_ranges(input_path)
+    block_offset = 0
+    line_offset = 0
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(ranges))) as executor:
+        pending = iter(ranges)
+        futures = deque()  # type: deque
+
+        def submit():
+            if (byte_range := next(pending, None)) is not None:
+                futures.append(executor.submit(parse_range, input_path, *byte_range))
+
+        for _ in range(jobs * PIPELINE_DEPTH):
+            submit()
+
+        try:
+            # Results are written in input order, the next range is submitted as one is written
+            while futures:
+                records, blocks, errors, lines = futures.popleft().result()
+                submit()
+
+                for (block_no, line_no, message) in errors:
+                    report_error(block_offset + block_no, line_offset + line_no, message)
+
+                for record in records:
+                    output.write(record)
+
+                block_offset += blocks
+                line_offset += lines
+
+        finally:
+            for future in futures:
+                future.cancel()
 
 
 def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
     metadata.update({'content': 'flightlog', 'source': 'robinradar'})
     output.write(metadata)
-    ctx = Context(output)
-
-    with input_path.open('rt') as f:
-        block_no = 0
+    jobs = params.get('jobs') or 1
 
-        for (line_no, block) in iterate_robin(f):
-            block_no += 1
+    if jobs > 1 and isinstance(input_path, Path) and input_path.stat().st_size > RANGE_SIZE:
+        convert_parallel(input_path, output, jobs)
+        return
 
-            try:
-                parser = ParserCreate()
-                converter = Converter(ctx)
-                parser.StartElementHandler = converter.start_element
-                parser.CharacterDataHandler = converter.cdata
-                parser.EndElementHandler = converter.end_element
-                parser.Parse(block, True)
-
-            except Exception as e:
-                lg.warning(f'Error parsing block {block_no} line {line_no}: {e}')
+    with input_path.open('rb') as f:
+        parse_blocks(f, output.write)
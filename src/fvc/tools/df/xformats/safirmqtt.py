@@ -4,6 +4,7 @@ import traceback
 
 import fvc.tools.util as u
 from fvc.tools.df.util import JsonlinesIO
+from fvc.tools.timestamps import TimestampParser
 
 
 def from_safir_ids(safir_ids):
@@ -30,7 +31,7 @@ def from_safir_ids(safir_ids):
     return ids
 
 
-def from_safir_loc(safir_loc, geoid):
+def parse_safir_loc(safir_loc):
     version = safir_loc.get('version')
     lat = safir_loc.get('latitude')
     lon = safir_loc.get('longitude')
@@ -47,25 +48,36 @@ def from_safir_loc(safir_loc, geoid):
         }
     }
 
-    if amsl is not None:
-        alt = u.amsl_to_ellipsoidal(geoid, lat, lon, amsl)
-        record['loc']['alt'] = alt
-    else:
+    if amsl is None:
         present = 'present' if 'altitudeAMSL' in safir_loc else 'also missing'
         lg.warning(f'No AMSL found in safir location record (geodetic is {present})')
 
+    return record, amsl
+
+
+def from_safir_loc(safir_loc, geoid):
+    record, amsl = parse_safir_loc(safir_loc)
+
+    if amsl is not None:
+        loc = record['loc']
+        loc['alt'] = u.amsl_to_ellipsoidal(geoid, loc['lat'], loc['lon'], amsl)
+
     return record
 
 
-def flightlog_record(record, geoid):
+def parse_flightlog_record(record, timestamps: TimestampParser | None = None, time: int | None = None):
     assert record.get('version') == '1'
     assert 'timestamp' in record
-    time = u.datestring_to_ts(record.get('timestamp', ''))
+
+    if time is None:
+        datestr = record.get('timestamp', '')
+        time = timestamps.parse(datestr) if timestamps else u.datestring_to_ts(datestr)
+
     rec_ids = record.get('identifiers')
     assert rec_ids
     ids = from_safir_ids(rec_ids)
     rec_loc = record.get('location')
-    pos = from_safir_loc(rec_loc, geoid)
+    pos, amsl = parse_safir_loc(rec_loc)
     origin = record.get('origin')
 
     record = {
@@ -75,22 +87,97 @@ def flightlog_record(record, geoid):
         'origin': origin
     }
 
-    return record
+    return record, amsl
+
+
+def flightlog_record(record, geoid, timestamps: TimestampParser | None = None):
+    fl_record, amsl = parse_flightlog_record(record, timestamps)
+
+    if amsl is not None:
+        loc = fl_record['pos']['loc']
+        loc['alt'] = u.amsl_to_ellipsoidal(geoid, loc['lat'], loc['lon'], amsl)
+
+    return fl_record
+
+
+def flightlog_records(records, geoid, timestamps: TimestampParser | None = None):
+    # Same as flightlog_record, with one geoid evaluation and one timestamp parse for all records
+    timestamps = timestamps or TimestampParser()
+    times = timestamps.parse_many([record.get('timestamp', '') for record in records]).tolist()
+    fl_records = []
+    coords = []
+
+    for record, time in zip(records, times):
+        fl_record, amsl = parse_flightlog_record(record, time=time)
+        fl_records.append(fl_record)
+
+        if amsl is not None:
+            loc = fl_record['pos']['loc']
+            coords.append((loc, loc['lat'], loc['lon'], amsl))
+
+    if coords:
+        (locs, lats, lons, amsls) = zip(*coords)
+        alts = u.amsl_to_ellipsoidal_batch(geoid, lats, lons, amsls).tolist()
+
+        for loc, alt in zip(locs, alts):
+            loc['alt'] = alt
+
+    return fl_records
+
+
+class BrokenRecord(Exception):
+    def __init__(self, line_no, error):
+        super().__init__(str(error))
+        self.line_no = line_no
+
+
+def write_records(records, geoid, timestamps: TimestampParser, output: JsonlinesIO, first_line_no: int):
+    # The batch is converted before writing any of it, so a retry does not write records twice
+    try:
+        fl_records = flightlog_records(records, geoid, timestamps)
+
+    except Exception:
+        # Redo the batch record by record to keep the records before the broken one
+        for index, record in enumerate(records):
+            try:
+                fl_record = flightlog_record(record, geoid, timestamps)
+            except Exception as e:
+                raise BrokenRecord(first_line_no + index, e) from e
+
+            output.write(fl_record)
+
+        return
+
+    output.write_many(fl_records)
 
 
 def convert_to_fvc(params, metadata, input_path: Path, output: JsonlinesIO):
     geoid = u.load_geoid(params, metadata)
+    timestamps = TimestampParser()
     metadata.update({'content': 'flightlog', 'source': 'safirmqtt'})
     output.write(metadata)
 
     with JsonlinesIO(input_path, 'r') as input:
+        records = []
+        first_line_no = 1
+
         try:
-            for record in input.iterate():
-                fl_record = flightlog_record(record, geoid)
-                output.write(fl_record)
+            try:
+                for record in input.iterate():
+                    records.append(record)
+
+                    if len(records) >= u.GEOID_BATCH_SIZE:
+                        batch, records = records, []
+                        write_records(batch, geoid, timestamps, output, first_line_no)
+                        first_line_no += len(batch)
+
+            finally:
+                # Records read before an unreadable line are still converted
+                write_records(records, geoid, timestamps, output, first_line_no)
 
         except Exception as e:
             if params['verbose']:
                 traceback.print_exc()
 
-            lg.warning(f'Error processing {input_path}:{input.in_line_no()}: {e}')
+            line_no = e.line_no if isinstance(e, BrokenRecord) else input.in_line_no()
+            lg.warning(f'Error processing {input_path}:{line_no}: {e}')
@@ -3,19 +3,37 @@ import os
 import pandas
 import geopandas
 
-from fvc.tools.df.util import Input, JsonlinesIO, JsonQuery
+from fvc.tools.df.util import Input, JsonlinesIO, JsonQuery, is_columnar
+from fvc.tools.df import columnar
+from fvc.tools.df.simplify import Simplification
 
 
-def fetch_geodata(file_name: str) -> geopandas.GeoDataFrame:
-    input = Input({'cache_dir': os.getenv('FVC_CACHE')}, file_name)
+def fetch_columnar(input_path) -> pandas.DataFrame:
+    metadata = columnar.read_metadata(input_path)
+    assert metadata and metadata['content'] == 'flightlog'
 
+    columns = {
+        'time.unix': 'Time',
+        'uaid.int': 'ID',
+        'pos.loc.lat': 'Latitude',
+        'pos.loc.lon': 'Longitude',
+        'pos.loc.alt': 'Altitude'
+    }
+
+    table = columnar.read_columns(input_path, list(columns.keys()))
+    df = table.rename_columns(list(columns.values())).to_pandas()
+    df['ID'] = df['ID'].fillna('unknown')
+    return df
+
+
+def fetch_jsonlines(input_path) -> pandas.DataFrame:
     qtime = JsonQuery('time.unix')
     quaid = JsonQuery('uaid.int', 'unknown')
     qlat = JsonQuery('pos.loc.lat')
     qlon = JsonQuery('pos.loc.lon')
     qalt = JsonQuery('pos.loc.alt')
 
-    with JsonlinesIO(input.fetch(), 'r') as io:
+    with JsonlinesIO(input_path, 'r') as io:
         metadata = io.read()
         assert metadata and metadata['content'] == 'flightlog'
 
@@ -33,6 +51,30 @@ def fetch_geodata(file_name: str) -> geopandas.GeoDataFrame:
             'Altitude': lists[4]
         })
 
+    return df
+
+
+def simplify_frame(df: pandas.DataFrame, simplifier: Simplification) -> pandas.DataFrame:
+    kept = []
+
+    for _, track in df.groupby('ID', sort=False):
+        points = track[['Time', 'Longitude', 'Latitude', 'Altitude']].to_numpy(dtype='float64', na_value=float('nan'))
+        kept.append(track.index.to_numpy()[simplifier.select(points)])
+
+    return df.loc[sorted(index for indices in kept for index in indices)]
+
+
+def fetch_geodata(file_name: str, simplifier: Simplification | None = None) -> geopandas.GeoDataFrame:
+    input_path = Input({'cache_dir': os.getenv('FVC_CACHE')}, file_name).fetch()
+
+    if is_columnar(input_path):
+        df = fetch_columnar(input_path)
+    else:
+        df = fetch_jsonlines(input_path)
+
+    if simplifier:
+        df = simplify_frame(df, simplifier)
+
     gdf = geopandas.GeoDataFrame(                    # type: ignore
         df,
         geometry=geopandas.points_from_xy(
@@ -0,0 +1,225 @@
+from pathlib import Path
+import hashlib
+import json
+import logging as lg
+import os
+import tempfile
+
+import numpy as np
+from scipy.interpolate import NdBSpline, RectBivariateSpline
+
+
+SIDECAR_SUFFIX = '.fvcgrid'
+SIDECAR_MAGIC = 'fvc.geoid.spline'
+SIDECAR_VERSION = 1
+HEADER_SIZE = 4096
+ALIGNMENT = 64
+
+_geoids = {}  # type: dict[tuple, MappedGeoid]
+
+
+def pgm_fingerprint(pgm_path: Path):
+    stat = pgm_path.stat()
+    return {'name': pgm_path.name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def sidecar_candidates(pgm_path: Path):
+    # Next to the geoid file, or in a temporary directory if that is not writable
+    yield pgm_path.with_name(pgm_path.name + SIDECAR_SUFFIX)
+    temp_dir = Path(tempfile.gettempdir()) / 'fvc-geoid'
+    key = hashlib.sha1(str(pgm_path.resolve()).encode('utf-8')).hexdigest()[:12]
+    yield temp_dir / f'{pgm_path.stem}-{key}{SIDECAR_SUFFIX}'
+
+
+def read_header(sidecar_path: Path):
+    with sidecar_path.open('rb') as f:
+        header = json.loads(f.read(HEADER_SIZE).rstrip(b'\0'))
+
+    if header.get('magic') != SIDECAR_MAGIC or header.get('version') != SIDECAR_VERSION:
+        raise ValueError(f'Not a geoid grid file: {sidecar_path}')
+
+    end = max(offset + 8 * size for (offset, size) in header['arrays'].values())
+
+    if sidecar_path.stat().st_size < end:
+        raise ValueError(f'Truncated geoid grid file: {sidecar_path}')
+
+    return header
+
+
+def parse_degrees(value: str) -> float:
+    # '90N', '0E'
+    sign = -1.0 if value[-1:] in ['S', 'W'] else 1.0
+    return sign * float(value.rstrip('NSEW'))
+
+
+def read_pgm(pgm_path: Path):
+    # A GeographicLib geoid grid: a 16-bit PGM image with 'Offset', 'Scale' and 'Origin'
+    # header comments, rows from the origin latitude (90N) southward, East longitudes
+    attributes = {}
+
+    with pgm_path.open('rb') as f:
+        if f.readline().strip() != b'P5':
+            raise UserWarning(f'Not a PGM geoid file: {pgm_path}')
+
+        while (line := f.readline()) and (line.startswith(b'#') or not line.strip()):
+            (key, _, value) = line.lstrip(b'#').decode('ascii', 'replace').strip().partition(' ')
+            attributes[key] = value.strip()
+
+        try:
+            (nlon, nlat) = map(int, line.split())
+            int(f.readline())
+            (offset, scale) = (float(attributes['Offset']), float(attributes['Scale']))
+            (slat, wlon) = map(parse_degrees, attributes['Origin'].split())
+        except (KeyError, ValueError) as e:
+            raise UserWarning(f'Invalid PGM geoid file {pgm_path}: {e}')
+
+        data = np.fromfile(f, dtype='>u2', count=nlat * nlon)
+
+    if data.size != nlat * nlon:
+        raise UserWarning(f'Truncated PGM geoid file: {pgm_path}')
+
+    # Latitudes ascending (rows flipped), as GeoidPGM builds its grid axes
+    dlat = 180.0 / (1 - nlat)
+    dlon = 360.0 / nlon
+    lats = np.array([slat + dlat * i for i in range(nlat)][::-1])
+    lons = np.array([wlon + dlon * i for i in range(nlon)])
+    heights = np.flipud(offset + data.reshape(nlat, nlon) * scale)
+
+    return lats, lons, dlon, heights
+
+
+def write_sidecar(pgm_path: Path, sidecar_path: Path):
+    lg.info(f'Precompiling geoid model {pgm_path.name}, this is done once')
+    lats, lons, dlon, heights = read_pgm(pgm_path)
+
+    # The spline GeoidPGM fits (cubic, no smoothing, the longitude bound one step past the
+    # last column), so the mapped geoid gives the same heights
+    lon_lo, lon_hi = lons[0], lons[-1] + dlon
+    spline = RectBivariateSpline(lats, lons, heights, bbox=[lats[0], lats[-1], lon_lo, lon_hi], kx=3, ky=3, s=0)
+    (tx, ty) = spline.get_knots()
+    arrays = [np.ascontiguousarray(a, dtype='<f8') for a in (tx, ty, spline.get_coeffs())]
+    (kx, ky) = spline.degrees
+
+    offset = HEADER_SIZE
+    layout = []
+
+    for array in arrays:
+        layout.append([offset, array.size])
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = {
+        'magic': SIDECAR_MAGIC,
+        'version': SIDECAR_VERSION,
+        'pgm': pgm_fingerprint(pgm_path),
+        'degrees': [kx, ky],
+        'arrays': dict(zip(['tx', 'ty', 'c'], layout)),
+        'cropped': False,
+        'lon_of': 0.0,
+        'lat_range': [float(lats[0]), float(lats[-1])],
+        # Earth longitudes, the grid ones being East longitudes
+        'lon_range': [float(lon_lo) - 180.0, float(lon_hi) - 180.0]
+    }
+
+    encoded = json.dumps(header).encode('utf-8')
+
+    if len(encoded) > HEADER_SIZE:
+        raise ValueError('Geoid grid header is too large')
+
+    sidecar_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = sidecar_path.with_name(f'{sidecar_path.name}.{os.getpid()}.tmp')
+
+    with temp_path.open('wb') as f:
+        f.write(encoded.ljust(HEADER_SIZE, b'\0'))
+
+        for array, (array_offset, _) in zip(arrays, layout):
+            f.seek(array_offset)
+            f.write(array.tobytes())
+
+    os.replace(temp_path, sidecar_path)
+    return header
+
+
+def open_sidecar(pgm_path: Path):
+    fingerprint = pgm_fingerprint(pgm_path)
+    candidates = list(sidecar_candidates(pgm_path))
+
+    for sidecar_path in candidates:
+        try:
+            header = read_header(sidecar_path)
+
+            if header['pgm'] == fingerprint:
+                return sidecar_path, header
+
+            lg.debug(f'Geoid grid {sidecar_path} is out of date')
+
+        except (OSError, ValueError):
+            pass
+
+    for sidecar_path in candidates:
+        try:
+            return sidecar_path, write_sidecar(pgm_path, sidecar_path)
+        except OSError as e:
+            lg.debug(f'Unable to write geoid grid {sidecar_path}: {e}')
+
+    raise UserWarning(f'Unable to precompile geoid model {pgm_path}')
+
+
+# Geoid spline coefficients memory-mapped from the sidecar file: no parsing on load
+# and the pages are shared between all processes using the same geoid model
+class MappedGeoid:
+    def __init__(self, sidecar_path: Path, header):
+        self.name = header['pgm']['name']
+        self.sidecar_path = sidecar_path
+        self.cropped = header['cropped']
+        self._lon_of = header['lon_of']
+        self._lat_range = header['lat_range']
+        self._lon_range = header['lon_range']
+
+        def mapped(name):
+            (offset, size) = header['arrays'][name]
+            return np.memmap(sidecar_path, dtype='<f8', mode='r', offset=offset, shape=(size,))
+
+        # The tensor-product B-spline of the knots and coefficients, evaluated as
+        # RectBivariateSpline.ev does (to rounding)
+        (kx, ky) = header['degrees']
+        (tx, ty) = (mapped('tx'), mapped('ty'))
+        c = mapped('c').reshape(tx.size - kx - 1, ty.size - ky - 1)
+        self._spline = NdBSpline((tx, ty), c, (kx, ky))
+
+    def heights(self, lats, lons) -> np.ndarray:
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+
+        if lats.size == 0:
+            return np.empty(lats.shape, dtype=np.float64)
+
+        # As GeoidPGM.outside, the bounds of the grid (or of its crop)
+        (lat_lo, lat_hi) = self._lat_range
+        (lon_lo, lon_hi) = self._lon_range
+
+        if np.any(lats < lat_lo) or np.any(lats > lat_hi) or np.any(lons < lon_lo) or np.any(lons > lon_hi):
+            raise ValueError('Location is outside of the geoid grid')
+
+        # Grid longitudes are East longitudes (or shifted for cropped grids)
+        if self.cropped:
+            lons = lons + self._lon_of
+        else:
+            lons = np.where(lons < 0.0, lons + 360.0, lons)
+
+        return np.asarray(self._spline(np.column_stack((lats.ravel(), lons.ravel()))), dtype=np.float64).reshape(lats.shape)
+
+    def height(self, lat: float, lon: float) -> float:
+        return float(self.heights([lat], [lon])[0])
+
+
+def mapped_geoid(pgm_path: Path) -> MappedGeoid:
+    # One instance per geoid file and version for the process lifetime
+    fingerprint = pgm_fingerprint(pgm_path)
+    key = (str(pgm_path.resolve()), fingerprint['size'], fingerprint['mtime_ns'])
+
+    if key not in _geoids:
+        sidecar_path, header = open_sidecar(pgm_path)
+        lg.debug(f'Mapping geoid grid {sidecar_path}')
+        _geoids[key] = MappedGeoid(sidecar_path, header)
+
+    return _geoids[key]
@@ -0,0 +1,239 @@
+from datetime import datetime, UTC
+import logging as lg
+import re
+
+import numpy as np
+
+from fvc.tools.util import datestring_to_ts
+
+
+# Number of leading values checked against dateutil before a fast path is trusted
+SNIFF_ROWS = 16
+
+EPOCH_PATTERN = re.compile(r'^\s*-?\d+(\.\d+)?\s*$')
+# Fractions of seconds strptime accepts (%f), pandas also parses longer ones
+LONG_FRACTION_PATTERN = r'\.\d{7,}'
+
+# Common layouts not covered by ISO-8601, tried in this order
+STRPTIME_TEMPLATES = [
+    '%Y/%m/%d %H:%M:%S.%f',
+    '%Y/%m/%d %H:%M:%S',
+    '%m/%d/%Y %H:%M:%S.%f',
+    '%m/%d/%Y %H:%M:%S',
+    '%d.%m.%Y %H:%M:%S.%f',
+    '%d.%m.%Y %H:%M:%S',
+    '%Y.%m.%d %H:%M:%S',
+    '%d %b %Y %H:%M:%S',
+    '%a %b %d %H:%M:%S %Y'
+]
+
+
+def datetime_to_ts(dt: datetime) -> int:
+    # Same arithmetic as datestring_to_ts, so both paths give identical values
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+
+    return int(dt.timestamp() * 1000)
+
+
+def parse_iso(datestr: str) -> int:
+    return datetime_to_ts(datetime.fromisoformat(datestr.strip()))
+
+
+def epoch_scale(value: float) -> float:
+    # Seconds, milliseconds, microseconds or nanoseconds, guessed by magnitude
+    magnitude = abs(value)
+
+    if magnitude < 1e11:
+        return 1e3
+    elif magnitude < 1e14:
+        return 1.0
+    elif magnitude < 1e17:
+        return 1e-3
+    else:
+        return 1e-6
+
+
+class EpochLayout:
+    name = 'epoch'
+
+    def __init__(self, sample: str):
+        if not EPOCH_PATTERN.match(sample):
+            raise ValueError(f'Not an epoch number: {sample}')
+
+        self.scale = epoch_scale(float(sample))
+
+    def parse(self, datestr: str) -> int:
+        if not EPOCH_PATTERN.match(datestr):
+            raise ValueError(f'Not an epoch number: {datestr}')
+
+        return int(float(datestr) * self.scale)
+
+    def parse_many(self, datestrs, fallback=None) -> np.ndarray:
+        values = np.asarray(datestrs, dtype=np.float64)
+        return np.trunc(values * self.scale).astype(np.int64)
+
+
+class IsoLayout:
+    name = 'iso8601'
+
+    def __init__(self, sample: str):
+        parse_iso(sample)
+
+    def parse(self, datestr: str) -> int:
+        return parse_iso(datestr)
+
+    def parse_many(self, datestrs, fallback=None) -> np.ndarray:
+        # fromisoformat is implemented in C and faster than pandas for strings with offsets
+        return np.fromiter((parse_iso(s) for s in datestrs), dtype=np.int64, count=len(datestrs))
+
+
+class TemplateLayout:
+    # Day-first dates with a day up to 12 are read month-first by dateutil (e.g. '01.05.2024'
+    # is January 5), such values are rejected so that they are parsed by dateutil
+    def __init__(self, template: str, sample: str):
+        self.template = template
+        self.name = f'strptime:{template}'
+        self.dayfirst = template.index('%d') < template.index('%m') if '%m' in template else False
+        self.parse(sample)
+
+    def parse(self, datestr: str) -> int:
+        dt = datetime.strptime(datestr.strip(), self.template)
+
+        if self.dayfirst and dt.day <= 12 and dt.day != dt.month:
+            raise ValueError(f'Ambiguous day-first date: {datestr}')
+
+        return datetime_to_ts(dt)
+
+    def parse_many(self, datestrs, fallback) -> np.ndarray:
+        # Values parse() would reject are given to 'fallback' one by one
+        import pandas
+
+        series = pandas.Series(datestrs).str.strip()
+        times = pandas.to_datetime(series, format=self.template, utc=True)
+        values = nanoseconds_to_ts(times.dt.as_unit('ns').astype('int64').to_numpy())
+        scalar = np.zeros(len(values), dtype=bool)
+
+        if '%f' in self.template:
+            scalar |= series.str.contains(LONG_FRACTION_PATTERN).to_numpy()
+
+        if self.dayfirst:
+            (day, month) = (times.dt.day.to_numpy(), times.dt.month.to_numpy())
+            scalar |= (day <= 12) & (day != month)
+
+        for i in np.flatnonzero(scalar).tolist():
+            values[i] = fallback(datestrs[i])
+
+        return values
+
+
+def nanoseconds_to_ts(nanoseconds: np.ndarray) -> np.ndarray:
+    # Mirrors int(datetime.timestamp() * 1000): float seconds from whole microseconds
+    seconds = (nanoseconds // 1000) / 1e6
+    return np.trunc(seconds * 1000.0).astype(np.int64)
+
+
+def candidate_layouts(sample: str):
+    for make in [IsoLayout, EpochLayout]:
+        try:
+            yield make(sample)
+        except (ValueError, TypeError):
+            pass
+
+    for template in STRPTIME_TEMPLATES:
+        try:
+            yield TemplateLayout(template, sample)
+        except (ValueError, TypeError):
+            pass
+
+
+def dateutil_ts(datestr: str) -> int | None:
+    try:
+        return datestring_to_ts(datestr)
+    except (ValueError, OverflowError, TypeError):
+        return None
+
+
+class TimestampParser:
+    # Sniffs the layout of the timestamps of one file and parses them on a fast path,
+    # falling back to dateutil for the values which do not match the layout
+    def __init__(self):
+        self.layout = None
+        self.sniffed = 0
+        self.fallbacks = 0
+        self._attempts = 0
+        self._rejected = False
+
+    def _sniff(self, datestr: str):
+        self._attempts += 1
+        expected = dateutil_ts(datestr)
+
+        for layout in candidate_layouts(datestr):
+            try:
+                value = layout.parse(datestr)
+            except (ValueError, OverflowError, TypeError):
+                continue
+
+            # Epoch numbers are not understood by dateutil, anything else must agree with it
+            if value == expected or (expected is None and layout.name == 'epoch'):
+                lg.debug(f'Detected timestamp layout: {layout.name}')
+                return layout
+
+        return None
+
+    def _verify(self, datestr: str, value: int) -> int:
+        self.sniffed += 1
+
+        if self.layout.name == 'epoch' or dateutil_ts(datestr) == value:
+            return value
+
+        # The values do not follow a single layout, use dateutil for the whole file
+        lg.debug(f'Timestamp layout {self.layout.name} rejected by {datestr}')
+        self.layout = None
+        self._rejected = True
+        self.fallbacks += 1
+        return datestring_to_ts(datestr)
+
+    def parse(self, datestr: str) -> int:
+        # A few unparseable values may precede the first good one
+        if self.layout is None and not self._rejected and self._attempts < SNIFF_ROWS:
+            self.layout = self._sniff(datestr)
+
+        if self.layout is not None:
+            try:
+                value = self.layout.parse(datestr)
+
+                if self.sniffed < SNIFF_ROWS:
+                    return self._verify(datestr, value)
+
+                return value
+
+            except (ValueError, OverflowError, TypeError):
+                pass
+
+        self.fallbacks += 1
+        return datestring_to_ts(datestr)
+
+    def parse_many(self, datestrs) -> np.ndarray:
+        datestrs = list(datestrs)
+
+        if not datestrs:
+            return np.empty(0, dtype=np.int64)
+
+        # The scalar path sniffs and verifies the layout on the first values
+        head = [self.parse(s) for s in datestrs[:max(SNIFF_ROWS - self.sniffed, 0)]]
+        tail = datestrs[len(head):]
+
+        if not tail:
+            return np.asarray(head, dtype=np.int64)
+
+        if self.layout is None:
+            return np.asarray(head + [self.parse(s) for s in tail], dtype=np.int64)
+
+        try:
+            values = self.layout.parse_many(tail, self.parse)
+        except (ValueError, OverflowError, TypeError):
+            # Mixed layouts, parse value by value
+            values = np.asarray([self.parse(s) for s in tail], dtype=np.int64)
+
+        return np.concatenate([np.asarray(head, dtype=np.int64), values])
@@ -1,30 +1,57 @@
 import json
 from datetime import UTC
+import importlib
 import logging as lg
 from pathlib import Path
 
-from typing import Any, Dict
-from pygments import highlight
-from pygments.lexers.jsonnet import JsonnetLexer
-from pygments.formatters import TerminalFormatter
-from pygeodesy import dms
-from dateutil import parser as dateparser
-from pygeodesy.geoids import GeoidPGM
+from typing import Any, Dict, Union, TYPE_CHECKING
+import click
+
+# NB: this module is imported by every command, heavier dependencies are imported where used
+if TYPE_CHECKING:
+    import numpy as np
+    from pygeodesy.geoids import GeoidPGM
+    from fvc.tools.geoid import MappedGeoid
 
 
 JSON = Dict[str, Any]
+Geoid = Union['GeoidPGM', 'MappedGeoid']
 JSON_INDENT = 2
+GEOID_BATCH_SIZE = 4096
+
+
+# A group whose commands given as 'module:attribute' are imported when used (or listed by --help)
+class LazyGroup(click.Group):
+    def __init__(self, *args, lazy_commands: dict[str, str] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted({*super().list_commands(ctx), *self.lazy_commands})
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_commands:
+            module_name, name = self.lazy_commands[cmd_name].split(':')
+            return getattr(importlib.import_module(module_name), name)
+
+        return super().get_command(ctx, cmd_name)
 
 
 def json_print(params, data: JSON):
     if not params['no_pprint']:
+        from pygments import highlight
+        from pygments.lexers.jsonnet import JsonnetLexer
+        from pygments.formatters import TerminalFormatter
+
         json_str = json.dumps(data, indent=JSON_INDENT, sort_keys=True)
         print(highlight(json_str, JsonnetLexer(), TerminalFormatter()))
     else:
         print(json.dumps(data))
 
 
-def load_geoid(params, metadata=None) -> GeoidPGM:
+def load_geoid(params, metadata=None) -> Geoid:
+    from fvc.tools.geoid import mapped_geoid
+
     pgm_path = Path(__file__).parent / 'static' / 'egm96-5.pgm'
 
     if egm := params.get('EGM'):
@@ -35,18 +62,60 @@ def load_geoid(params, metadata=None) -> GeoidPGM:
     if metadata:
         metadata.update({'geoid': pgm_path.name})
 
-    geoid = GeoidPGM(pgm_path)
+    if not pgm_path.is_file():
+        raise UserWarning(f'Geoid model not found: {pgm_path}')
+
+    geoid = mapped_geoid(pgm_path)
     return geoid
 
 
-def amsl_to_ellipsoidal(geoid: GeoidPGM, lat: float, lon: float, amsl_height: float) -> float:
+def amsl_to_ellipsoidal(geoid: Geoid, lat: float, lon: float, amsl_height: float) -> float:
     # Initialize the Geoid model using EGM96 with WGS-84 datum
     geoid_height = geoid.height(lat, lon)
     ellipsoidal_height = amsl_height + geoid_height  # type: ignore
     return ellipsoidal_height
 
 
+def ellipsoidal_to_amsl(geoid: Geoid, lat: float, lon: float, ellipsoidal_height: float) -> float:
+    geoid_height = geoid.height(lat, lon)
+    amsl_height = ellipsoidal_height - geoid_height  # type: ignore
+    return amsl_height
+
+
+def geoid_undulations(geoid: Geoid, lats, lons) -> 'np.ndarray':
+    import numpy as np
+    from fvc.tools.geoid import MappedGeoid
+
+    if isinstance(geoid, MappedGeoid):
+        return geoid.heights(lats, lons)
+
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    if lats.size == 0:
+        return np.empty(lats.shape, dtype=np.float64)
+
+    # Checked as GeoidPGM.height does, against the bounds of the grid (or of its crop)
+    if any(geoid.outside(lat, lon) for lat, lon in zip(lats.ravel().tolist(), lons.ravel().tolist())):
+        raise ValueError('Location is outside of the geoid grid')
+
+    heights = geoid.height(lats.ravel().tolist(), lons.ravel().tolist())
+    return np.asarray(heights, dtype=np.float64).reshape(lats.shape)
+
+
+def amsl_to_ellipsoidal_batch(geoid: Geoid, lats, lons, amsl_heights) -> 'np.ndarray':
+    import numpy as np
+    return np.asarray(amsl_heights, dtype=np.float64) + geoid_undulations(geoid, lats, lons)
+
+
+def ellipsoidal_to_amsl_batch(geoid: Geoid, lats, lons, ellipsoidal_heights) -> 'np.ndarray':
+    import numpy as np
+    return np.asarray(ellipsoidal_heights, dtype=np.float64) - geoid_undulations(geoid, lats, lons)
+
+
 def datestring_to_ts(datestr: str) -> int:
+    from dateutil import parser as dateparser
+
     dt = dateparser.parse(datestr)
 
     if dt.tzinfo is None:
@@ -74,6 +143,7 @@ def parse_lat(lat: Any) -> float:
             return sign*(deg + min/60.0)
 
     # Something else
+    from pygeodesy import dms
     return dms.parseDMS(lat)
 
 
@@ -96,8 +166,10 @@ def parse_lon(lon: Any) -> float:
             return sign*(deg + min/60.0)
 
     # Something else
+    from pygeodesy import dms
     return dms.parseDMS(lon)
 
 
 def render_latlon(lat, lon) -> str:
+    from pygeodesy import dms
     return f'{dms.latDMS(lat, dms.F_DMS)} {dms.lonDMS(lon, dms.F_DMS)}'